@@ -0,0 +1,346 @@
+from datetime import date, datetime
+
+import click
+from sqlalchemy import case, desc, event, func, inspect, select
+from sqlalchemy.orm import Session
+from app import db
+from models import User, Product, Order, OrderItem, DailySalesRollup, SellerStats, OrderStatusCount, ProductSales
+from caching import TTLValue, bump_version, get_version
+from upserts import upsert
+
+# Dashboard metrics. Order totals live in small summary tables (daily_sales_rollup
+# for the shop, seller_stats per seller, order_status_counts and product_sales)
+# that are kept current in the same transaction that places an order or changes
+# its status, so dashboards never have to scan order history.
+
+
+ROLLUP_VERSION = 'daily_sales_rollup'
+SELLER_STATS_VERSION = 'seller_stats'
+ORDER_ROLLUPS_VERSION = 'order_rollups'
+
+# Products below this stock level count as low stock on the seller dashboard
+LOW_STOCK_THRESHOLD = 10
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _add_to_rollup(day, **deltas):
+    """Add ``deltas`` to the rollup row for ``day``, creating the row if needed"""
+    upsert(DailySalesRollup.__table__, ['day'], [dict(day=day, **deltas)], increment=True)
+
+
+def _order_day(order):
+    return (order.created_at or datetime.utcnow()).date()
+
+
+def record_order_placed(order, seller_sales=None, product_units=None):
+    """Count a new order in the daily rollup, seller stats, status counts and product sales; call before committing the order.
+
+    ``seller_sales`` is ``{seller_id: (revenue, units)}`` and ``product_units``
+    ``{product_id: units}`` for the order when the caller already knows them;
+    otherwise they are read from the order lines.
+    """
+    _add_to_rollup(_order_day(order), order_count=1, revenue=order.total_amount)
+    _add_seller_sales(order.id, 1, seller_sales)
+    record_status_change(None, order.status)
+    _add_product_sales(order.id, product_units)
+
+
+def record_order_cancelled(order, previous_status, seller_sales=None):
+    """Move a cancelled order's amount out of net revenue for the day it was placed"""
+    _add_to_rollup(_order_day(order), cancelled_count=1, cancelled_revenue=order.total_amount)
+    _add_seller_sales(order.id, -1, seller_sales)
+    record_status_change(previous_status, 'cancelled')
+
+
+def record_status_change(previous_status, status):
+    """Move one order from ``previous_status`` (None for a new order) to ``status`` in the status counts"""
+    deltas = {status: 1}
+    if previous_status is not None:
+        deltas[previous_status] = deltas.get(previous_status, 0) - 1
+    upsert(OrderStatusCount.__table__, ['status'], [
+        {'status': name, 'order_count': delta} for name, delta in sorted(deltas.items()) if delta
+    ], increment=True)
+
+
+def _add_product_sales(order_id, product_units=None):
+    if product_units is None:
+        product_units = dict(db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity)).filter(
+            OrderItem.order_id == order_id
+        ).group_by(OrderItem.product_id))
+    upsert(ProductSales.__table__, ['product_id'], [
+        {'product_id': product_id, 'units_sold': int(units)} for product_id, units in sorted(product_units.items())
+    ], increment=True)
+
+
+def rebuild_order_rollups():
+    """Recompute order_status_counts and product_sales from all orders; returns the number of rows written"""
+    statuses = db.session.query(Order.status, func.count(Order.id)).group_by(Order.status).all()
+    sales = db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity)).join(
+        Product, Product.id == OrderItem.product_id
+    ).group_by(OrderItem.product_id).all()
+
+    db.session.execute(OrderStatusCount.__table__.delete())
+    db.session.execute(ProductSales.__table__.delete())
+    if statuses:
+        db.session.execute(OrderStatusCount.__table__.insert(), [
+            {'status': status, 'order_count': count} for status, count in statuses
+        ])
+    if sales:
+        db.session.execute(ProductSales.__table__.insert(), [
+            {'product_id': product_id, 'units_sold': int(units)} for product_id, units in sales
+        ])
+    bump_version(ORDER_ROLLUPS_VERSION)  # Marks the tables as built
+    db.session.commit()
+    return len(statuses) + len(sales)
+
+
+def rebuild_daily_sales_rollup():
+    """Recompute the whole rollup table from the orders table; returns the number of days written"""
+    cancelled = Order.status == 'cancelled'
+    day = func.date(Order.created_at)
+    rows = select(
+        day,
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.total_amount), 0),
+        func.sum(case((cancelled, 1), else_=0)),
+        func.coalesce(func.sum(case((cancelled, Order.total_amount), else_=0)), 0),
+    ).where(Order.created_at.isnot(None)).group_by(day)
+
+    table = DailySalesRollup.__table__
+    db.session.execute(table.delete())
+    result = db.session.execute(table.insert().from_select(
+        ['day', 'order_count', 'revenue', 'cancelled_count', 'cancelled_revenue'], rows
+    ))
+    bump_version(ROLLUP_VERSION)  # Marks the table as built
+    db.session.commit()
+    return result.rowcount
+
+
+# Seller stats
+
+def _add_seller_sales(order_id, sign, seller_sales=None):
+    """Add (sign=1) or remove (sign=-1) one order's lines from its sellers' stats"""
+    if seller_sales is None:
+        seller_sales = {
+            seller_id: (revenue, units)
+            for seller_id, revenue, units in db.session.query(
+                Product.super_admin_id,
+                func.sum(OrderItem.price * OrderItem.quantity),
+                func.sum(OrderItem.quantity),
+            ).join(Product, Product.id == OrderItem.product_id).filter(
+                OrderItem.order_id == order_id
+            ).group_by(Product.super_admin_id)
+        }
+
+    upsert(SellerStats.__table__, ['seller_id'], [{
+        'seller_id': seller_id,
+        'order_count': sign,
+        'revenue': sign * (revenue or 0),
+        'units_sold': sign * int(units or 0),
+    } for seller_id, (revenue, units) in sorted(seller_sales.items())], increment=True)
+    refresh_seller_inventory(seller_sales)
+
+
+def refresh_seller_inventory(seller_ids, connection=None):
+    """Recount product_count and low_stock_count for the given sellers"""
+    seller_ids = {str(seller_id) for seller_id in seller_ids if seller_id}
+    if not seller_ids:
+        return
+    execute = connection.execute if connection is not None else db.session.execute
+    counts = {seller_id: (0, 0) for seller_id in seller_ids}
+    for seller_id, products, low_stock in execute(
+        select(
+            Product.super_admin_id,
+            func.count(Product.id),
+            func.sum(case((Product.stock < LOW_STOCK_THRESHOLD, 1), else_=0)),
+        ).where(Product.super_admin_id.in_(seller_ids)).group_by(Product.super_admin_id)
+    ):
+        counts[seller_id] = (products, int(low_stock or 0))
+
+    upsert(SellerStats.__table__, ['seller_id'], [
+        {'seller_id': seller_id, 'product_count': products, 'low_stock_count': low_stock}
+        for seller_id, (products, low_stock) in sorted(counts.items())
+    ], connection=connection)
+
+
+def rebuild_seller_stats():
+    """Recompute seller_stats from orders and products; returns the number of sellers written"""
+    sales = db.session.query(
+        Product.super_admin_id,
+        func.count(func.distinct(OrderItem.order_id)),
+        func.coalesce(func.sum(OrderItem.price * OrderItem.quantity), 0),
+        func.coalesce(func.sum(OrderItem.quantity), 0),
+    ).join(OrderItem, OrderItem.product_id == Product.id).join(Order, Order.id == OrderItem.order_id).filter(
+        Order.status != 'cancelled'
+    ).group_by(Product.super_admin_id).all()
+    inventory = db.session.query(
+        Product.super_admin_id,
+        func.count(Product.id),
+        func.sum(case((Product.stock < LOW_STOCK_THRESHOLD, 1), else_=0)),
+    ).group_by(Product.super_admin_id).all()
+
+    rows = {}
+    for seller_id, orders, revenue, units in sales:
+        rows[seller_id] = {'seller_id': seller_id, 'order_count': orders, 'revenue': revenue, 'units_sold': int(units)}
+    for seller_id, products, low_stock in inventory:
+        row = rows.setdefault(seller_id, {'seller_id': seller_id, 'order_count': 0, 'revenue': 0, 'units_sold': 0})
+        row.update(product_count=products, low_stock_count=int(low_stock or 0))
+    for row in rows.values():
+        row.setdefault('product_count', 0)
+        row.setdefault('low_stock_count', 0)
+
+    table = SellerStats.__table__
+    db.session.execute(table.delete())
+    if rows:
+        db.session.execute(table.insert(), list(rows.values()))
+    bump_version(SELLER_STATS_VERSION)  # Marks the table as built
+    db.session.commit()
+    return len(rows)
+
+
+def get_seller_stats(seller_id):
+    """The seller's stats row (an unsaved all-zero row if they have no products yet)"""
+    stats = db.session.get(SellerStats, seller_id)
+    if stats is None:
+        stats = SellerStats(seller_id=seller_id, order_count=0, revenue=0, units_sold=0,
+                            product_count=0, low_stock_count=0)
+    return stats
+
+
+def _refresh_inventory_for_products(session, flush_context):
+    # Product adds, deletes, stock edits and ownership changes move the inventory counts
+    seller_ids = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Product):
+            seller_ids.add(obj.super_admin_id)
+    for obj in session.dirty:
+        if not isinstance(obj, Product):
+            continue
+        state = inspect(obj)
+        for attr in ('stock', 'super_admin_id'):
+            history = state.attrs[attr].history
+            if history.has_changes():
+                seller_ids.update(history.added)
+                seller_ids.update(history.deleted)
+                seller_ids.add(obj.super_admin_id)
+    if seller_ids:
+        refresh_seller_inventory(seller_ids, session.connection())
+
+
+event.listen(Session, 'after_flush', _refresh_inventory_for_products)
+
+
+def month_bucket(column):
+    """'YYYY-MM' for a date column, in the current database's dialect"""
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        return func.to_char(func.date_trunc('month', column), 'YYYY-MM')
+    if dialect in ('mysql', 'mariadb'):
+        return func.date_format(column, '%Y-%m')
+    return func.strftime('%Y-%m', column)
+
+
+def _last_months(count, today=None):
+    """The ``count`` most recent calendar months as (year, month), current month first"""
+    today = today or date.today()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months
+
+
+def _monthly_totals():
+    month = month_bucket(DailySalesRollup.day)
+    return db.session.execute(
+        select(
+            month,
+            func.sum(DailySalesRollup.order_count),
+            func.sum(DailySalesRollup.revenue - DailySalesRollup.cancelled_revenue),
+        ).group_by(month)
+    ).all()
+
+
+def compute_dashboard_metrics(months=6):
+    """All admin dashboard figures as plain, template-ready data (from the summary tables, see ensure_rollups)"""
+    monthly = _monthly_totals()
+
+    revenue_by_month = {key: float(revenue or 0) for key, _, revenue in monthly}
+    monthly_revenue = [{
+        'month': date(year, month, 1).strftime('%B %Y'),
+        'revenue': revenue_by_month.get(f'{year:04d}-{month:02d}', 0.0),
+    } for year, month in _last_months(months)]
+
+    user_counts = dict(db.session.query(User.role, func.count(User.id)).filter(
+        User.role.in_(['customer', 'super_admin'])
+    ).group_by(User.role).all())
+
+    status_counts = db.session.query(OrderStatusCount.status, OrderStatusCount.order_count).filter(
+        OrderStatusCount.order_count > 0
+    ).order_by(OrderStatusCount.status).all()
+
+    top_products = db.session.query(Product.name, ProductSales.units_sold).join(
+        Product, Product.id == ProductSales.product_id
+    ).order_by(desc(ProductSales.units_sold), desc(ProductSales.product_id)).limit(5).all()
+
+    recent_orders = db.session.query(
+        Order.id, Order.total_amount, Order.status, User.name
+    ).outerjoin(User, User.id == Order.customer_id).order_by(desc(Order.created_at)).limit(10).all()
+
+    return {
+        'total_orders': sum(count or 0 for _, count, _ in monthly),
+        'total_revenue': sum(float(revenue or 0) for _, _, revenue in monthly),
+        'total_users': user_counts.get('customer', 0),
+        'total_super_admins': user_counts.get('super_admin', 0),
+        'monthly_revenue': monthly_revenue,
+        'status_counts': [[status, count] for status, count in status_counts],
+        'top_products': [(name, int(total_sold or 0)) for name, total_sold in top_products],
+        'recent_orders': [{
+            'id': order_id,
+            'total_amount': float(total_amount),
+            'status': status,
+            'customer_name': customer_name,
+        } for order_id, total_amount, status, customer_name in recent_orders],
+    }
+
+
+def ensure_rollups():
+    """Backfill the summary tables that were never built (e.g. on a database with older orders); returns their names.
+
+    Part of seed-db, so the full rebuilds run once per deploy and never inside
+    a request; `flask rebuild-sales-rollup` forces them.
+    """
+    built = []
+    for version, rebuild in ((ROLLUP_VERSION, rebuild_daily_sales_rollup),
+                             (SELLER_STATS_VERSION, rebuild_seller_stats),
+                             (ORDER_ROLLUPS_VERSION, rebuild_order_rollups)):
+        if not get_version(version):
+            rebuild()
+            built.append(version)
+    return built
+
+
+dashboard_cache = TTLValue(compute_dashboard_metrics)
+
+
+def get_dashboard_metrics():
+    """Dashboard metrics, recomputed at most every ADMIN_DASHBOARD_CACHE_TTL seconds per worker"""
+    return dashboard_cache.get()
+
+
+def init_analytics(app):
+    dashboard_cache.ttl = app.config['ADMIN_DASHBOARD_CACHE_TTL']
+
+    @app.cli.command('rebuild-sales-rollup')
+    def rebuild_sales_rollup_command():
+        """Recompute the daily_sales_rollup, seller_stats, order_status_counts and product_sales tables from all orders."""
+        days = rebuild_daily_sales_rollup()
+        sellers = rebuild_seller_stats()
+        rows = rebuild_order_rollups()
+        dashboard_cache.clear()
+        click.echo(f"Rebuilt daily_sales_rollup: {days} days; seller_stats: {sellers} sellers; "
+                   f"order_status_counts and product_sales: {rows} rows")
@@ -6,26 +6,23 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-from supabase import create_client, Client
+from replicas import RoutingSession, replica_binds
 import uuid # Import the uuid module
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL=DEBUG for verbose output)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 
-# Initialize Supabase client
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_KEY")
-supabase_client: Client = create_client(supabase_url, supabase_key)
+# The Supabase client is built on first use (see storage.SupabaseClientPool.public_client)
 
 def create_app():
     # Create the app
@@ -35,17 +32,106 @@ def create_app():
     
     # Configure the database
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
+    # Connection pool, per worker process; gunicorn.conf.py sizes it to the worker's thread/greenlet count
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 30)) # Seconds to wait for a free connection
+    app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 300))
+    app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true" # One extra round trip per checkout
+    app.config["DB_STATEMENT_CACHE_SIZE"] = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500)) # Compiled SQL kept per engine
+    app.config["DB_PGBOUNCER"] = os.environ.get("DB_PGBOUNCER", "false").lower() == "true" # Let PgBouncer do the pooling
+    from dbpool import PoolMetrics, bind_options, engine_options
+    pool_metrics = {None: PoolMetrics()}  # Per bind key; None is the primary
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, pool_metrics[None])
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Read replicas for @replica_reads views: comma-separated URLs, bound as "replica0", "replica1", ...
+    app.config["SQLALCHEMY_BINDS"] = bind_options(
+        app.config, replica_binds(os.environ.get("DATABASE_REPLICA_URLS", "")), pool_metrics)
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.environ.get("REPLICA_STICKY_SECONDS", 10)) # Longer than the usual replica lag
+    app.config["REPLICA_RETRY_INTERVAL"] = float(os.environ.get("REPLICA_RETRY_INTERVAL", 30)) # Skip a failed replica this long
     
     # Configure Supabase credentials
     app.config["SUPABASE_URL"] = os.environ.get("SUPABASE_URL")
     app.config["SUPABASE_KEY"] = os.environ.get("SUPABASE_KEY")
     app.config["SUPABASE_PRODUCTS_BUCKET"] = os.environ.get("SUPABASE_PRODUCTS_BUCKET", "product-images") # Default to 'product-images'
 
+    # Product image uploads run on a bounded thread pool (see storage.upload_files)
+    app.config["SUPABASE_UPLOAD_WORKERS"] = int(os.environ.get("SUPABASE_UPLOAD_WORKERS", 4))
+    app.config["SUPABASE_UPLOAD_TIMEOUT"] = float(os.environ.get("SUPABASE_UPLOAD_TIMEOUT", 30))
+    app.config["SUPABASE_UPLOAD_RETRIES"] = int(os.environ.get("SUPABASE_UPLOAD_RETRIES", 2))
+    app.config["SUPABASE_UPLOAD_BACKOFF"] = float(os.environ.get("SUPABASE_UPLOAD_BACKOFF", 0.5))
+    # Authenticated storage clients are pooled per JWT and share one HTTP connection pool
+    app.config["SUPABASE_CLIENT_CACHE_SIZE"] = int(os.environ.get("SUPABASE_CLIENT_CACHE_SIZE", 128))
+    app.config["SUPABASE_HTTP_MAX_CONNECTIONS"] = int(os.environ.get("SUPABASE_HTTP_MAX_CONNECTIONS", 20))
+
+    # Product listing page size (keyset pagination)
+    app.config["PRODUCTS_PER_PAGE"] = int(os.environ.get("PRODUCTS_PER_PAGE", 24))
+    app.config["PRODUCTS_MAX_PER_PAGE"] = int(os.environ.get("PRODUCTS_MAX_PER_PAGE", 96))
+    app.config["SELLER_ORDERS_PER_PAGE"] = int(os.environ.get("SELLER_ORDERS_PER_PAGE", 25))
+
+    # Product search: 'auto' uses Postgres full-text search on Postgres and the in-process index otherwise
+    app.config["SEARCH_BACKEND"] = os.environ.get("SEARCH_BACKEND", "auto")
+    app.config["SEARCH_MAX_RESULTS"] = int(os.environ.get("SEARCH_MAX_RESULTS", 1000))
+    app.config["SEARCH_PG_TRGM"] = os.environ.get("SEARCH_PG_TRGM", "false").lower() == "true"
+
+    # Optional per-request SELECT budget (see queries.select_budget); enforced in testing mode
+    app.config["SQL_SELECT_BUDGET"] = int(os.environ["SQL_SELECT_BUDGET"]) if os.environ.get("SQL_SELECT_BUDGET") else None
+
+    # SQL profiling: per-request query stats, slow-query log and the /admin/queries view
+    app.config["SQL_PROFILER_ENABLED"] = os.environ.get("SQL_PROFILER_ENABLED", "true").lower() == "true"
+    app.config["SQL_SLOW_QUERY_MS"] = float(os.environ.get("SQL_SLOW_QUERY_MS", 100))
+    app.config["SQL_PROFILER_TOP_N"] = int(os.environ.get("SQL_PROFILER_TOP_N", 5))
+    app.config["SQL_PROFILER_WINDOW"] = int(os.environ.get("SQL_PROFILER_WINDOW", 300))
+    app.config["SQL_PROFILER_MAX_STATEMENTS"] = int(os.environ.get("SQL_PROFILER_MAX_STATEMENTS", 500))
+
+    # Process-local caches; versions are re-checked against the database every CACHE_VERSION_CHECK_INTERVAL seconds
+    app.config["CATEGORY_CACHE_TTL"] = int(os.environ.get("CATEGORY_CACHE_TTL", 300))
+    app.config["CACHE_VERSION_CHECK_INTERVAL"] = float(os.environ.get("CACHE_VERSION_CHECK_INTERVAL", 5))
+    app.config["ADMIN_DASHBOARD_CACHE_TTL"] = float(os.environ.get("ADMIN_DASHBOARD_CACHE_TTL", 30))
+
+    # Shared key/value store for the cart and wishlist caches: redis://... reachable from every host (REDIS_URL and
+    # the old CART_STORE_URL are read too). Host-local stores, memory:// or sqlite:///<file> (the default: a private
+    # file in the instance folder), only suit one host and log a warning at startup unless SINGLE_HOST=true
+    app.config["KV_STORE_URL"] = (os.environ.get("KV_STORE_URL") or os.environ.get("REDIS_URL")
+                                  or os.environ.get("CART_STORE_URL"))
+    app.config["SINGLE_HOST"] = os.environ.get("SINGLE_HOST", "false").lower() == "true"
+    # Carts are cached there with write-behind to the cart table every CART_FLUSH_INTERVAL seconds (0: write at once)
+    app.config["CART_FLUSH_INTERVAL"] = float(os.environ.get("CART_FLUSH_INTERVAL", 2))
+    app.config["CART_CACHE_TTL"] = int(os.environ.get("CART_CACHE_TTL", 3600))
+    app.config["WISHLIST_CACHE_TTL"] = int(os.environ.get("WISHLIST_CACHE_TTL", 3600))
+    # Per-worker current_user snapshots, dropped when the user's row changes (see identity)
+    app.config["USER_CACHE_TTL"] = float(os.environ.get("USER_CACHE_TTL", 60))
+    app.config["USER_CACHE_MAX_ENTRIES"] = int(os.environ.get("USER_CACHE_MAX_ENTRIES", 10000))
+
+    # Anonymous catalog pages: ETag revalidation plus a per-process LRU of rendered HTML (0 entries disables it)
+    app.config["PAGE_CACHE_MAX_ENTRIES"] = int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 512))
+    app.config["PAGE_CACHE_MAX_BYTES"] = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    # {% cache %} template fragments (product cards, product detail sections), per process
+    app.config["FRAGMENT_CACHE_MAX_ENTRIES"] = int(os.environ.get("FRAGMENT_CACHE_MAX_ENTRIES", 4096))
+    app.config["FRAGMENT_CACHE_MAX_BYTES"] = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+    # Background jobs (Supabase Auth calls, password rehashes): per-process thread pool with retries
+    app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 2))
+    app.config["JOB_QUEUE_SIZE"] = int(os.environ.get("JOB_QUEUE_SIZE", 1000))
+    app.config["JOB_MAX_ATTEMPTS"] = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+    app.config["JOB_RETRY_BACKOFF"] = float(os.environ.get("JOB_RETRY_BACKOFF", 1.0))
+    app.config["SUPABASE_TICKET_TTL"] = int(os.environ.get("SUPABASE_TICKET_TTL", 300)) # Seconds a finished sign-in waits for pickup
+
+    # Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"; older hashes are upgraded on login
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+
+    # Homepage asset manifest and resized image derivatives, built by `flask build-assets` / `flask build-images`
+    # or the gunicorn master (gunicorn.conf.py); workers only read it. Defaults to <derived folder>/manifest.json
+    app.config["ASSET_MANIFEST_PATH"] = os.environ.get("ASSET_MANIFEST_PATH")
+    app.config["ASSET_MANIFEST_CHECK_INTERVAL"] = float(os.environ.get("ASSET_MANIFEST_CHECK_INTERVAL", 30))
+    app.config["ASSET_DERIVED_FOLDER"] = os.environ.get("ASSET_DERIVED_FOLDER") # Defaults to static/derived
+
+    # Prometheus /metrics: per-worker aggregation, merged across workers through the kv store
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN") # /metrics requires "Authorization: Bearer <token>"; 404 while unset
+    app.config["METRICS_PUBLISH_INTERVAL"] = float(os.environ.get("METRICS_PUBLISH_INTERVAL", 5))
+    app.config["METRICS_WORKER_TTL"] = int(os.environ.get("METRICS_WORKER_TTL", 86400)) # Keep exited workers' counters this long
+
     # Configure upload folder
     # app.config['UPLOAD_FOLDER'] = 'static/uploads'
     # app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -62,62 +148,145 @@ def create_app():
     from auth import auth_bp
     # from api import api_bp # Commented out as api.py not found or not in use
     
+    from metrics import metrics_bp
+    
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
+
+    from storage import init_storage
+    init_storage(app)
+
+    from search import init_search
+    init_search(app)
+
+    from caching import init_caching
+    init_caching(app)
+
+    from assets import init_assets
+    init_assets(app)
+
+    from kvstore import init_kv_store
+    init_kv_store(app)
+
+    from carts import init_carts
+    init_carts(app)
+
+    from wishlists import init_wishlists
+    init_wishlists(app)
+
+    from identity import init_identity
+    init_identity(app)
+
+    from jobs import init_jobs
+    init_jobs(app)
+
+    from auth_jobs import init_auth_jobs
+    init_auth_jobs(app)
+
+    from pagecache import init_page_cache
+    init_page_cache(app)
+
+    from fragments import init_fragment_cache
+    init_fragment_cache(app)
+
+    from analytics import init_analytics
+    init_analytics(app)
+
+    from queries import init_select_budget
+    init_select_budget(app)
+
+    from profiling import init_profiling
+    init_profiling(app)
+
+    from dbpool import init_pool_metrics
+    init_pool_metrics(app, pool_metrics)
+
+    from metrics import init_metrics
+    init_metrics(app)
+
+    from replicas import init_replicas
+    init_replicas(app)
     # from api import api_bp # Commented out as api.py not found or not in use
     # app.register_blueprint(api_bp) # Commented out as api.py not found or not in use
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        from models import User # Import User model inside to avoid circular imports
-        return User.query.get(int(user_id))
+    @app.cli.command('seed-db')
+    def seed_db_command():
+        """Create missing tables and seed default categories and the admin user."""
+        init_db_and_admin(app)
+        logging.info("Database ready; default admin: admin@msrshop.com")
 
     @app.context_processor
     def inject_global_data():
-        from models import Category
-        all_categories = Category.query.all()
+        from caching import get_categories
+        all_categories = get_categories()
         return dict(all_categories=all_categories)
     
     return app # Return the app instance for Gunicorn
 
+def after_fork(app):
+    """Reset state inherited from a preloading parent process (gunicorn post_fork)"""
+    with app.app_context():
+        # Connections opened in the parent must not be shared; close=False leaves them to the parent
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    for metrics in app.extensions['db_pool_metrics'].values():
+        metrics.reset()
+    app.extensions['supabase_pool'].reset_after_fork()
+
+DEFAULT_CATEGORIES = [
+    "Electronics", "Books", "Clothing", "Home & Kitchen", "Beauty & Personal Care",
+    "Sports & Outdoors", "Toys & Games", "Automotive", "Pet Supplies", "Health & Household",
+    "Movies & TV", "Music", "Video Games", "Garden & Outdoor", "Baby Products",
+    "Office Products", "Industrial & Scientific", "Handmade", "Collectibles & Fine Art"
+]
+
 def init_db_and_admin(app):
+    """Create tables and seed default categories and the admin user; safe to run repeatedly.
+
+    Run it once per deploy (`flask --app main seed-db`), not in every worker.
+    """
     with app.app_context():
         # Import models to ensure they are registered
         import models
+        from datetime import datetime
+        from upserts import ensure_unique_index, insert_missing
+        from catalog import fill_null_sort_keys
+        from analytics import ensure_rollups
+        from search import ensure_search_index
+        from passwords import hash_password
         
         # Create tables
         db.create_all()
+
+        # Tables created before the cart/wishlist unique indexes existed get them (and lose duplicates)
+        ensure_unique_index(models.Cart, 'ux_cart_user_product')
+        ensure_unique_index(models.Wishlist, 'ux_wishlist_user_product')
+
+        # Postgres full-text index for product search, also on databases created before it existed
+        ensure_search_index()
+
+        # Rows from before the listing sort keys were NOT NULL would end keyset pagination early
+        fill_null_sort_keys()
+
+        # Dashboard summary tables, backfilled from existing orders the first time
+        ensure_rollups()
         
-        # Add default categories if they don't exist
-        from models import Category
-        default_categories = [
-            "Electronics", "Books", "Clothing", "Home & Kitchen", "Beauty & Personal Care",
-            "Sports & Outdoors", "Toys & Games", "Automotive", "Pet Supplies", "Health & Household",
-            "Movies & TV", "Music", "Video Games", "Garden & Outdoor", "Baby Products",
-            "Office Products", "Industrial & Scientific", "Handmade", "Collectibles & Fine Art"
-        ]
-        for cat_name in default_categories:
-            if not Category.query.filter_by(name=cat_name).first():
-                category = Category(name=cat_name, description=f'{cat_name} products')
-                db.session.add(category)
+        # Default categories and admin user, each in one INSERT ... ON CONFLICT DO NOTHING
+        now = datetime.utcnow()
+        insert_missing(models.Category.__table__, ['name'], [
+            {'name': name, 'description': f'{name} products', 'created_at': now} for name in DEFAULT_CATEGORIES
+        ])
+        insert_missing(models.User.__table__, ['email'], [{
+            'id': str(uuid.uuid4()), # Generate a UUID for the admin user
+            'name': 'System Admin',
+            'email': 'admin@msrshop.com',
+            'password_hash': hash_password('admin123'),
+            'role': 'admin',
+            'created_at': now,
+            'is_active': True,
+        }])
         db.session.commit()
-        
-        # Create default admin user if it doesn't exist
-        from models import User
-        from werkzeug.security import generate_password_hash
-        
-        admin_user = User.query.filter_by(email='admin@msrshop.com').first()
-        if not admin_user:
-            admin_user = User(
-                id=str(uuid.uuid4()), # Generate a UUID for the admin user
-                name='System Admin',
-                email='admin@msrshop.com',
-                password_hash=generate_password_hash('admin123'),
-                role='admin'
-            )
-            db.session.add(admin_user)
-            db.session.commit()
-            logging.info("Default admin user created: admin@msrshop.com / admin123")
 
 if __name__ == '__main__':
     app = create_app()
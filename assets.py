@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import click
+from flask import current_app, url_for
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+SLIDER_DIR = 'Slider'
+CATEGORY_ICON_DIR = 'Cat'
+
+# Width buckets for resized derivatives; a source only gets buckets up to its own width
+DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+
+# Output format -> (file extension, Pillow format, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def normalize_category_name(name):
+    """Key used to match a category to its icon file (e.g. "Home & Kitchen" -> "Home_and_Kitchen")"""
+    return name.replace(' ', '_').replace('&', 'and')
+
+
+def _list_images(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:10]
+
+
+def plan_derivatives(static_folder, path):
+    """Describe the derivatives of one static image, or None if Pillow is unavailable.
+
+    Derivative names carry a hash of the source file, so they can be cached
+    forever and change whenever the source image does.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    source = os.path.join(static_folder, path)
+    with Image.open(source) as image:
+        width = image.width
+    fingerprint = _fingerprint(source)
+
+    widths = [w for w in DERIVATIVE_WIDTHS if w < width] + [min(width, DERIVATIVE_WIDTHS[-1])]
+    stem = os.path.splitext(path)[0]
+    variants = {
+        fmt: [[w, f'{stem}.{fingerprint}.{w}w.{extension}'] for w in widths]
+        for fmt, (extension, _, _) in DERIVATIVE_FORMATS.items()
+    }
+    return {'width': width, 'hash': fingerprint, 'variants': variants}
+
+
+def generate_derivative(source, destination, width, fmt):
+    """Resize ``source`` to ``width`` pixels wide and write it atomically to ``destination``"""
+    from PIL import Image
+
+    _, pil_format, options = DERIVATIVE_FORMATS[fmt]
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        tmp_path = f'{destination}.{os.getpid()}.{threading.get_ident()}.tmp'
+        image.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, destination)
+
+
+def scan_static_assets(static_folder, derivatives=True):
+    """Build the manifest dict by scanning the slider and category icon folders.
+
+    Planning derivatives opens and hashes every image, so it belongs in a
+    build step; ``derivatives=False`` only lists the folders.
+    """
+    slider = [f'{SLIDER_DIR}/{filename}' for filename in _list_images(os.path.join(static_folder, SLIDER_DIR))]
+    category_icons = {
+        normalize_category_name(os.path.splitext(filename)[0]): f'{CATEGORY_ICON_DIR}/{filename}'
+        for filename in _list_images(os.path.join(static_folder, CATEGORY_ICON_DIR))
+    }
+
+    plans = {}
+    for path in slider + list(category_icons.values()) if derivatives else ():
+        plan = plan_derivatives(static_folder, path)
+        if plan is None:
+            break
+        plans[path] = plan
+    return {'slider': slider, 'category_icons': category_icons, 'derivatives': plans}
+
+
+class AssetManifest:
+    """Static asset lookup for the homepage.
+
+    Paths are relative to the static folder. The manifest is built once by
+    ``build()`` (`flask build-assets`, or the gunicorn master before it forks
+    workers) and written to ``manifest_path``; processes only read that JSON
+    file, re-checking its mtime at most every ``check_interval`` seconds so a
+    rebuilt manifest is picked up without a restart. Until it exists, the
+    folders are listed without derivatives and the original images are served.
+    """
+
+    def __init__(self, static_folder, manifest_path=None, check_interval=30, derived_folder=None):
+        self.static_folder = static_folder
+        self.manifest_path = manifest_path
+        self.check_interval = check_interval
+        self.derived_folder = derived_folder or os.path.join(static_folder, 'derived')
+        self._lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+        self._data = {'slider': [], 'category_icons': {}, 'derivatives': {}}
+        self._derivative_index = {}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def load(self):
+        if self.manifest_path and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                data = json.load(f)
+            self._mtime = os.path.getmtime(self.manifest_path)
+        else:
+            data = scan_static_assets(self.static_folder, derivatives=False)
+        self._set_data(data)
+        self._checked_at = time.monotonic()
+        return data
+
+    def build(self):
+        """Rescan the static folders, plan derivatives and write the manifest file"""
+        data = scan_static_assets(self.static_folder)
+        self.save(data)
+        self._set_data(data)
+        return data
+
+    def _set_data(self, data):
+        data.setdefault('derivatives', {})
+        # Reverse lookup: derivative name -> (source path, width, format)
+        index = {}
+        for path, plan in data['derivatives'].items():
+            for fmt, variants in plan['variants'].items():
+                for width, name in variants:
+                    index[name] = (path, width, fmt)
+        self._data = data
+        self._derivative_index = index
+
+    def save(self, data=None):
+        data = data if data is not None else self._data
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self._mtime = os.path.getmtime(self.manifest_path)
+
+    @property
+    def data(self):
+        if self.manifest_path and time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                self._checked_at = time.monotonic()
+                try:
+                    if os.path.getmtime(self.manifest_path) != self._mtime:
+                        self.load()
+                except OSError:
+                    pass
+        return self._data
+
+    @property
+    def version(self):
+        """Changes whenever a rebuilt manifest file is picked up"""
+        self.data  # Re-checks the file's mtime
+        return self._mtime
+
+    def slider_images(self):
+        return self.data['slider']
+
+    def category_icon(self, category_name):
+        return self.data['category_icons'].get(normalize_category_name(category_name))
+
+    def image_sources(self, path, display_width=640):
+        """URLs for one static image, ready for <img src> / <source srcset>.
+
+        Returns a dict with ``src`` (a JPEG near ``display_width``, or the
+        original when no derivatives exist), per-format ``srcset`` strings, and
+        per-format single ``url`` picks for CSS backgrounds.
+        """
+        plan = self.data['derivatives'].get(path)
+        if not plan:
+            original = url_for('static', filename=path)
+            return {'src': original, 'srcset': {}, 'url': {'jpeg': original}}
+
+        srcset, picks = {}, {}
+        for fmt, variants in plan['variants'].items():
+            urls = [(width, url_for('main.image_derivative', filename=name)) for width, name in variants]
+            srcset[fmt] = ', '.join(f'{url} {width}w' for width, url in urls)
+            picks[fmt] = next((url for width, url in urls if width >= display_width), urls[-1][1])
+        return {'src': picks['jpeg'], 'srcset': srcset, 'url': picks}
+
+    def derivative_path(self, name):
+        """Filesystem path of a derivative, generating it on first use; None if unknown"""
+        entry = self._derivative_index.get(name)
+        if entry is None:
+            return None
+        destination = os.path.join(self.derived_folder, name)
+        if not os.path.exists(destination):
+            source, width, fmt = entry
+            with self._generate_lock:
+                if not os.path.exists(destination):
+                    generate_derivative(os.path.join(self.static_folder, source), destination, width, fmt)
+        return destination
+
+    def build_derivatives(self):
+        """Generate every missing derivative listed in the manifest; returns how many were written"""
+        written = 0
+        for name in self._derivative_index:
+            if not os.path.exists(os.path.join(self.derived_folder, name)):
+                self.derivative_path(name)
+                written += 1
+        return written
+
+
+def get_asset_manifest():
+    return current_app.extensions['assets']
+
+
+def init_assets(app):
+    derived_folder = app.config.get('ASSET_DERIVED_FOLDER') or os.path.join(app.static_folder, 'derived')
+    manifest = AssetManifest(
+        app.static_folder,
+        manifest_path=app.config.get('ASSET_MANIFEST_PATH') or os.path.join(derived_folder, 'manifest.json'),
+        check_interval=app.config.get('ASSET_MANIFEST_CHECK_INTERVAL', 30),
+        derived_folder=derived_folder,
+    )
+    manifest.load()
+    app.extensions['assets'] = manifest
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Rescan static/Slider and static/Cat and write the asset manifest."""
+        data = manifest.build()
+        click.echo(f"Wrote {manifest.manifest_path}: {len(data['slider'])} slider images, "
+                   f"{len(data['category_icons'])} category icons, {len(data['derivatives'])} with derivatives")
+
+    @app.cli.command('build-images')
+    def build_images_command():
+        """Generate resized WebP/JPEG derivatives for the slider and category images."""
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise click.ClickException('Pillow is required to build image derivatives (pip install pillow).')
+        manifest.build()
+        written = manifest.build_derivatives()
+        click.echo(f"Generated {written} derivatives in {manifest.derived_folder}")
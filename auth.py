@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, session
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
-from app import db, supabase_client # Import supabase_client
+from app import db
 from models import User
+from passwords import hash_password, check_password
+from auth_jobs import queue_sign_in, queue_sign_up
 import secrets
 import string
 import uuid # Import the uuid module
@@ -21,24 +22,15 @@ def login():
         
         user = User.query.filter_by(email=email, is_active=True).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        if user and check_password(user, password):
             # Sign in with Flask-Login
             login_user(user)
 
-            # Sign in with Supabase Auth
-            try:
-                supabase_response = supabase_client.auth.sign_in_with_password({
-                    "email": email,
-                    "password": password,
-                })
-                if supabase_response.user and supabase_response.session:
-                    session['supabase_jwt'] = supabase_response.session.access_token
-                    flash(f'Welcome back, {user.name}! Supabase session established.', 'success')
-                else:
-                    flash('Supabase login failed, but local login successful.', 'warning')
-            except Exception as e:
-                current_app.logger.error(f"Supabase login error: {e}")
-                flash(f'Supabase login failed: {str(e)}', 'warning')
+            # The Supabase session (needed for uploads) is established in the background
+            if queue_sign_in(email, password):
+                flash(f'Welcome back, {user.name}!', 'success')
+            else:
+                flash(f'Welcome back, {user.name}! Supabase sign-in is busy; log in again before uploading images.', 'warning')
 
             # Redirect based on user role
             if user.role == 'admin':
@@ -105,7 +97,7 @@ def register():
         
         # Set password for the user, whether new or pre-existing super admin
         if user_to_register:
-            user_to_register.password_hash = generate_password_hash(password)
+            user_to_register.password_hash = hash_password(password)
         else:
             # This case should ideally not be reached if validation is correct
             flash('Registration failed due to an unexpected error.', 'error')
@@ -116,23 +108,8 @@ def register():
             db.session.commit()
             flash('Registration successful! Please log in.', 'success')
             
-            # Register user with Supabase Auth as well
-            try:
-                supabase_response = supabase_client.auth.sign_up({
-                    "email": user_to_register.email,
-                    "password": password,
-                    "options": {
-                        "data": {"name": name, "role": user_to_register.role}
-                    }
-                })
-                if supabase_response.user and supabase_response.session:
-                    session['supabase_jwt'] = supabase_response.session.access_token
-                    flash('Registration successful with Supabase! Please log in.', 'success')
-                else:
-                    flash('Local registration successful, but Supabase registration failed.', 'warning')
-            except Exception as e:
-                current_app.logger.error(f"Supabase registration error: {e}")
-                flash(f'Local registration successful, but Supabase registration failed: {str(e)}', 'warning')
+            # Register user with Supabase Auth as well, in the background
+            queue_sign_up(user_to_register.email, password, name, user_to_register.role)
 
             return redirect(url_for('auth.login'))
         except Exception as e:
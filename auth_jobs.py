@@ -0,0 +1,109 @@
+import hashlib
+import secrets
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app, session
+from storage import get_supabase_pool
+from metrics import supabase_call
+from jobs import get_job_queue
+
+# Supabase Auth calls made on behalf of login and registration run as
+# background jobs, so the local login/registration completes immediately.
+# A sign-in job hands the Supabase access token back through the shared
+# key/value store, encrypted with a single-use key that only the user's
+# session holds, under a hash of a random ticket also kept in the session. The
+# store never sees the token or the ticket; the first request that needs the
+# token decrypts it into the session.
+
+TICKET_SESSION_KEY = 'supabase_ticket'
+JWT_SESSION_KEY = 'supabase_jwt'
+
+
+def _ticket_key(ticket):
+    return f'supabase:ticket:{hashlib.sha256(ticket.encode()).hexdigest()}'
+
+
+def queue_sign_in(email, password):
+    """Start a Supabase sign-in for the current session; the token shows up in session_jwt() when done"""
+    ticket = secrets.token_urlsafe(24)
+    key = Fernet.generate_key().decode()
+    session.pop(JWT_SESSION_KEY, None)
+    session[TICKET_SESSION_KEY] = [ticket, key, time.time()]
+    queued = get_job_queue().submit(f'Supabase sign-in for {email}', _sign_in, ticket, key, email, password,
+                                    on_failure=lambda error: _finish_ticket(ticket, failed=1))
+    if not queued:
+        session.pop(TICKET_SESSION_KEY, None)
+    return queued
+
+
+def queue_sign_up(email, password, name, role):
+    return get_job_queue().submit(f'Supabase sign-up for {email}', _sign_up, email, password, name, role)
+
+
+def session_jwt():
+    """(access token or None, True while a queued sign-in has not finished yet)"""
+    jwt = session.get(JWT_SESSION_KEY)
+    if jwt or TICKET_SESSION_KEY not in session:
+        return jwt, False
+
+    ticket = session[TICKET_SESSION_KEY]
+    if len(ticket) != 3:
+        session.pop(TICKET_SESSION_KEY, None)  # Queued before tokens were encrypted; sign in again for one
+        return None, False
+    ticket, key, queued_at = ticket
+    store = current_app.extensions['kv_store']
+    result = store.hgetall(_ticket_key(ticket))
+    if not result:
+        if time.time() - queued_at < current_app.config['SUPABASE_TICKET_TTL']:
+            return None, True
+        session.pop(TICKET_SESSION_KEY, None)  # The worker running the job went away
+        return None, False
+    store.delete(_ticket_key(ticket))
+    session.pop(TICKET_SESSION_KEY, None)
+    if result.get('jwt'):
+        try:
+            jwt = Fernet(key).decrypt(result['jwt']).decode()
+        except InvalidToken:
+            current_app.logger.warning('Discarded a Supabase sign-in result that does not decrypt with the session key')
+            return None, False
+        session[JWT_SESSION_KEY] = jwt
+        return jwt, False
+    return None, False
+
+
+def _finish_ticket(ticket, **result):
+    store = current_app.extensions['kv_store']
+    store.hset(_ticket_key(ticket), mapping=result)
+    store.expire(_ticket_key(ticket), current_app.config['SUPABASE_TICKET_TTL'])
+
+
+def _sign_in(ticket, key, email, password):
+    with supabase_call('sign_in'):
+        response = get_supabase_pool().public_client().auth.sign_in_with_password({"email": email, "password": password})
+    if response.user and response.session:
+        _finish_ticket(ticket, jwt=Fernet(key).encrypt(response.session.access_token.encode()).decode())
+    else:
+        current_app.logger.warning(f"Supabase sign-in for {email} returned no session")
+        _finish_ticket(ticket, failed=1)
+
+
+def _sign_up(email, password, name, role):
+    with supabase_call('sign_up'):
+        response = get_supabase_pool().public_client().auth.sign_up({
+            "email": email,
+            "password": password,
+            "options": {"data": {"name": name, "role": role}},
+        })
+    if not response.user:
+        current_app.logger.warning(f"Supabase sign-up for {email} returned no user")
+
+
+def _collect_finished_sign_in():
+    # Move the token into the session on the first request after the job finishes
+    if TICKET_SESSION_KEY in session:
+        session_jwt()
+
+
+def init_auth_jobs(app):
+    app.before_request(_collect_finished_sign_in)
@@ -0,0 +1,147 @@
+"""Database round trips per checkout and cancellation, before and after the checkout service.
+
+"legacy" replays the old place_order/cancel_order route bodies (one OrderItem
+add and stock update per line, one Product lookup per line on cancel);
+"service" uses checkout.create_order / checkout.cancel_order. Each statement
+sent to the database (an executemany counts once) is one round trip.
+
+    python benchmarks/checkout_roundtrips.py
+    DATABASE_URL=postgresql://... python benchmarks/checkout_roundtrips.py --sizes 1 10 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100], help='cart sizes (lines) to measure')
+parser.add_argument('--repeat', type=int, default=5, help='orders per cart size and path')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'checkout_roundtrips.db')}"
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+os.environ.setdefault('SQL_PROFILER_ENABLED', 'false')
+
+from sqlalchemy import event
+from app import create_app, db
+from models import User, Category, Product, Order, OrderItem, Cart, Payment
+from carts import get_cart_service
+from checkout import create_order, cancel_order
+
+app = create_app()
+statements = [0]
+
+
+def _count(conn, cursor, statement, parameters, context, executemany):
+    statements[0] += 1
+
+
+def seed(max_lines):
+    db.create_all()
+    seller = User(id=str(uuid.uuid4()), name='Bench Seller', email=f'{uuid.uuid4().hex}@bench.test',
+                  password_hash='-', role='super_admin')
+    customer = User(id=str(uuid.uuid4()), name='Bench Customer', email=f'{uuid.uuid4().hex}@bench.test',
+                    password_hash='-', role='customer')
+    category = Category(name=f'Bench {uuid.uuid4().hex[:8]}')
+    db.session.add_all([seller, customer, category])
+    db.session.flush()
+    products = [Product(name=f'Bench product {i}', price=1, stock=10 ** 6,
+                        category_id=category.id, super_admin_id=seller.id) for i in range(max_lines)]
+    db.session.add_all(products)
+    db.session.commit()
+    return customer.id, [product.id for product in products]
+
+
+def fill_cart(customer_id, product_ids):
+    db.session.execute(Cart.__table__.insert(), [
+        {'user_id': customer_id, 'product_id': product_id, 'quantity': 1, 'created_at': datetime.utcnow()}
+        for product_id in product_ids
+    ])
+    db.session.commit()
+
+
+def legacy_place(customer_id, cart_items):
+    total = sum(item.product.price * item.quantity for item in cart_items)
+    order = Order(customer_id=customer_id, total_amount=total, payment_method='cod',
+                  shipping_address='Bench street', phone='1')
+    db.session.add(order)
+    db.session.flush()
+    for cart_item in cart_items:
+        db.session.add(OrderItem(order_id=order.id, product_id=cart_item.product.id,
+                                 quantity=cart_item.quantity, price=cart_item.product.price))
+        cart_item.product.stock -= cart_item.quantity
+    db.session.add(Payment(order_id=order.id, payment_method='cod', payment_status='pending', amount=total))
+    Cart.query.filter_by(user_id=customer_id).delete()
+    db.session.commit()
+    return order.id
+
+
+def legacy_cancel(order_id):
+    order = db.session.get(Order, order_id)
+    order.status = 'cancelled'
+    for item in order.order_items:
+        product = db.session.get(Product, item.product_id)
+        if product:
+            product.stock += item.quantity
+    db.session.commit()
+
+
+def service_place(customer_id, cart_items):
+    order = create_order(customer_id, cart_items, 'Bench street', '1', 'cod')
+    db.session.commit()
+    return order.id
+
+
+def service_cancel(order_id):
+    cancel_order(db.session.get(Order, order_id))
+    db.session.commit()
+
+
+def measure(place, cancel, customer_id, product_ids):
+    place_counts, cancel_counts, place_ms = [], [], []
+    for _ in range(args.repeat):
+        fill_cart(customer_id, product_ids)
+        db.session.expunge_all()
+        cart_items = get_cart_service().lines(customer_id, cached=False)
+
+        statements[0] = 0
+        start = time.perf_counter()
+        order_id = place(customer_id, cart_items)
+        place_ms.append((time.perf_counter() - start) * 1000)
+        place_counts.append(statements[0])
+
+        db.session.expunge_all()
+        statements[0] = 0
+        cancel(order_id)
+        cancel_counts.append(statements[0])
+        db.session.expunge_all()
+    return max(place_counts), max(cancel_counts), sorted(place_ms)[len(place_ms) // 2]
+
+
+def main():
+    with app.app_context():
+        customer_id, product_ids = seed(max(args.sizes))
+        event.listen(db.engine, 'before_cursor_execute', _count)
+        # Build the summary tables up front, as seed-db does, so their one-off backfill is not measured
+        from analytics import ensure_rollups
+        ensure_rollups()
+        db.session.commit()
+
+        print(f"{app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]}: round trips per order (median place time)")
+        print(f"{'lines':>6} {'path':>8} {'place':>6} {'cancel':>7} {'place ms':>9}")
+        for size in args.sizes:
+            for name, place, cancel in (('legacy', legacy_place, legacy_cancel),
+                                        ('service', service_place, service_cancel)):
+                place_count, cancel_count, median_ms = measure(place, cancel, customer_id, product_ids[:size])
+                print(f"{size:>6} {name:>8} {place_count:>6} {cancel_count:>7} {median_ms:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Concurrent checkout stress test for inventory.reserve_stock.
+
+Many threads check out the same few products at once; afterwards stock must
+never be negative and units sold plus units left must equal the starting
+stock. Runs against DATABASE_URL, or a throwaway SQLite file when unset:
+
+    python benchmarks/checkout_stress.py --workers 16 --checkouts 200
+    DATABASE_URL=postgresql://... python benchmarks/checkout_stress.py
+
+Pass --naive to run the old read-modify-write (`stock -= quantity`) path for
+comparison; it typically oversells.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--workers', type=int, default=16)
+parser.add_argument('--checkouts', type=int, default=200, help='checkouts per worker')
+parser.add_argument('--products', type=int, default=3)
+parser.add_argument('--stock', type=int, default=500, help='starting stock per product')
+parser.add_argument('--max-quantity', type=int, default=3)
+parser.add_argument('--naive', action='store_true', help='use unlocked read-modify-write instead of reserve_stock')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'checkout_stress.db')}"
+os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+os.environ.setdefault('SUPABASE_KEY', 'stress-test')
+os.environ.setdefault('SQL_PROFILER_ENABLED', 'false')
+
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from models import User, Category, Product
+from inventory import reserve_stock, InsufficientStock
+
+app = create_app()
+
+
+def seed():
+    with app.app_context():
+        db.create_all()
+        seller = User(id=str(uuid.uuid4()), name='Stress Seller', email=f'{uuid.uuid4().hex}@stress.test',
+                      password_hash='-', role='super_admin')
+        category = Category(name=f'Stress {uuid.uuid4().hex[:8]}')
+        db.session.add_all([seller, category])
+        db.session.flush()
+        products = [Product(name=f'Stress product {i}', price=1, stock=args.stock,
+                            category_id=category.id, super_admin_id=seller.id) for i in range(args.products)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+
+def naive_checkout(quantities):
+    # The pre-reservation behaviour: read stock, subtract in Python, write it back
+    for product_id, quantity in quantities.items():
+        product = db.session.get(Product, product_id)
+        if product.stock < quantity:
+            raise InsufficientStock([])
+        product.stock -= quantity
+
+
+def worker(product_ids, sold, stats, lock):
+    rng = random.Random()
+    with app.app_context():
+        for _ in range(args.checkouts):
+            lines = rng.sample(product_ids, rng.randint(1, len(product_ids)))
+            quantities = {product_id: rng.randint(1, args.max_quantity) for product_id in lines}
+            while True:
+                try:
+                    if args.naive:
+                        naive_checkout(quantities)
+                    else:
+                        reserve_stock(quantities)
+                    db.session.commit()
+                    outcome = 'ok'
+                except InsufficientStock:
+                    db.session.rollback()
+                    outcome = 'short'
+                except OperationalError:
+                    # SQLite "database is locked" / Postgres serialization hiccups: retry the checkout
+                    db.session.rollback()
+                    with lock:
+                        stats['retries'] += 1
+                    continue
+                break
+            with lock:
+                stats[outcome] += 1
+                if outcome == 'ok':
+                    for product_id, quantity in quantities.items():
+                        sold[product_id] += quantity
+        db.session.remove()
+
+
+def main():
+    product_ids = seed()
+    sold = {product_id: 0 for product_id in product_ids}
+    stats = {'ok': 0, 'short': 0, 'retries': 0}
+    lock = threading.Lock()
+
+    threads = [threading.Thread(target=worker, args=(product_ids, sold, stats, lock)) for _ in range(args.workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        remaining = dict(db.session.query(Product.id, Product.stock).filter(Product.id.in_(product_ids)))
+
+    total = args.workers * args.checkouts
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]}, "
+          f"{'naive' if args.naive else 'reserve_stock'}: {total} checkouts in {elapsed:.2f}s "
+          f"({total / elapsed:.0f}/s), {stats['ok']} placed, {stats['short']} rejected, {stats['retries']} retries")
+
+    failures = 0
+    for product_id in product_ids:
+        consistent = remaining[product_id] >= 0 and sold[product_id] + remaining[product_id] == args.stock
+        failures += not consistent
+        print(f"  product {product_id}: sold {sold[product_id]}, left {remaining[product_id]}"
+              f"{'' if consistent else '  <-- OVERSOLD / LOST UPDATE'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
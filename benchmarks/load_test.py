@@ -0,0 +1,181 @@
+"""Throughput of the gunicorn worker modes (sync / gthread / gevent) on the catalog routes.
+
+Starts gunicorn with gunicorn.conf.py once per mode, drives it with
+--concurrency keep-alive clients for --duration seconds, and prints requests
+per second with p50/p95 latency. Uses DATABASE_URL, or a throwaway SQLite
+database seeded with --products products when unset. Requires gunicorn (and
+gevent + psycogreen for the gevent mode; modes whose worker class cannot be
+imported are skipped). The gevent mode also needs KV_STORE_URL=redis://...
+(see gunicorn.conf.py) and is skipped without it.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --modes gthread gevent --concurrency 64 --duration 20
+    python benchmarks/load_test.py --no-page-cache   # measure rendering, not the anonymous HTML cache
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKER_MODULES = {'sync': 'gunicorn', 'gthread': 'gunicorn', 'gevent': 'gevent'}
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--modes', nargs='+', default=['sync', 'gthread', 'gevent'], choices=sorted(WORKER_MODULES))
+parser.add_argument('--duration', type=float, default=10, help='seconds of load per mode')
+parser.add_argument('--concurrency', type=int, default=32, help='simultaneous clients')
+parser.add_argument('--workers', type=int, help='WEB_CONCURRENCY for every mode (default: gunicorn.conf.py sizing)')
+parser.add_argument('--products', type=int, default=500, help='products to seed into a throwaway database')
+parser.add_argument('--no-page-cache', action='store_true', help='disable the anonymous page LRU (PAGE_CACHE_MAX_ENTRIES=0)')
+args = None  # Parsed in __main__ only, so importing this module (e.g. pytest collecting *_test.py) has no side effects
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def base_env():
+    env = dict(os.environ)
+    if not env.get('DATABASE_URL'):
+        env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}"
+    env.setdefault('SESSION_SECRET', 'load-test')
+    env.setdefault('SUPABASE_URL', 'http://localhost:9')
+    env.setdefault('SUPABASE_KEY', 'load-test')
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    env.setdefault('SQL_PROFILER_ENABLED', 'false')
+    env.setdefault('SINGLE_HOST', 'true')  # One host; set KV_STORE_URL=redis://... to use Redis instead
+    env['KV_STORE_URL'] = env.get('KV_STORE_URL') or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cache.sqlite3')}"
+    if args.no_page_cache:
+        env['PAGE_CACHE_MAX_ENTRIES'] = '0'
+    if args.workers:
+        env['WEB_CONCURRENCY'] = str(args.workers)
+    return env
+
+
+SEED = '''
+import sys, uuid
+from main import app
+from app import db, init_db_and_admin
+from models import User, Category, Product
+init_db_and_admin(app)
+with app.app_context():
+    if Product.query.count() < {products}:
+        seller = User(id=str(uuid.uuid4()), name='Load Seller', email=f'{{uuid.uuid4().hex}}@load.test',
+                      password_hash='-', role='super_admin', is_active=True)
+        db.session.add(seller)
+        categories = [category.id for category in Category.query.all()]
+        db.session.add_all([Product(name=f'Load product {{i}} phone', description='A sturdy test gadget', price=10 + i % 90,
+                                    stock=100, category_id=categories[i % len(categories)], super_admin_id=seller.id,
+                                    sales_count=i % 50) for i in range({products})])
+        db.session.commit()
+    print(','.join(str(product_id) for (product_id,) in db.session.query(Product.id).limit(200)))
+'''
+
+
+def seed(env):
+    output = subprocess.run([sys.executable, '-c', SEED.format(products=args.products)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return [int(product_id) for product_id in output.stdout.strip().splitlines()[-1].split(',')]
+
+
+def routes(product_ids):
+    return ['/', '/products', '/products?sort=price_asc', '/products?search=phone'] + \
+        [f'/product/{product_id}' for product_id in product_ids[:50]]
+
+
+def wait_until_up(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/products')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def drive(port, paths):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    def client():
+        rng = random.Random()
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', rng.choice(paths))
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise OSError(response.status)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def run_mode(mode, env, paths):
+    port = free_port()
+    env = dict(env, GUNICORN_WORKER_CLASS=mode, GUNICORN_BIND=f'127.0.0.1:{port}')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'main:app'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port, process)
+        latencies, errors = drive(port, paths)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    if not latencies:
+        return f"{mode:<8} no successful requests ({errors} errors)"
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    return f"{mode:<8} {len(latencies) / args.duration:>9.1f} {p50:>8.1f} {p95:>8.1f} {errors:>7}"
+
+
+def main():
+    env = base_env()
+    paths = routes(seed(env))
+    print(f"{len(paths)} routes, {args.concurrency} clients, {args.duration:.0f}s per mode"
+          f"{', page cache off' if args.no_page_cache else ''}")
+    print(f"{'mode':<8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        if importlib.util.find_spec(WORKER_MODULES[mode]) is None:
+            print(f"{mode:<8} skipped: {WORKER_MODULES[mode]} is not installed")
+            continue
+        if mode == 'gevent' and not env['KV_STORE_URL'].startswith(('redis:', 'rediss:', 'unix:')):
+            print(f"{mode:<8} skipped: needs KV_STORE_URL=redis://...")
+            continue
+        print(run_mode(mode, env, paths))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main()
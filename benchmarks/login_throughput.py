@@ -0,0 +1,97 @@
+"""Logins per second in one worker process, per password hash method.
+
+Posts to /login through the app's test client (no HTTP server), so the
+number is the worker's own ceiling: user lookup, password check and session
+handling. The Supabase sign-in runs as a background job and is not waited
+for. Runs against DATABASE_URL, or a throwaway SQLite file when unset:
+
+    python benchmarks/login_throughput.py
+    python benchmarks/login_throughput.py --methods scrypt pbkdf2:sha256:600000 pbkdf2:sha256:100000 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--methods', nargs='+', default=['scrypt', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:100000'],
+                    help='werkzeug hash methods to compare (PASSWORD_HASH_METHOD values)')
+parser.add_argument('--logins', type=int, default=100, help='logins per method')
+parser.add_argument('--users', type=int, default=20)
+parser.add_argument('--threads', type=int, default=1, help='concurrent requests inside the worker (threaded server)')
+args = parser.parse_args()
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'login_throughput.db')}"
+os.environ.setdefault('SESSION_SECRET', 'benchmark')
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:9')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+os.environ.setdefault('SQL_PROFILER_ENABLED', 'false')
+os.environ.setdefault('JOB_MAX_ATTEMPTS', '1')
+
+from app import create_app, db
+from models import User
+from passwords import hash_password
+
+app = create_app()
+app.logger.disabled = True
+PASSWORD = 'benchmark-password'
+
+
+def seed(method):
+    app.config['PASSWORD_HASH_METHOD'] = method
+    emails = [f'{uuid.uuid4().hex}@bench.test' for _ in range(args.users)]
+    with app.app_context():
+        db.create_all()
+        password_hash = hash_password(PASSWORD)
+        db.session.add_all([User(id=str(uuid.uuid4()), name='Bench', email=email, password_hash=password_hash,
+                                 role='customer', is_active=True) for email in emails])
+        db.session.commit()
+    return emails
+
+
+def run(emails):
+    errors = []
+    counter = iter(range(args.logins))
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            response = client.post('/login', data={'email': emails[i % len(emails)], 'password': PASSWORD})
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+def main():
+    print(f"{'method':<28} {'logins/s':>9} {'ms/login':>9}")
+    for method in args.methods:
+        emails = seed(method)
+        elapsed, errors = run(emails)
+        if errors:
+            print(f"{method:<28} failed: {len(errors)} logins did not redirect")
+            continue
+        print(f"{method:<28} {args.logins / elapsed:>9.1f} {elapsed / args.logins * 1000 * args.threads:>9.1f}")
+    with app.app_context():
+        app.extensions['jobs'].join(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Where SELECTs go with read replicas configured: routing, read-your-writes stickiness and failover.
+
+By default this builds a primary SQLite file, copies it to act as a replica
+(a frozen snapshot, i.e. a replica with unbounded lag) and adds a second
+replica URL that cannot be opened, so the health check has something to
+skip. With --primary/--replicas it runs against real databases instead,
+e.g. two Postgres instances with streaming replication:
+
+    python benchmarks/replica_routing.py
+    python benchmarks/replica_routing.py --primary postgresql://.../shop --replicas postgresql://replica1/shop
+
+Prints SELECTs per database for each step and exits 1 when a step reads
+from the wrong place.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--primary', help='primary database URL (default: a throwaway SQLite file)')
+parser.add_argument('--replicas', help='comma-separated replica URLs (default: a copy of the SQLite primary plus a dead URL)')
+parser.add_argument('--sticky', type=float, default=2, help='REPLICA_STICKY_SECONDS for the run')
+parser.add_argument('--requests', type=int, default=20, help='catalog requests per step')
+args = parser.parse_args()
+
+tmp = tempfile.mkdtemp()
+primary_url = args.primary or f"sqlite:///{os.path.join(tmp, 'primary.db')}"
+os.environ['DATABASE_URL'] = primary_url
+os.environ.setdefault('SESSION_SECRET', 'benchmark')
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:9')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ['SINGLE_HOST'] = 'true'
+os.environ['KV_STORE_URL'] = f"sqlite:///{os.path.join(tmp, 'cache.sqlite3')}"
+os.environ['PAGE_CACHE_MAX_ENTRIES'] = '0'  # Every request renders, so every request reads
+os.environ['REPLICA_STICKY_SECONDS'] = str(args.sticky)
+os.environ['JOB_MAX_ATTEMPTS'] = '1'
+
+
+def seed():
+    from app import create_app, db, init_db_and_admin
+    from models import User, Category, Product
+    from passwords import hash_password
+    app = create_app()
+    init_db_and_admin(app)
+    with app.app_context():
+        seller = User(id=str(uuid.uuid4()), name='Seller', email=f'{uuid.uuid4().hex}@replica.test',
+                      password_hash='-', role='super_admin', is_active=True)
+        customer = User(id=str(uuid.uuid4()), name='Customer', email=f'{uuid.uuid4().hex}@replica.test',
+                        password_hash=hash_password('replica-test'), role='customer', is_active=True)
+        db.session.add_all([seller, customer])
+        category_id = Category.query.first().id
+        db.session.add_all([Product(name=f'Replica product {i}', description='A replica test product', price=10 + i,
+                                    stock=10, category_id=category_id, super_admin_id=seller.id) for i in range(30)])
+        db.session.commit()
+        return customer.email, [product.id for product in Product.query.limit(5)]
+
+
+email, product_ids = seed()
+if args.replicas:
+    os.environ['DATABASE_REPLICA_URLS'] = args.replicas
+else:
+    shutil.copy(os.path.join(tmp, 'primary.db'), os.path.join(tmp, 'replica.db'))
+    os.environ['DATABASE_REPLICA_URLS'] = (f"sqlite:///{os.path.join(tmp, 'replica.db')},"
+                                           f"sqlite:///{os.path.join(tmp, 'missing', 'replica.db')}")
+
+from sqlalchemy import event
+from app import create_app, db
+
+app = create_app()
+app.logger.disabled = True
+counts = {}
+with app.app_context():
+    for key, engine in db.engines.items():
+        name = key or 'primary'
+
+        def count_select(conn, cursor, statement, parameters, context, executemany, name=name):
+            if statement.lstrip()[:6].upper() in ('SELECT', 'WITH'):
+                counts[name] = counts.get(name, 0) + 1
+
+        event.listen(engine, 'before_cursor_execute', count_select)
+
+
+def step(title, client, paths, expect):
+    counts.clear()
+    errors = 0
+    for i in range(args.requests):
+        if client.get(paths[i % len(paths)]).status_code != 200:
+            errors += 1
+    replica_reads = sum(count for name, count in counts.items() if name != 'primary')
+    ok = not errors and (replica_reads > 0 if expect == 'replica' else replica_reads == 0)
+    row = '  '.join(f"{name}={count}" for name, count in sorted(counts.items()))
+    print(f"{'ok  ' if ok else 'FAIL'} {title:<44} {row}  errors={errors}")
+    return ok
+
+
+def main():
+    catalog = ['/', '/products', '/products?sort=price_asc'] + [f'/product/{product_id}' for product_id in product_ids]
+    app.test_client().get('/products')  # This process first sees the catalog version now...
+    time.sleep(args.sticky + 1)  # ...and lets that change age out
+    results = []
+
+    anon = app.test_client()
+    results.append(step('anonymous catalog reads go to replicas', anon, catalog, 'replica'))
+
+    customer = app.test_client()
+    if customer.post('/login', data={'email': email, 'password': 'replica-test'}).status_code != 302:
+        print('FAIL could not log in')
+        sys.exit(1)
+    customer.get(f'/add-to-wishlist/{product_ids[0]}')
+    results.append(step('right after a write: primary (sticky)', customer, catalog, 'primary'))
+    time.sleep(args.sticky + 0.5)
+    results.append(step(f'{args.sticky:.0f}s later: replicas again', customer, catalog, 'replica'))
+
+    with app.app_context():
+        for replica in app.extensions['replicas'].status():
+            print(f"     {replica['url']}: {'healthy' if replica['healthy'] else 'down'}")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Worker cold start: time to import main (build the app) and database round trips made while doing it.
+
+Each run is a fresh interpreter, as with a new gunicorn worker. By default
+workers must boot with zero database round trips and within --target-ms
+(median); the script exits 1 otherwise. --seed boots with SEED_ON_STARTUP=1
+for comparison with seeding in every worker.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --seed
+    DATABASE_URL=postgresql://... python benchmarks/startup.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--runs', type=int, default=5)
+parser.add_argument('--seed', action='store_true', help='boot with SEED_ON_STARTUP=1 (seeding in every worker)')
+parser.add_argument('--target-ms', type=float, default=1500, help='fail when the median boot takes longer')
+args = parser.parse_args()
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+counts = {'connections': 0, 'statements': 0}
+event.listen(Pool, 'connect', lambda *a: counts.__setitem__('connections', counts['connections'] + 1))
+event.listen(Engine, 'before_cursor_execute', lambda *a: counts.__setitem__('statements', counts['statements'] + 1))
+import main
+counts['ms'] = (time.perf_counter() - start) * 1000
+counts['supabase_imported'] = 'supabase' in sys.modules
+print(json.dumps(counts))
+'''
+
+
+def boot(env):
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    env = dict(os.environ)
+    if not env.get('DATABASE_URL'):
+        env['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    env.setdefault('SESSION_SECRET', 'benchmark')
+    env.setdefault('SUPABASE_URL', 'http://localhost:9')
+    env.setdefault('SUPABASE_KEY', 'benchmark')
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    env['SEED_ON_STARTUP'] = '1' if args.seed else ''
+
+    boot(env)  # Warm the bytecode cache so runs measure startup, not compilation
+    runs = [boot(env) for _ in range(args.runs)]
+    times = sorted(run['ms'] for run in runs)
+    median = times[len(times) // 2]
+    round_trips = max(run['statements'] for run in runs)
+    connections = max(run['connections'] for run in runs)
+
+    print(f"{'seeding' if args.seed else 'lazy'} boot over {args.runs} runs: median {median:.0f} ms "
+          f"(min {times[0]:.0f}, max {times[-1]:.0f}), {connections} DB connections, {round_trips} statements, "
+          f"supabase imported: {runs[0]['supabase_imported']}")
+    if args.seed:
+        return
+    failed = median > args.target_ms or round_trips or connections
+    if failed:
+        print(f"FAIL: target is <= {args.target_ms:.0f} ms with no database round trips")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app import db
+from models import Category, CacheVersion
+from upserts import upsert
+from metrics import count_cache
+from replicas import primary_reads
+
+
+def get_version(name):
+    """Current value of a shared cache version counter (0 if it was never bumped)"""
+    version = db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar()
+    return version or 0
+
+
+def bump_version(name, connection=None):
+    """Increment a shared cache version counter, creating it on first use"""
+    connection = connection if connection is not None else db.session.connection()
+    # One INSERT ... ON CONFLICT statement, so two first bumps cannot both try to insert
+    upsert(CacheVersion.__table__, ['name'], [{'name': name, 'version': 1}], increment=True, connection=connection)
+
+
+def bump_versions(generation, names, connection):
+    """Bump counter ``generation`` and stamp rows ``names`` with its new value (see VersionMap)"""
+    bump_version(generation, connection)
+    if names:
+        value = connection.execute(select(CacheVersion.version).where(CacheVersion.name == generation)).scalar()
+        upsert(CacheVersion.__table__, ['name'],
+               [{'name': f'{generation}:{name}', 'version': value} for name in sorted(names)], connection=connection)
+
+
+class VersionMap:
+    """Per-row versions under one shared counter, mirrored in each process.
+
+    A commit that changes rows bumps the ``generation`` counter and records
+    its new value as the version of ``<generation>:<row>`` for each row (see
+    note_version_change). A process reads the counter at most once every
+    ``check_interval`` seconds and, when it has moved, fetches only the rows
+    stamped since the value it saw last.
+    """
+
+    def __init__(self, generation, check_interval=5):
+        self.generation = generation
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._current = None
+        self._seen_at = 0.0
+        self._checked_at = 0.0
+
+    def _sync(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None and now - self._checked_at < self.check_interval:
+                return
+            with primary_reads():  # A lagging replica would hide changes that are already committed
+                rows = self._fetch(self._current)
+                current = rows.pop(self.generation, 0)
+                if self._current is not None and current < self._current:
+                    rows = self._fetch(None)  # A different database (e.g. in tests): start over
+                    current = rows.pop(self.generation, 0)
+            if current != self._current:
+                if self._current is None or current < self._current:
+                    self._versions = {}
+                prefix = len(self.generation) + 1
+                self._versions.update((name[prefix:], version) for name, version in rows.items())
+                self._current = current
+                self._seen_at = time.time()
+            self._checked_at = now
+
+    def _fetch(self, since):
+        # The counter plus the rows stamped after ``since`` (all rows when None), in one SELECT
+        rows = CacheVersion.name.startswith(f'{self.generation}:')
+        if since is not None:
+            rows &= CacheVersion.version > since
+        return dict(db.session.execute(
+            select(CacheVersion.name, CacheVersion.version).where((CacheVersion.name == self.generation) | rows)
+        ).all())
+
+    def current(self):
+        """(counter value, time this process first saw it)"""
+        self._sync()
+        return self._current, self._seen_at
+
+    def get(self, name):
+        """Version of row ``name`` (0 if it never changed)"""
+        self._sync()
+        return self._versions.get(str(name), 0)
+
+    def changed_since(self, version):
+        """Rows stamped after counter value ``version``, or None when that value is not comparable (start over)"""
+        self._sync()
+        with self._lock:
+            if version is None or version > self._current:
+                return None
+            return {name for name, stamped in self._versions.items() if stamped > version}
+
+    def expire(self):
+        """Re-read the counter on next use, e.g. right after this process changed it"""
+        self._checked_at = 0.0
+
+
+def version_map(app, generation):
+    """The app's VersionMap for counter ``generation``, created on first use"""
+    maps = app.extensions.setdefault('version_maps', {})
+    if generation not in maps:
+        maps[generation] = VersionMap(generation, check_interval=app.config['CACHE_VERSION_CHECK_INTERVAL'])
+    return maps[generation]
+
+
+def note_version_change(session, generation, names=()):
+    """Have the session's next commit bump VersionMap counter ``generation`` for rows ``names``"""
+    session.info.setdefault('version_changes', {}).setdefault(generation, set()).update(str(name) for name in names)
+
+
+def _bump_noted_versions(session):
+    session.flush()  # Changes still pending are noted by the flush
+    changes = session.info.get('version_changes')
+    if changes:
+        # Right before COMMIT, so the counter rows are locked as briefly as possible
+        connection = session.connection()
+        for generation in sorted(changes):
+            bump_versions(generation, changes[generation], connection)
+
+
+def _expire_version_maps(session):
+    changes = session.info.pop('version_changes', None)
+    if changes and has_app_context():
+        maps = current_app.extensions.get('version_maps', {})
+        for generation in changes:
+            if generation in maps:
+                maps[generation].expire()
+
+
+def _discard_version_changes(session):
+    session.info.pop('version_changes', None)
+
+
+event.listen(Session, 'before_commit', _bump_noted_versions)
+event.listen(Session, 'after_commit', _expire_version_maps)
+event.listen(Session, 'after_rollback', _discard_version_changes)
+
+
+class TTLValue:
+    """A process-local cached value that is simply reloaded every ``ttl`` seconds.
+
+    For values where a little staleness is fine and a shared version counter
+    would be bumped far too often (e.g. aggregates over orders).
+    """
+
+    def __init__(self, loader, ttl=30):
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded_at is None or now - self._loaded_at >= self.ttl:
+                self._value = self.loader()
+                self._loaded_at = now
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._value = None
+
+
+class LRUCache:
+    """A bounded, thread-safe least-recently-used map of keys to str/bytes values.
+
+    Holds at most ``max_entries`` items and ``max_bytes`` of values (by
+    ``len``); ``max_entries=0`` disables it.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if not self.max_entries or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = value
+            self._size += len(value)
+            while len(self._items) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+# Category list
+
+CATEGORY_GENERATION = 'categories'
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name', 'description'])
+
+
+def _load_categories():
+    rows = db.session.query(Category.id, Category.name, Category.description).order_by(Category.id).all()
+    return tuple(CachedCategory(*row) for row in rows)
+
+
+class CategoryCache:
+    """The category list, reloaded when the 'categories' counter moves (see VersionMap) or after ``ttl`` seconds"""
+
+    def __init__(self, versions, ttl=300):
+        self.versions = versions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._loaded_at = 0.0
+
+    def get(self):
+        version, _ = self.versions.current()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._version == version and now - self._loaded_at < self.ttl
+            count_cache('categories', hit)
+            if not hit:
+                self._value = _load_categories()
+                self._version = version
+                self._loaded_at = now
+            return self._value
+
+
+def _note_category_flush(session, flush_context):
+    changed = list(session.new) + list(session.deleted)
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    if any(isinstance(obj, Category) for obj in changed):
+        note_version_change(session, CATEGORY_GENERATION)
+
+
+event.listen(Session, 'after_flush', _note_category_flush)
+
+
+def get_categories():
+    """All categories as immutable (id, name, description) tuples, served from the process cache"""
+    return current_app.extensions['category_cache'].get()
+
+
+def init_caching(app):
+    app.extensions['category_cache'] = CategoryCache(version_map(app, CATEGORY_GENERATION),
+                                                     ttl=app.config['CATEGORY_CACHE_TTL'])
@@ -0,0 +1,287 @@
+import atexit
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import delete, func, tuple_
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Cart, Product
+from replicas import primary_reads
+from upserts import upsert
+
+# Shopping carts are served from the shared key/value store (see kvstore) and
+# written back to the cart table in batches. While a user's cart is cached the
+# cache is authoritative; the table is its durable copy and the fallback when
+# the cache entry is missing. Each cart is a hash of product id -> quantity
+# plus a running total in cents.
+#
+# Refills from the table only ever add missing fields (hsetnx), and removed
+# lines stay in the hash with quantity 0, so a refill that read the table
+# before a change cannot undo it. Checkout moves the user to a new cart
+# generation, i.e. a new hash, so a refill racing with it lands in the old one.
+
+CartLine = namedtuple('CartLine', ['product', 'quantity'])
+
+LOADED_FIELD = '_loaded'
+TOTAL_FIELD = '_total_cents'
+GENERATIONS_KEY = 'cart:generations'  # Hash of user id -> current cart generation
+DIRTY_KEY = 'cart:dirty'              # Set of user ids with unflushed changes
+FLUSHING_KEY = 'cart:flushing'        # Hash of user id -> time a worker started flushing that cart
+
+
+def _cents(price):
+    return int((Decimal(price) * 100).to_integral_value())
+
+
+class CartService:
+    """Cached carts with write-behind to the cart table.
+
+    Changes mark the cart dirty; a background thread in each worker writes
+    dirty carts every ``flush_interval`` seconds in one transaction. With
+    ``flush_interval <= 0`` every change is written immediately instead.
+    """
+
+    def __init__(self, store, ttl=3600, flush_interval=2.0, lock_timeout=30):
+        self.store = store
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.lock_timeout = lock_timeout
+        self._flusher_lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _key(self, user_id):
+        return f"cart:{user_id}:{self.store.hget(GENERATIONS_KEY, user_id) or 0}"
+
+    def _rows(self, user_id):
+        return db.session.query(Cart.product_id, func.sum(Cart.quantity), Product.price).join(
+            Product, Product.id == Cart.product_id
+        ).filter(Cart.user_id == user_id).group_by(Cart.product_id, Product.price).all()
+
+    def _cached(self, user_id, key=None):
+        """The raw cached hash, filled from the cart table on a miss"""
+        key = key or self._key(user_id)
+        data = self.store.hgetall(key)
+        if LOADED_FIELD in data:
+            return data
+
+        with primary_reads():  # Never cache a cart read from a lagging replica
+            rows = self._rows(user_id)
+        # hsetnx so a change made by another worker in the meantime is not overwritten
+        for product_id, quantity, _ in rows:
+            self.store.hsetnx(key, product_id, int(quantity))
+        self.store.hsetnx(key, TOTAL_FIELD, sum(_cents(price) * int(quantity) for _, quantity, price in rows))
+        self.store.hsetnx(key, LOADED_FIELD, 1)
+        self.store.expire(key, self.ttl)
+        return self.store.hgetall(key)
+
+    @staticmethod
+    def _quantities(data):
+        return {int(field): int(value) for field, value in data.items()
+                if not field.startswith('_') and int(value) > 0}
+
+    def quantities(self, user_id):
+        """``{product_id: quantity}`` for the user's cart"""
+        return self._quantities(self._cached(user_id))
+
+    def lines(self, user_id, cached=True):
+        """Cart lines with product, category and seller loaded in one SELECT, ordered by product id.
+
+        ``cached=False`` reads the quantities from the cart table, e.g. inside flushed().
+        """
+        if cached:
+            key = self._key(user_id)
+            quantities = self._quantities(self._cached(user_id, key))
+        else:
+            quantities = {product_id: int(quantity) for product_id, quantity, _ in self._rows(user_id) if quantity > 0}
+        if not quantities:
+            return []
+        products = Product.query.filter(Product.id.in_(quantities)).options(
+            joinedload(Product.category), joinedload(Product.owner)
+        ).order_by(Product.id).all()
+        lines = [CartLine(product, quantities[product.id]) for product in products]
+
+        # Prices may have changed since items were added; keep the running total honest
+        total = sum(_cents(line.product.price) * line.quantity for line in lines)
+        if cached and str(total) != self.store.hget(key, TOTAL_FIELD):
+            self.store.hset(key, TOTAL_FIELD, total)
+        return lines
+
+    def summary(self, user_id):
+        """(number of lines, running total) without touching product rows"""
+        data = self._cached(user_id)
+        return len(self._quantities(data)), Decimal(int(data.get(TOTAL_FIELD, 0))) / 100
+
+    def add(self, user_id, product_id, price, quantity=1):
+        key = self._key(user_id)
+        self._cached(user_id, key)
+        self.store.hincrby(key, product_id, quantity)
+        self.store.hincrby(key, TOTAL_FIELD, _cents(price) * quantity)
+        self._changed(user_id, key)
+
+    def decrease(self, user_id, product_id, price):
+        """Take one unit off a line; a line at zero stays in the hash as a removal marker"""
+        key = self._key(user_id)
+        self._cached(user_id, key)
+        remaining = self.store.hincrby(key, product_id, -1)
+        if remaining < 0:
+            self.store.hset(key, product_id, 0)
+        else:
+            self.store.hincrby(key, TOTAL_FIELD, -_cents(price))
+        self._changed(user_id, key)
+
+    def remove(self, user_id, product_id, price):
+        key = self._key(user_id)
+        quantity = int(self._cached(user_id, key).get(str(product_id), 0))
+        self.store.hset(key, product_id, 0)
+        if quantity > 0:
+            self.store.hincrby(key, TOTAL_FIELD, -_cents(price) * quantity)
+        self._changed(user_id, key)
+
+    def clear(self, user_id):
+        """Start a new, empty cart generation, e.g. after checkout emptied the cart table"""
+        key = self._key(user_id)
+        self.store.hincrby(GENERATIONS_KEY, user_id, 1)
+        self.store.delete(key)
+
+    def _changed(self, user_id, key):
+        self.store.expire(key, self.ttl)
+        self.store.sadd(DIRTY_KEY, user_id)
+        if self.flush_interval <= 0:
+            self.flush([user_id])
+        else:
+            self.start_flusher(current_app._get_current_object())
+
+    # Write-behind
+
+    def _lock(self, user_id):
+        now = time.time()
+        if self.store.hsetnx(FLUSHING_KEY, user_id, now):
+            return True
+        held_since = self.store.hget(FLUSHING_KEY, user_id)
+        if held_since is not None and now - float(held_since) > self.lock_timeout:
+            # The worker that took the lock died mid-flush
+            self.store.hdel(FLUSHING_KEY, user_id)
+            return bool(self.store.hsetnx(FLUSHING_KEY, user_id, now))
+        return False
+
+    def flush(self, user_ids=None):
+        """Write dirty carts (all, or just ``user_ids``) to the cart table; returns how many were written"""
+        candidates = self.store.smembers(DIRTY_KEY) if user_ids is None else {str(u) for u in user_ids}
+        claimed = []
+        for user_id in sorted(candidates):
+            if not self._lock(user_id):
+                continue  # Another worker is writing this cart; it stays dirty if it changes again
+            if self.store.srem(DIRTY_KEY, user_id):
+                claimed.append(user_id)
+            else:
+                self.store.hdel(FLUSHING_KEY, user_id)
+        if not claimed:
+            return 0
+        try:
+            return self._flush_claimed(claimed)
+        finally:
+            self.store.hdel(FLUSHING_KEY, *claimed)
+
+    def _flush_claimed(self, user_ids):
+        try:
+            snapshots = {}
+            for user_id in user_ids:
+                data = self.store.hgetall(self._key(user_id))
+                if LOADED_FIELD in data:
+                    snapshots[user_id] = self._quantities(data)
+            self._write(snapshots)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.store.sadd(DIRTY_KEY, *user_ids)
+            raise
+        return len(snapshots)
+
+    @contextmanager
+    def flushed(self, user_id):
+        """Write the user's pending changes and keep other workers from flushing this cart until the block ends.
+
+        For placing an order: read the lines with ``lines(user_id, cached=False)``
+        and call ``clear`` inside the block once the order is committed.
+        """
+        user_id = str(user_id)
+        deadline = time.monotonic() + self.lock_timeout
+        while not self._lock(user_id):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Cart of user {user_id} is still being written by another worker')
+            time.sleep(0.05)
+        try:
+            if self.store.srem(DIRTY_KEY, user_id):
+                self._flush_claimed([user_id])
+            yield
+        finally:
+            self.store.hdel(FLUSHING_KEY, user_id)
+
+    def _write(self, snapshots):
+        """Make the cart table match ``{user_id: {product_id: quantity}}`` with one DELETE and one upsert"""
+        if not snapshots:
+            return
+        wanted_products = {product_id for lines in snapshots.values() for product_id in lines}
+        existing_products = {product_id for (product_id,) in db.session.query(Product.id).filter(
+            Product.id.in_(wanted_products))} if wanted_products else set()
+
+        keep = [(user_id, product_id) for user_id, lines in snapshots.items()
+                for product_id in lines if product_id in existing_products]
+        stale = delete(Cart).where(Cart.user_id.in_(snapshots))
+        if keep:
+            stale = stale.where(tuple_(Cart.user_id, Cart.product_id).not_in(keep))
+        db.session.execute(stale.execution_options(synchronize_session=False))
+
+        now = datetime.utcnow()
+        upsert(Cart.__table__, ['user_id', 'product_id'], [
+            {'user_id': user_id, 'product_id': product_id, 'quantity': snapshots[user_id][product_id], 'created_at': now}
+            for user_id, product_id in keep
+        ], update=['quantity'])
+
+    def start_flusher(self, app):
+        """Start this process's background flush thread if it is not running yet"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._flusher_lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+            threading.Thread(target=self._run_flusher, args=(app,), name='cart-flusher', daemon=True).start()
+
+    def _run_flusher(self, app):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                app.logger.error(f"Cart write-behind failed: {e}")
+
+
+def get_cart_service():
+    return current_app.extensions['cart_service']
+
+
+def init_carts(app):
+    service = CartService(
+        app.extensions['kv_store'],
+        ttl=app.config['CART_CACHE_TTL'],
+        flush_interval=app.config['CART_FLUSH_INTERVAL'],
+    )
+    app.extensions['cart_service'] = service
+
+    def flush_at_exit():
+        try:
+            with app.app_context():
+                service.flush()
+        except Exception as e:
+            app.logger.error(f"Cart write-behind failed at exit: {e}")
+
+    atexit.register(flush_at_exit)
@@ -0,0 +1,156 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import tuple_, update
+from app import db
+from models import Order, Product
+
+# Sort options for the product listing. Each entry is (column, descending, cursor type).
+# Every sort is tie-broken on Product.id in the same direction so the keyset
+# comparison can be expressed as a single row-value comparison that walks the
+# matching composite index declared on Product. The sort columns are NOT NULL:
+# a NULL key compares as unknown, so the page after it would come back empty.
+SORT_OPTIONS = {
+    'newest': (Product.created_at, True, 'datetime'),
+    'price_asc': (Product.price, False, 'decimal'),
+    'price_desc': (Product.price, True, 'decimal'),
+    'ratings': (Product.ratings, True, 'decimal'),
+    'bestsellers': (Product.sales_count, True, 'int'),
+}
+DEFAULT_SORT = 'newest'
+
+# Search results can additionally be ordered by the search backend's ranking
+RELEVANCE_SORT = 'relevance'
+
+SORT_LABELS = {
+    'relevance': 'Relevance',
+    'newest': 'Newest Arrivals',
+    'price_asc': 'Price: Low to High',
+    'price_desc': 'Price: High to Low',
+    'ratings': 'Avg. Customer Review',
+    'bestsellers': 'Best Sellers',
+}
+
+ProductPage = namedtuple('ProductPage', ['items', 'next_cursor', 'sort', 'per_page'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load_value(value, kind):
+    if value is None:
+        return None
+    if kind == 'datetime':
+        return datetime.fromisoformat(value)
+    if kind == 'decimal':
+        return Decimal(value)
+    return int(value)
+
+
+def pack_cursor(kind, value, row_id):
+    """Opaque URL-safe cursor for a (kind, key value, row id) position"""
+    raw = json.dumps([kind, _dump_value(value), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def unpack_cursor(kind, cursor, value_type):
+    """Decode a cursor built by pack_cursor into (key value, row id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_kind, value, row_id = json.loads(raw)
+        if cursor_kind != kind:
+            raise InvalidCursor('Cursor does not match the requested sort order')
+        return _load_value(value, value_type), int(row_id)
+    except InvalidCursor:
+        raise
+    except Exception as e:
+        raise InvalidCursor(str(e))
+
+
+def encode_cursor(sort, product):
+    """Build an opaque cursor pointing just past the given product"""
+    column, _, _ = SORT_OPTIONS[sort]
+    return pack_cursor(sort, getattr(product, column.key), product.id)
+
+
+def decode_cursor(sort, cursor):
+    """Decode a cursor into (sort key value, product id) for the given sort"""
+    return unpack_cursor(sort, cursor, SORT_OPTIONS[sort][2])
+
+
+def encode_offset_cursor(sort, offset):
+    return pack_cursor(sort, offset, 0)
+
+
+def decode_offset_cursor(sort, cursor):
+    offset, _ = unpack_cursor(sort, cursor, 'int')
+    return max(offset, 0)
+
+
+# Value given to legacy NULL sort keys: unrated / never sold / oldest
+NULL_SORT_DEFAULTS = (
+    (Product.ratings, 0),
+    (Product.sales_count, 0),
+    (Product.created_at, datetime(1970, 1, 1)),
+    (Order.created_at, datetime(1970, 1, 1)),
+)
+
+
+def fill_null_sort_keys():
+    """Replace NULL keyset sort keys in tables created before those columns were NOT NULL"""
+    for column, value in NULL_SORT_DEFAULTS:
+        db.session.execute(update(column.class_).where(column.is_(None)).values({column.key: value}))
+
+
+def paginate_ranked(query, ranked_ids, cursor=None, per_page=24):
+    """Return one page of search hits in ranking order, restricted to an already filtered query"""
+    offset = decode_offset_cursor(RELEVANCE_SORT, cursor) if cursor else 0
+
+    # One id-only query applies the listing filters (active, category) to the hit set
+    allowed = {product_id for (product_id,) in query.with_entities(Product.id)}
+    ordered_ids = [product_id for product_id in ranked_ids if product_id in allowed]
+    page_ids = ordered_ids[offset:offset + per_page]
+
+    products = {p.id: p for p in query.filter(Product.id.in_(page_ids))} if page_ids else {}
+    items = [products[product_id] for product_id in page_ids if product_id in products]
+    has_more = len(ordered_ids) > offset + per_page
+    next_cursor = encode_offset_cursor(RELEVANCE_SORT, offset + per_page) if has_more else None
+    return ProductPage(items=items, next_cursor=next_cursor, sort=RELEVANCE_SORT, per_page=per_page)
+
+
+def paginate_products(query, sort=DEFAULT_SORT, cursor=None, per_page=24):
+    """Return one keyset page of products from an already filtered query"""
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    column, descending, _ = SORT_OPTIONS[sort]
+
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        key = tuple_(column, Product.id)
+        if descending:
+            query = query.filter(key < tuple_(value, last_id))
+        else:
+            query = query.filter(key > tuple_(value, last_id))
+
+    if descending:
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column.asc(), Product.id.asc())
+
+    # Fetch one extra row to know whether another page exists without a COUNT(*)
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = encode_cursor(sort, items[-1]) if len(rows) > per_page else None
+    return ProductPage(items=items, next_cursor=next_cursor, sort=sort, per_page=per_page)
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy import delete, func, update
+from app import db
+from models import Order, OrderItem, Payment, Cart, Product
+from inventory import reserve_stock, release_stock
+from analytics import record_order_placed, record_order_cancelled, record_status_change
+
+# Order placement and cancellation. Each step is one set-based statement
+# (stock reservation, order lines, payment, cart clear), so a checkout costs
+# the same number of round trips whether the cart has 1 line or 100.
+
+CANCELLABLE_STATUSES = ('pending', 'processing')
+
+
+def create_order(customer_id, cart_items, shipping_address, phone, payment_method):
+    """Turn a customer's cart lines (with products loaded) into an order and return it.
+
+    Raises inventory.InsufficientStock when the cart cannot be covered. Nothing
+    is committed here; the caller commits, or rolls back on error.
+    """
+    quantities, prices, seller_sales = {}, {}, {}
+    for item in cart_items:
+        product = item.product
+        quantities[product.id] = quantities.get(product.id, 0) + item.quantity
+        prices[product.id] = product.price
+        revenue, units = seller_sales.get(product.super_admin_id, (0, 0))
+        seller_sales[product.super_admin_id] = (revenue + product.price * item.quantity, units + item.quantity)
+
+    reserve_stock(quantities)
+
+    total = sum(prices[product_id] * quantity for product_id, quantity in quantities.items())
+    paid = payment_method == 'online'
+    order = Order(
+        customer_id=customer_id,
+        total_amount=total,
+        payment_method=payment_method,
+        payment_status='paid' if paid else 'pending',  # Online payments are simulated as successful
+        shipping_address=shipping_address,
+        phone=phone,
+    )
+    db.session.add(order)
+    db.session.flush()  # One INSERT; the id comes back with it
+
+    db.session.execute(OrderItem.__table__.insert().values([
+        {'order_id': order.id, 'product_id': product_id, 'quantity': quantity, 'price': prices[product_id]}
+        for product_id, quantity in sorted(quantities.items())
+    ]))
+    db.session.execute(Payment.__table__.insert().values(
+        order_id=order.id,
+        payment_method=payment_method,
+        payment_status='paid' if paid else 'pending',
+        amount=total,
+        transaction_id=f"TXN{order.id}{datetime.now().strftime('%Y%m%d%H%M%S')}" if paid else None,
+    ))
+    record_order_placed(order, seller_sales, quantities)
+    db.session.execute(delete(Cart).where(Cart.user_id == customer_id).execution_options(synchronize_session=False))
+    return order
+
+
+def cancel_order(order):
+    """Cancel a pending/processing order and put its stock back; returns False if it can no longer be cancelled.
+
+    The status change is a conditional UPDATE, so two concurrent cancellations
+    cannot both restore the stock. Nothing is committed here.
+    """
+    previous_status = order.status
+    if previous_status not in CANCELLABLE_STATUSES or not _change_status(order, previous_status, 'cancelled'):
+        return False
+
+    # Quantities per product and sales per seller from one grouped read of the order lines
+    quantities, seller_sales = {}, {}
+    for product_id, seller_id, units, revenue in db.session.query(
+        OrderItem.product_id,
+        Product.super_admin_id,
+        func.sum(OrderItem.quantity),
+        func.sum(OrderItem.price * OrderItem.quantity),
+    ).outerjoin(Product, Product.id == OrderItem.product_id).filter(
+        OrderItem.order_id == order.id
+    ).group_by(OrderItem.product_id, Product.super_admin_id):
+        quantities[product_id] = int(units)
+        if seller_id is not None:
+            seller_revenue, seller_units = seller_sales.get(seller_id, (0, 0))
+            seller_sales[seller_id] = (seller_revenue + revenue, seller_units + int(units))
+
+    release_stock(quantities)
+    record_order_cancelled(order, previous_status, seller_sales)
+    return True
+
+
+def set_order_status(order, status):
+    """Move an order to ``status``; returns False if its status changed concurrently. Nothing is committed here."""
+    previous_status = order.status
+    if previous_status == status:
+        return True
+    if not _change_status(order, previous_status, status):
+        return False
+    record_status_change(previous_status, status)
+    return True
+
+
+def _change_status(order, previous_status, status):
+    # Conditional on the status we read, so the status counts move exactly once per change
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == previous_status)
+        .values(status=status)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.expire(order, ['status'])
+    return result.rowcount == 1
@@ -0,0 +1,183 @@
+import bisect
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import NullPool, QueuePool
+from app import db
+
+# Connection pool settings and per-worker pool metrics. Each gunicorn worker
+# has its own pool (see gunicorn.conf.py), so the numbers here describe the
+# worker that serves the request; size DB_POOL_SIZE + DB_MAX_OVERFLOW so that
+# workers x (size + overflow) stays under the server's max_connections.
+
+# Upper bounds (ms) of the checkout wait histogram buckets; the last bucket is +Inf
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics:
+    """Checkout counts, wait-time histogram and connection churn for one process"""
+
+    def __init__(self, buckets=WAIT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.wait_counts = [0] * (len(self.buckets) + 1)
+            self.wait_sum_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+
+    def observe_wait(self, wait_ms):
+        with self._lock:
+            self.wait_counts[bisect.bisect_left(self.buckets, wait_ms)] += 1
+            self.wait_sum_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            self.checkouts += 1
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def observe_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def observe_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool=None, max_overflow=None):
+        """Counters plus the pool's current occupancy, as a dict"""
+        with self._lock:
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + (None,), self.wait_counts):
+                cumulative += count
+                buckets.append({'le_ms': bound if bound is not None else '+Inf', 'count': cumulative})
+            data = {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'wait_ms': {
+                    'sum': round(self.wait_sum_ms, 3),
+                    'max': round(self.wait_max_ms, 3),
+                    'avg': round(self.wait_sum_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                    'buckets': buckets,
+                },
+            }
+        if pool is not None:
+            data['pool'] = pool_status(pool, max_overflow)
+        return data
+
+
+def pool_status(pool, max_overflow=None):
+    """Occupancy of ``pool``; ``max_overflow`` is the configured DB_MAX_OVERFLOW (QueuePool has no public getter)"""
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=max_overflow,
+            timeout=pool.timeout(),
+        )
+    return status
+
+
+class _TimedCheckout:
+    """Pool mixin that times how long each checkout waits for a connection.
+
+    ``_do_get`` is where QueuePool blocks when every connection is in use, so
+    timing it captures queueing for the pool (plus connect time for new
+    connections). The metrics object is a class attribute because a pool
+    rebuilds itself from its own class on dispose()/recreate().
+    """
+
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeout:
+            self.metrics.observe_timeout()
+            raise
+        self.metrics.observe_wait((time.perf_counter() - start) * 1000)
+        return record
+
+
+def timed_pool_class(base, metrics):
+    return type(f'Timed{base.__name__}', (_TimedCheckout, base), {'metrics': metrics})
+
+
+def engine_options(config, metrics, url=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the DB_POOL_* settings in ``config`` (for ``url``, default the primary)"""
+    options = {
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'query_cache_size': config['DB_STATEMENT_CACHE_SIZE'],
+    }
+    url = url or config.get('SQLALCHEMY_DATABASE_URI')
+    url = make_url(url) if url else None
+    if config['DB_PGBOUNCER']:
+        # PgBouncer already pools server connections: keep none open in the worker,
+        # so a transaction-mode bouncer can hand each transaction any server.
+        # psycopg2 has no server-side prepared statements to break that.
+        options.update(poolclass=timed_pool_class(NullPool, metrics), pool_pre_ping=False)
+    elif url is not None and url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        pass  # In-memory SQLite needs its default single-connection pool
+    else:
+        options.update(
+            poolclass=timed_pool_class(QueuePool, metrics),
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+        )
+    return options
+
+
+def bind_options(config, binds, metrics):
+    """SQLALCHEMY_BINDS entries for ``{bind key: url}``, each with its own pool options and PoolMetrics.
+
+    ``metrics`` maps bind keys to PoolMetrics and gains an entry per bind, so
+    replica pools are never counted as the primary's.
+    """
+    entries = {}
+    for key, url in binds.items():
+        metrics[key] = PoolMetrics()
+        entries[key] = dict(engine_options(config, metrics[key], url), url=url)
+    return entries
+
+
+def pool_name(bind_key):
+    return bind_key or 'primary'
+
+
+def get_pool_metrics(bind_key=None):
+    return current_app.extensions['db_pool_metrics'][bind_key]
+
+
+def pool_snapshot(bind_key=None):
+    return get_pool_metrics(bind_key).snapshot(db.engines[bind_key].pool, current_app.config['DB_MAX_OVERFLOW'])
+
+
+def init_pool_metrics(app, metrics):
+    """``metrics`` maps bind keys (None for the primary) to their PoolMetrics"""
+    app.extensions['db_pool_metrics'] = metrics
+    with app.app_context():
+        for key, engine in db.engines.items():
+            # Pool events registered on the engine carry over to pools rebuilt by dispose()
+            event.listen(engine, 'connect', lambda *args, m=metrics[key]: m.observe_connect())
+            event.listen(engine, 'invalidate', lambda *args, m=metrics[key]: m.observe_invalidation())
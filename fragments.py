@@ -0,0 +1,104 @@
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from models import Product, ProductImage, Category
+from caching import LRUCache, note_version_change, version_map
+from pagecache import CATALOG_GENERATION
+from metrics import count_cache
+
+# Template fragment caching:
+#
+#     {% cache 'product-card', product, product.stock %} ... {% endcache %}
+#
+# The rendered block is kept in a per-process LRU keyed by the template, the
+# block's position and the listed values. Products and categories in the key
+# stand for their current version: the catalog generation (see pagecache) of
+# the last commit that edited or deleted that row, kept per row in
+# cache_versions, so an edit invalidates only that row's fragments in every
+# worker within CACHE_VERSION_CHECK_INTERVAL. Anything else shown in the block
+# that can change without an edit (e.g. stock) must be listed in the key.
+
+VERSIONED_MODELS = (Product, Category)
+
+
+def _row_name(obj):
+    return f'{obj.__tablename__}:{obj.id}'
+
+
+class FragmentCache:
+    """Rendered template fragments plus the per-row versions they are keyed on"""
+
+    def __init__(self, versions, max_entries=4096, max_bytes=16 * 1024 * 1024):
+        self.versions = versions
+        self.fragments = LRUCache(max_entries, max_bytes)
+
+    def key(self, template, lineno, parts):
+        key = [template, lineno]
+        for part in parts:
+            if isinstance(part, VERSIONED_MODELS):
+                name = _row_name(part)
+                key.append((name, self.versions.get(name)))
+            elif isinstance(part, db.Model):
+                key.append(_row_name(part))
+            else:
+                key.append(repr(part))
+        return tuple(key)
+
+
+class FragmentCacheExtension(Extension):
+    """The ``{% cache key, ... %}...{% endcache %}`` tag"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        args = [nodes.Const(parser.name or ''), nodes.Const(lineno), nodes.List(parts)]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, template, lineno, parts, caller):
+        cache = current_app.extensions['fragment_cache']
+        if not cache.fragments.max_entries:
+            return caller()
+        key = cache.key(template, lineno, parts)
+        html = cache.fragments.get(key)
+        count_cache('fragment', html is not None)
+        if html is None:
+            html = caller()
+            cache.fragments.put(key, html)
+        return html
+
+
+def _note_edited_rows(session, flush_context):
+    changed = list(session.deleted)
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    names = set()
+    for obj in changed:
+        if isinstance(obj, VERSIONED_MODELS):
+            names.add(_row_name(obj))
+        elif isinstance(obj, ProductImage):
+            names.add(f'{Product.__tablename__}:{obj.product_id}')
+    # Images added to an existing product change its gallery too
+    for obj in session.new:
+        if isinstance(obj, ProductImage) and obj.product_id is not None:
+            names.add(f'{Product.__tablename__}:{obj.product_id}')
+    if names:
+        note_version_change(session, CATALOG_GENERATION, names)
+
+
+event.listen(Session, 'after_flush', _note_edited_rows)
+
+
+def init_fragment_cache(app):
+    app.extensions['fragment_cache'] = FragmentCache(
+        version_map(app, CATALOG_GENERATION),
+        max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'],
+    )
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,90 @@
+"""Production gunicorn profile: `gunicorn -c gunicorn.conf.py main:app`.
+
+The app is imported once in the master (preload_app) and forked, so workers
+share its memory copy-on-write and boot instantly. The master also builds the
+static asset manifest before forking. Anything holding sockets or threads is
+reset in each child in post_fork.
+
+GUNICORN_WORKER_CLASS picks the concurrency model:
+
+    gthread (default)  WEB_CONCURRENCY processes x GUNICORN_THREADS threads; a
+                       request waiting on Postgres or Supabase only ties up a thread
+    sync               one request per process (gunicorn's plain default)
+    gevent             cooperative greenlets, GUNICORN_WORKER_CONNECTIONS per
+                       process; needs the "gevent" and "redis" extras and a
+                       redis:// KV_STORE_URL, since sqlite3 calls to a local
+                       store cannot yield and would stall every greenlet in the
+                       worker (refused at startup otherwise)
+
+WEB_CONCURRENCY overrides the worker count (default: sized to the CPU count).
+The database pool (DB_POOL_SIZE / DB_MAX_OVERFLOW) and Supabase connection
+pool (SUPABASE_HTTP_MAX_CONNECTIONS) default to the per-process concurrency
+unless set explicitly.
+"""
+import multiprocessing
+import os
+from urllib.parse import urlparse
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Same lookup as KV_STORE_URL in create_app
+    store_url = os.environ.get('KV_STORE_URL') or os.environ.get('REDIS_URL') or os.environ.get('CART_STORE_URL')
+    if urlparse(store_url or '').scheme not in ('redis', 'rediss', 'unix'):
+        raise RuntimeError(f'GUNICORN_WORKER_CLASS=gevent needs a Redis KV_STORE_URL (got {store_url!r}): '
+                           'a SQLite or in-process store blocks the gevent loop.')
+
+    # Patch before the app is preloaded so its locks, sockets and threads are cooperative
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()  # Otherwise every Postgres query blocks the whole worker
+    except ImportError:
+        pass
+
+cores = multiprocessing.cpu_count()
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+preload_app = True
+
+if worker_class == 'sync':
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores * 2 + 1))
+    concurrency = 1
+elif worker_class == 'gevent':
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores))
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+    # Only requests actually waiting on the database need a connection; the pool queues the rest
+    concurrency = min(worker_connections, 20)
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', cores + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    concurrency = threads
+
+# Read by create_app when the app is preloaded below
+os.environ.setdefault('DB_POOL_SIZE', str(concurrency))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(concurrency))
+os.environ.setdefault('SUPABASE_HTTP_MAX_CONNECTIONS', str(max(concurrency, 4)))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Recycle workers now and then so slow leaks cannot build up; jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # e.g. "-" for stdout
+
+
+def on_starting(server):
+    # Hash and plan the homepage images once here instead of in every worker (see assets.AssetManifest)
+    server.app.wsgi().extensions['assets'].build()
+
+
+def post_fork(server, worker):
+    from app import after_fork
+    after_fork(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    # Keep the exiting worker's counters in /metrics (see metrics.py)
+    from metrics import retire_worker
+    retire_worker(server.app.wsgi())
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db, login_manager
+from models import User
+from caching import note_version_change, version_map
+from metrics import count_cache
+from replicas import primary_reads
+
+# current_user for logged-in requests is a slim, immutable snapshot of the user
+# row (id, name, role, is_active) cached per worker, so page views don't
+# SELECT the user each time. Snapshots expire after a TTL and are dropped when
+# the row changes: each user has a version in cache_versions (see
+# caching.VersionMap), stamped by any commit that touches the row, which the
+# committing worker sees at once and the others within
+# CACHE_VERSION_CHECK_INTERVAL seconds.
+
+USERS_GENERATION = 'users'
+
+
+class UserSnapshot(UserMixin):
+    """Read-only view of a user for current_user.
+
+    Attributes other than id/name/role/is_active (email, orders, ...) are read
+    from the full row, which is loaded on first use in the request. Changes
+    must be made on ``record``.
+    """
+
+    def __init__(self, id, name, role, is_active):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'active', bool(is_active))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'UserSnapshot is read-only; set {name!r} on current_user.record')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.record, name)
+
+    @property
+    def is_active(self):
+        return self.active
+
+    @property
+    def record(self):
+        """The full User row (one SELECT per request at most, via the session identity map)"""
+        return db.session.get(User, self.id)
+
+
+class IdentityCache:
+    """Per-worker snapshots keyed by user id, at most ``max_entries`` of them"""
+
+    def __init__(self, versions, ttl=60, max_entries=10000):
+        self.versions = versions
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def get(self, user_id):
+        # Read the version before the row, so a change committed in between forces a reload next time
+        version = self.versions.get(user_id)
+        now = time.monotonic()
+        entry = self._users.get(user_id)
+        if entry is not None and entry[0] == version and now - entry[1] < self.ttl:
+            count_cache('user', True)
+            return entry[2]
+        count_cache('user', False)
+
+        with primary_reads():  # A lagging replica would pin an outdated snapshot to the new version
+            row = db.session.query(User.id, User.name, User.role, User.is_active).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(*row)
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._users[user_id] = (version, now, snapshot)
+            while len(self._users) > self.max_entries:
+                del self._users[next(iter(self._users))]  # Oldest load first
+        return snapshot
+
+
+def load_user(user_id):
+    return current_app.extensions['identity_cache'].get(user_id)
+
+
+def _note_changed_users(session, flush_context):
+    changed = list(session.deleted)
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    ids = {obj.id for obj in changed if isinstance(obj, User)}
+    if ids:
+        note_version_change(session, USERS_GENERATION, ids)
+
+
+event.listen(Session, 'after_flush', _note_changed_users)
+
+
+def init_identity(app):
+    app.extensions['identity_cache'] = IdentityCache(
+        version_map(app, USERS_GENERATION),
+        ttl=app.config['USER_CACHE_TTL'],
+        max_entries=app.config['USER_CACHE_MAX_ENTRIES'],
+    )
+    login_manager.user_loader(load_user)
@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+from sqlalchemy import case, select, update
+from app import db
+from models import Product
+
+# Stock reservation for checkout. The whole cart is taken in one conditional
+# UPDATE, so two concurrent checkouts can never both take the last unit.
+
+Shortfall = namedtuple('Shortfall', ['product_id', 'name', 'requested', 'available'])
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more cart lines cannot be reserved; the caller must roll back"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__(', '.join(
+            f'{s.name or s.product_id}: requested {s.requested}, available {s.available}' for s in shortfalls
+        ))
+
+
+def _lock_rows(product_ids):
+    # Lock in primary key order so checkouts sharing products queue instead of deadlocking.
+    # SQLite has no row locks; it serializes writers on the database instead.
+    if db.session.get_bind().dialect.name in ('postgresql', 'mysql', 'mariadb', 'oracle'):
+        db.session.execute(
+            select(Product.id).where(Product.id.in_(product_ids)).order_by(Product.id).with_for_update()
+        )
+
+
+def reserve_stock(quantities):
+    """Take ``{product_id: quantity}`` out of stock in a single statement.
+
+    Either every line is reserved or InsufficientStock is raised with one
+    Shortfall per line that could not be (missing, inactive or not enough
+    stock). Nothing is committed here; on failure the caller rolls back.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    product_ids = sorted(quantities)
+    _lock_rows(product_ids)
+
+    wanted = case(quantities, value=Product.id)
+    stmt = (
+        update(Product)
+        .where(Product.id.in_(product_ids), Product.is_active.isnot(False), Product.stock >= wanted)
+        .values(stock=Product.stock - wanted)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.update_returning:
+        reserved = set(db.session.execute(stmt.returning(Product.id)).scalars())
+        if len(reserved) == len(product_ids):
+            return
+    else:
+        result = db.session.execute(stmt)
+        if result.rowcount == len(product_ids):
+            return
+        reserved = set()
+    raise InsufficientStock(find_shortfalls(quantities, reserved))
+
+
+def find_shortfalls(quantities, reserved=()):
+    """Lines of ``{product_id: quantity}`` that current stock cannot cover.
+
+    ``reserved`` lists products whose quantity was already taken in this
+    transaction; those lines are covered and are skipped.
+    """
+    rows = {
+        product_id: (name, stock, is_active)
+        for product_id, name, stock, is_active in db.session.execute(
+            select(Product.id, Product.name, Product.stock, Product.is_active).where(Product.id.in_(quantities))
+        )
+    }
+    shortfalls = []
+    for product_id in sorted(quantities):
+        if product_id in reserved:
+            continue
+        name, stock, is_active = rows.get(product_id, (None, 0, False))
+        available = stock if is_active is not False else 0
+        if available < quantities[product_id]:
+            shortfalls.append(Shortfall(product_id, name, quantities[product_id], max(available, 0)))
+    return shortfalls
+
+
+
+def release_stock(quantities):
+    """Put ``{product_id: quantity}`` back into stock in a single statement (e.g. on cancellation)"""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    returned = case(quantities, value=Product.id)
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(sorted(quantities)))
+        .values(stock=Product.stock + returned)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,101 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+# In-process background jobs for work that must not hold up a request, such as
+# calls to Supabase Auth. Jobs run on a small thread pool in each worker
+# process, inside an app context, and are retried with backoff on transient
+# errors. Nothing is persisted: jobs still queued when a worker exits are
+# lost, so only best-effort work (and work that carries secrets which must
+# not be written anywhere, like passwords) belongs here.
+
+
+def is_retryable(error):
+    # Client errors (bad request, duplicate, unauthorized, ...) will not succeed on retry
+    status = getattr(error, 'status', None)
+    try:
+        return int(status) >= 500 or int(status) == 429
+    except (TypeError, ValueError):
+        return True
+
+
+class JobQueue:
+    """A bounded per-process job pool; ``submit`` returns False when the queue is full"""
+
+    def __init__(self, app, workers=2, max_pending=1000, max_attempts=3, backoff=1.0):
+        self.app = app
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+
+    def _get_executor(self):
+        # Thread pools do not survive a fork; start one per worker process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='jobs')
+                self._pid = os.getpid()
+                self._pending = 0
+            return self._executor
+
+    def submit(self, description, func, *args, on_failure=None, **kwargs):
+        """Run ``func(*args, **kwargs)`` in the background; ``on_failure(error)`` runs if every attempt fails"""
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.app.logger.warning(f"Job queue full, dropping {description}")
+                return False
+            self._pending += 1
+        executor.submit(self._run, description, func, args, kwargs, on_failure)
+        return True
+
+    def _run(self, description, func, args, kwargs, on_failure):
+        try:
+            attempt = 1
+            while True:
+                try:
+                    with self.app.app_context():
+                        return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_attempts or not is_retryable(e):
+                        self.app.logger.error(f"{description} failed after {attempt} attempt(s): {e}")
+                        if on_failure is not None:
+                            with self.app.app_context():
+                                on_failure(e)
+                        return None
+                    time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random() / 2))
+                    attempt += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def join(self, timeout=None):
+        """Wait until every submitted job has finished (for scripts and benchmarks); returns True if drained"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+def get_job_queue():
+    return current_app.extensions['jobs']
+
+
+def init_jobs(app):
+    app.extensions['jobs'] = JobQueue(
+        app,
+        workers=app.config['JOB_WORKERS'],
+        max_pending=app.config['JOB_QUEUE_SIZE'],
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+        backoff=app.config['JOB_RETRY_BACKOFF'],
+    )
@@ -0,0 +1,283 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+# Small key/value stores for process-external caches. Both implement the
+# subset of the redis-py API the app uses (hashes, sets, expiry, with
+# decode_responses=True semantics: fields and values are returned as str), so
+# a redis.Redis client can be used in their place.
+#
+# Entries are invalidated by deleting them, which only reaches the workers
+# that share the store: with more than one host serving traffic KV_STORE_URL
+# must be a Redis server they all use. Without it the app uses a private
+# SQLite file per host and logs a warning unless SINGLE_HOST=true says that is
+# intended.
+
+LOCAL_SCHEMES = ('memory', 'sqlite')
+
+
+class MemoryStore:
+    """Per-process store; fine for a single worker and for tests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._sets = {}
+        self._expires = {}
+
+    def _live(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._hashes.pop(key, None)
+            self._sets.pop(key, None)
+            self._expires.pop(key, None)
+
+    def hgetall(self, key):
+        with self._lock:
+            self._live(key)
+            return dict(self._hashes.get(key, {}))
+
+    def hget(self, key, field):
+        with self._lock:
+            self._live(key)
+            return self._hashes.get(key, {}).get(str(field))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        with self._lock:
+            self._live(key)
+            data = self._hashes.setdefault(key, {})
+            added = sum(1 for name in items if str(name) not in data)
+            data.update({str(name): str(item) for name, item in items.items()})
+            return added
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            self._live(key)
+            data = self._hashes.setdefault(key, {})
+            if str(field) in data:
+                return 0
+            data[str(field)] = str(value)
+            return 1
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            self._live(key)
+            data = self._hashes.setdefault(key, {})
+            value = int(data.get(str(field), 0)) + amount
+            data[str(field)] = str(value)
+            return value
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            self._live(key)
+            data = self._hashes.get(key, {})
+            return sum(1 for field in fields if data.pop(str(field), None) is not None)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._live(key)
+            data = self._sets.setdefault(key, set())
+            added = {str(member) for member in members} - data
+            data.update(added)
+            return len(added)
+
+    def srem(self, key, *members):
+        with self._lock:
+            self._live(key)
+            data = self._sets.get(key, set())
+            removed = {str(member) for member in members} & data
+            data.difference_update(removed)
+            return len(removed)
+
+    def smembers(self, key):
+        with self._lock:
+            self._live(key)
+            return set(self._sets.get(key, set()))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                deleted += (self._hashes.pop(key, None) is not None) + (self._sets.pop(key, None) is not None)
+                self._expires.pop(key, None)
+            return deleted
+
+
+class SQLiteStore:
+    """Store in a local SQLite file, shared by all worker processes on the host.
+
+    Operations autocommit in WAL mode; increments run in an immediate
+    transaction, so they and set removals are atomic across processes. A new
+    file is created readable by its owner only (SQLite gives the -wal and
+    -shm files the same mode).
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS kv_hash (key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, '
+        'PRIMARY KEY (key, field)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS kv_set (key TEXT NOT NULL, member TEXT NOT NULL, '
+        'PRIMARY KEY (key, member)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS kv_expiry (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self):
+        # One connection per thread and process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _live(self, conn, key):
+        row = conn.execute('SELECT expires_at FROM kv_expiry WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[0] <= time.time():
+            self._delete(conn, key)
+
+    def _delete(self, conn, key):
+        deleted = conn.execute('DELETE FROM kv_hash WHERE key = ?', (key,)).rowcount > 0
+        deleted += conn.execute('DELETE FROM kv_set WHERE key = ?', (key,)).rowcount > 0
+        conn.execute('DELETE FROM kv_expiry WHERE key = ?', (key,))
+        return deleted
+
+    def hgetall(self, key):
+        conn = self._conn()
+        self._live(conn, key)
+        return dict(conn.execute('SELECT field, value FROM kv_hash WHERE key = ?', (key,)))
+
+    def hget(self, key, field):
+        conn = self._conn()
+        self._live(conn, key)
+        row = conn.execute('SELECT value FROM kv_hash WHERE key = ? AND field = ?', (key, str(field))).fetchone()
+        return row[0] if row else None
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        conn = self._conn()
+        self._live(conn, key)
+        before = conn.total_changes
+        conn.executemany(
+            'INSERT INTO kv_hash (key, field, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (key, field) DO UPDATE SET value = excluded.value',
+            [(key, str(name), str(item)) for name, item in items.items()],
+        )
+        return conn.total_changes - before
+
+    def hsetnx(self, key, field, value):
+        conn = self._conn()
+        self._live(conn, key)
+        return conn.execute('INSERT OR IGNORE INTO kv_hash (key, field, value) VALUES (?, ?, ?)',
+                            (key, str(field), str(value))).rowcount
+
+    def hincrby(self, key, field, amount=1):
+        conn = self._conn()
+        self._live(conn, key)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO kv_hash (key, field, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (key, field) DO UPDATE SET value = CAST(value AS INTEGER) + CAST(excluded.value AS INTEGER)',
+                (key, str(field), str(amount)),
+            )
+            row = conn.execute('SELECT value FROM kv_hash WHERE key = ? AND field = ?', (key, str(field))).fetchone()
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return int(row[0])
+
+    def hdel(self, key, *fields):
+        conn = self._conn()
+        self._live(conn, key)
+        return sum(conn.execute('DELETE FROM kv_hash WHERE key = ? AND field = ?', (key, str(field))).rowcount
+                   for field in fields)
+
+    def sadd(self, key, *members):
+        conn = self._conn()
+        self._live(conn, key)
+        return sum(conn.execute('INSERT OR IGNORE INTO kv_set (key, member) VALUES (?, ?)', (key, str(member))).rowcount
+                   for member in members)
+
+    def srem(self, key, *members):
+        conn = self._conn()
+        self._live(conn, key)
+        return sum(conn.execute('DELETE FROM kv_set WHERE key = ? AND member = ?', (key, str(member))).rowcount
+                   for member in members)
+
+    def smembers(self, key):
+        conn = self._conn()
+        self._live(conn, key)
+        return {member for (member,) in conn.execute('SELECT member FROM kv_set WHERE key = ?', (key,))}
+
+    def expire(self, key, seconds):
+        self._conn().execute(
+            'INSERT INTO kv_expiry (key, expires_at) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at',
+            (key, time.time() + seconds),
+        )
+        return True
+
+    def delete(self, *keys):
+        conn = self._conn()
+        return sum(self._delete(conn, key) for key in keys)
+
+    def purge_expired(self):
+        """Drop every expired key; returns how many were removed"""
+        conn = self._conn()
+        expired = [key for (key,) in conn.execute('SELECT key FROM kv_expiry WHERE expires_at <= ?', (time.time(),))]
+        for key in expired:
+            self._delete(conn, key)
+        return len(expired)
+
+
+def local_store_url(directory):
+    """A SQLite store in ``directory``, which is created private to this user"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return f"sqlite:///{os.path.join(directory, 'kv-store.sqlite3')}"
+
+
+def create_store(url):
+    """Build a store from a URL: memory://, sqlite:///path/to/file or redis://host:port/db"""
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return MemoryStore()
+    if scheme == 'sqlite':
+        return SQLiteStore(url[len('sqlite:///'):])
+    if scheme in ('redis', 'rediss', 'unix'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(f'The redis package is required for {url!r} (pip install redis).')
+        return redis.Redis.from_url(url, decode_responses=True)
+    raise ValueError(f'Unsupported store URL: {url!r}')
+
+
+def init_kv_store(app):
+    url = app.config['KV_STORE_URL'] or local_store_url(app.instance_path)
+    if urlparse(url).scheme in LOCAL_SCHEMES and not app.config['SINGLE_HOST']:
+        app.logger.warning(f"Key/value store {url} is local to this host: with more than one host serving "
+                           "traffic, set KV_STORE_URL to a Redis server they share (SINGLE_HOST=true silences this)")
+    app.extensions['kv_store'] = create_store(url)
@@ -1,14 +1,13 @@
-from app import create_app, init_db_and_admin, login_manager
-from models import User
+import os
+from app import create_app, init_db_and_admin
 
 app = create_app()
 
-with app.app_context():
+# Workers boot without touching the database; seed once per deploy with
+# `flask --app main seed-db`, or set SEED_ON_STARTUP=1 (e.g. for local development)
+if os.environ.get('SEED_ON_STARTUP', '').lower() in ('1', 'true', 'yes'):
     init_db_and_admin(app)
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(user_id)
-
 if __name__ == '__main__':
+    init_db_and_admin(app)
     app.run(debug=True)
@@ -0,0 +1,314 @@
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, abort, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from app import db
+
+# Prometheus text-format metrics without a client library. Each worker process
+# aggregates in memory (a dict update under a lock per observation) and
+# publishes a JSON snapshot to the shared key/value store at most every
+# METRICS_PUBLISH_INTERVAL seconds; /metrics merges the snapshots of every
+# worker on this host. Counters of workers that have exited stay in the sum
+# until METRICS_WORKER_TTL passes, so recycling workers does not look like a
+# counter reset; gauges only count workers that published recently. With the
+# memory:// store each worker only sees itself.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint.'),
+    'http_requests_in_flight': ('gauge', 'HTTP requests being served.'),
+    'db_queries_total': ('counter', 'SQL statements executed, by endpoint ("background" outside requests).'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent executing SQL statements, by endpoint.'),
+    'db_pool_checkouts_total': ('counter', 'Connections checked out of the pool.'),
+    'db_pool_timeouts_total': ('counter', 'Checkouts that gave up waiting for a free connection.'),
+    'db_pool_connects_total': ('counter', 'New database connections opened.'),
+    'db_pool_checkout_wait_seconds': ('histogram', 'Time spent waiting for a pooled connection.'),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out.'),
+    'supabase_request_duration_seconds': ('histogram', 'Supabase API call latency by operation.'),
+    'supabase_errors_total': ('counter', 'Failed Supabase API calls by operation.'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).'),
+    'orders_placed_total': ('counter', 'Orders placed.'),
+    'checkout_failures_total': ('counter', 'Order placements rejected, by reason.'),
+    'metrics_workers': ('gauge', 'Worker processes whose metrics are included.'),
+}
+
+
+class Metrics:
+    """In-memory counters, gauges and histograms for one worker process"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._published = 0.0
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add(self, name, amount, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-2] += 1
+            counts[-1] += value
+
+    def snapshot(self, extra=()):
+        """A JSON-able copy: {'updated', 'counters', 'gauges', 'histograms'}; ``extra`` entries are merged in"""
+        with self._lock:
+            data = {
+                'updated': time.time(),
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self._gauges.items()],
+                'histograms': [[name, labels, list(self.buckets), counts] for (name, labels), counts in self._histograms.items()],
+            }
+        for kind, entries in extra:
+            data[kind].extend(entries)
+        return data
+
+
+def _pool_entries():
+    # The connection pools keep their own per-worker numbers (dbpool.PoolMetrics), one per bind
+    from dbpool import pool_name
+    pool_metrics = current_app.extensions.get('db_pool_metrics')
+    if pool_metrics is None:
+        return []
+    counters, histograms, gauges = [], [], []
+    for bind_key, metrics in pool_metrics.items():
+        snap = metrics.snapshot(db.engines[bind_key].pool, current_app.config['DB_MAX_OVERFLOW'])
+        labels = [['pool', pool_name(bind_key)]]
+        wait = snap['wait_ms']
+        bounds = [bucket['le_ms'] / 1000 for bucket in wait['buckets'][:-1]]
+        cumulative = [bucket['count'] for bucket in wait['buckets']]
+        counts = [count - previous for count, previous in zip(cumulative, [0] + cumulative[:-1])]
+        counters += [['db_pool_checkouts_total', labels, snap['checkouts']],
+                     ['db_pool_timeouts_total', labels, snap['timeouts']],
+                     ['db_pool_connects_total', labels, snap['connects']]]
+        histograms.append(['db_pool_checkout_wait_seconds', labels, bounds, counts + [wait['sum'] / 1000]])
+        if 'checked_out' in snap['pool']:
+            gauges.append(['db_pool_checked_out', labels, snap['pool']['checked_out']])
+    return [('counters', counters), ('histograms', histograms), ('gauges', gauges)]
+
+
+def _worker_key():
+    return f'metrics:workers:{socket.gethostname()}'
+
+
+def publish(app, metrics, final=False):
+    """Write this worker's snapshot to the shared store; ``final`` zeroes its gauges (worker exit)"""
+    with app.app_context():
+        data = metrics.snapshot(_pool_entries())
+    if final:
+        data['gauges'] = []
+    metrics._published = time.monotonic()
+    app.extensions['kv_store'].hset(_worker_key(), str(os.getpid()), json.dumps(data))
+
+
+def collect(app):
+    """Merge every worker's latest snapshot into {(kind, name, labels): value}"""
+    store = app.extensions['kv_store']
+    now = time.time()
+    ttl = app.config['METRICS_WORKER_TTL']
+    gauge_age = max(2 * app.config['METRICS_PUBLISH_INTERVAL'], 30)
+    merged, workers, stale = {}, 0, []
+    for pid, raw in store.hgetall(_worker_key()).items():
+        data = json.loads(raw)
+        age = now - data['updated']
+        if age > ttl:
+            stale.append(pid)
+            continue
+        workers += 1
+        kinds = ('counters', 'gauges') if age <= gauge_age else ('counters',)
+        for kind in kinds:
+            for name, labels, value in data[kind]:
+                key = (kind, name, tuple(map(tuple, labels)))
+                merged[key] = merged.get(key, 0) + value
+        for name, labels, bounds, counts in data['histograms']:
+            key = ('histograms', name, tuple(map(tuple, labels)))
+            if key in merged:
+                merged[key] = (bounds, [a + b for a, b in zip(merged[key][1], counts)])
+            else:
+                merged[key] = (bounds, counts)
+    if stale:
+        store.hdel(_worker_key(), *stale)
+    merged[('gauges', 'metrics_workers', ())] = workers
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    """Prometheus text exposition format (version 0.0.4)"""
+    by_name = {}
+    for (kind, name, labels), value in merged.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        samples = by_name.get(name)
+        if not samples:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(samples, key=lambda sample: sample[0]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            bounds, counts = value
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", _number(float(bound)))])} {cumulative}')
+            cumulative += counts[len(bounds)]
+            lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(float(counts[-1]))}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    """This worker's Metrics, or None when metrics are off or there is no app context"""
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+
+def count(name, amount=1, **labels):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.inc(name, amount, **labels)
+
+
+def count_cache(cache, hit):
+    count('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def supabase_call(operation, metrics=None):
+    """Time a Supabase API call; pass ``metrics`` from threads that have no app context"""
+    metrics = metrics or get_metrics()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if metrics is not None:
+            metrics.inc('supabase_errors_total', operation=operation)
+        raise
+    finally:
+        if metrics is not None:
+            metrics.observe('supabase_request_duration_seconds', time.perf_counter() - start, operation=operation)
+
+
+def _endpoint():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'background'
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    # Not served at all without a token: behind the proxy every request looks local
+    if 'metrics' not in current_app.extensions or not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    app = current_app._get_current_object()
+    publish(app, app.extensions['metrics'])  # Include this worker's latest numbers
+    return Response(render(collect(app)), mimetype='text/plain; version=0.0.4')
+
+
+def retire_worker(app):
+    """Publish a last snapshot before the worker exits (gunicorn worker_exit)"""
+    metrics = app.extensions.get('metrics')
+    if metrics is not None:
+        publish(app, metrics, final=True)
+
+
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    metrics = app.extensions['metrics'] = Metrics()
+    interval = app.config['METRICS_PUBLISH_INTERVAL']
+
+    def start_request():
+        g._metrics_start = time.perf_counter()
+        metrics.add('http_requests_in_flight', 1)
+
+    def note_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    def finish_request(exc):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        endpoint = _endpoint()
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method,
+                    status=str(g.pop('_metrics_status', 500)))
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint)
+        metrics.add('http_requests_in_flight', -1)
+        if time.monotonic() - metrics._published >= interval:
+            try:
+                publish(app, metrics)
+            except Exception as e:
+                app.logger.warning(f"Could not publish metrics: {e}")
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get('metrics_query_start')
+        if start_times:
+            endpoint = _endpoint()
+            metrics.inc('db_queries_total', endpoint=endpoint)
+            metrics.inc('db_query_duration_seconds_total', time.perf_counter() - start_times.pop(), endpoint=endpoint)
+
+    def handle_error(exception_context):
+        start_times = exception_context.connection.info.get('metrics_query_start') if exception_context.connection else None
+        if start_times:
+            start_times.pop()
+
+    app.before_request(start_request)
+    app.after_request(note_status)
+    app.teardown_request(finish_request)
+    with app.app_context():
+        for engine in db.engines.values():  # The primary and any read replicas
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+            event.listen(engine, 'handle_error', handle_error)
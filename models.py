@@ -53,11 +53,12 @@ class Product(db.Model):
     image_url = db.Column(db.String(200), default=None) # Primary image
     brand = db.Column(db.String(100), nullable=True)
     dimensions = db.Column(db.String(200), nullable=True) # e.g., "Large: 35.5x25.4x3.8 cm, Medium: ..."
-    ratings = db.Column(db.Numeric(2, 1), default=0.0)
+    # Sort keys of the keyset-paginated listing are NOT NULL (see catalog.fill_null_sort_keys)
+    ratings = db.Column(db.Numeric(2, 1), nullable=False, default=0.0, server_default='0')
     num_ratings = db.Column(db.Integer, default=0)
-    sales_count = db.Column(db.Integer, default=0) # For "200+ bought in past month"
+    sales_count = db.Column(db.Integer, nullable=False, default=0, server_default='0') # For "200+ bought in past month"
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.current_timestamp())
     
     # Relationships
     product_images = db.relationship('ProductImage', backref='product', lazy=True, cascade='all, delete-orphan')
@@ -65,6 +66,17 @@ class Product(db.Model):
     cart_items = db.relationship('Cart', backref='product', lazy=True)
     wishlist_items = db.relationship('Wishlist', backref='product', lazy=True)
 
+    # Composite indexes backing the keyset-paginated product listing (see catalog.SORT_OPTIONS)
+    __table_args__ = (
+        db.Index('ix_products_active_category_created', 'is_active', 'category_id', 'created_at', 'id'),
+        db.Index('ix_products_active_created', 'is_active', 'created_at', 'id'),
+        db.Index('ix_products_active_price', 'is_active', 'price', 'id'),
+        db.Index('ix_products_active_ratings', 'is_active', 'ratings', 'id'),
+        db.Index('ix_products_active_sales', 'is_active', 'sales_count', 'id'),
+        # Seller pages: a seller's products, and their low-stock subset
+        db.Index('ix_products_super_admin_stock', 'super_admin_id', 'stock'),
+    )
+
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
     
@@ -85,12 +97,17 @@ class Order(db.Model):
     payment_status = db.Column(db.String(50), nullable=False, default='pending')  # pending, paid, failed
     shipping_address = db.Column(db.Text, nullable=False)
     phone = db.Column(db.String(20))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.current_timestamp())
     expected_delivery_date = db.Column(db.DateTime)
     
     # Relationships
     order_items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     payment = db.relationship('Payment', backref='order', uselist=False, cascade='all, delete-orphan')
+
+    # Newest-first order listings walk this index (see queries.paginate_seller_orders)
+    __table_args__ = (
+        db.Index('ix_orders_created', 'created_at', 'id'),
+    )
     
     def __init__(self, **kwargs):
         super(Order, self).__init__(**kwargs)
@@ -122,6 +139,11 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Numeric(10, 2), nullable=False)  # Price at the time of order
 
+    __table_args__ = (
+        # Finds the orders containing a seller's products without scanning order_items
+        db.Index('ix_order_items_product_order', 'product_id', 'order_id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -141,6 +163,11 @@ class Cart(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # One line per product; cart writes upsert against it (see upserts.upsert)
+    __table_args__ = (
+        db.Index('ux_cart_user_product', 'user_id', 'product_id', unique=True),
+    )
+
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
     
@@ -149,6 +176,11 @@ class Wishlist(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # One entry per product; the wishlist toggle relies on it for INSERT ... ON CONFLICT DO NOTHING
+    __table_args__ = (
+        db.Index('ux_wishlist_user_product', 'user_id', 'product_id', unique=True),
+    )
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     
@@ -159,3 +191,50 @@ class Payment(db.Model):
     payment_status = db.Column(db.String(50), nullable=False, default='pending')
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    # Version counters shared by all workers so process-local caches can tell when to reload
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class DailySalesRollup(db.Model):
+    __tablename__ = 'daily_sales_rollup'
+
+    # Per-day order totals kept up to date by analytics.record_order_placed/record_order_cancelled
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    cancelled_count = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class OrderStatusCount(db.Model):
+    __tablename__ = 'order_status_counts'
+
+    # Orders per status, kept up to date by analytics.record_order_placed/record_status_change
+    status = db.Column(db.String(50), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductSales(db.Model):
+    __tablename__ = 'product_sales'
+
+    # Units ordered per product (cancelled orders included), kept up to date by analytics.record_order_placed
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+
+    # The dashboard's best sellers walk this index
+    __table_args__ = (
+        db.Index('ix_product_sales_units', 'units_sold', 'product_id'),
+    )
+
+class SellerStats(db.Model):
+    __tablename__ = 'seller_stats'
+
+    # Per-seller dashboard figures kept up to date by analytics (orders net of cancellations)
+    seller_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    low_stock_count = db.Column(db.Integer, nullable=False, default=0)
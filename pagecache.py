@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, request, session, Response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+from models import Product, ProductImage, Category
+from assets import get_asset_manifest
+from caching import LRUCache, note_version_change, version_map
+from metrics import count_cache
+
+# Conditional GET and rendered-HTML caching for anonymous catalog pages.
+#
+# Every committed change to products, their images or categories (ORM edits
+# and bulk statements such as stock reservations alike) bumps the 'catalog'
+# counter in cache_versions (see caching.VersionMap). Page ETags are derived
+# from that counter, which each process re-reads at most every
+# CACHE_VERSION_CHECK_INTERVAL seconds, so a revalidation usually costs no
+# database query at all.
+
+CATALOG_GENERATION = 'catalog'
+CATALOG_TABLES = {Product.__tablename__, ProductImage.__tablename__, Category.__tablename__}
+CATALOG_MODELS = (Product, ProductImage, Category)
+
+
+class PageCache:
+    """ETag validators for catalog pages plus a bounded LRU of rendered HTML.
+
+    The LRU holds at most ``max_entries`` pages and ``max_bytes`` of HTML and
+    is emptied whenever the catalog version moves; ``max_entries=0`` turns it
+    off while keeping conditional GET.
+    """
+
+    def __init__(self, versions, salt='', max_entries=512, max_bytes=32 * 1024 * 1024):
+        self.versions = versions
+        self.salt = salt
+        self.pages = LRUCache(max_entries, max_bytes)
+        self._lock = threading.Lock()
+        self._version = None
+
+    def catalog_version(self):
+        """(version, change time) of the catalog; the time is when this process first saw the version"""
+        version, seen_at = self.versions.current()
+        return version, datetime.fromtimestamp(int(seen_at), timezone.utc)
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                self.pages.clear()
+                self._version = version
+                return None
+        return self.pages.get(key)
+
+    def put(self, key, version, body):
+        if version == self._version:
+            self.pages.put(key, body)
+
+
+def _applies():
+    # Pages differ per user and flashed messages are one-off, so only plain anonymous views qualify
+    return (request.method in ('GET', 'HEAD') and '_flashes' not in session
+            and not current_user.is_authenticated)
+
+
+def conditional_page(view):
+    """Serve an anonymous catalog page with ETag/Last-Modified validators and the HTML LRU"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions['page_cache']
+        if not _applies():
+            return view(*args, **kwargs)
+
+        version, last_modified = cache.catalog_version()
+        etag = hashlib.sha1(
+            f'{cache.salt}:{version}:{get_asset_manifest().version}:{request.full_path}'.encode()
+        ).hexdigest()
+
+        def finish(response):
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return finish(Response(status=304))
+
+        body = cache.get(etag, version)
+        count_cache('page', body is not None)
+        if body is not None:
+            return finish(Response(body, mimetype='text/html'))
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.mimetype != 'text/html' or '_flashes' in session:
+            return response
+        cache.put(etag, version, response.get_data())
+        return finish(response)
+    return wrapper
+
+
+def _note_catalog_flush(session, flush_context):
+    changed = list(session.new) + list(session.deleted)
+    changed += [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    if any(isinstance(obj, CATALOG_MODELS) for obj in changed):
+        note_version_change(session, CATALOG_GENERATION)
+
+
+def _note_catalog_statement(state):
+    # Bulk UPDATE/DELETE/INSERT run through the session, e.g. stock reservations
+    if (state.is_update or state.is_delete or state.is_insert) and \
+            getattr(state.statement, 'table', None) is not None and state.statement.table.name in CATALOG_TABLES:
+        note_version_change(state.session, CATALOG_GENERATION)
+
+
+event.listen(Session, 'after_flush', _note_catalog_flush)
+event.listen(Session, 'do_orm_execute', _note_catalog_statement)
+
+
+def _template_salt(app):
+    # Changes to templates (i.e. a deploy) must change every ETag
+    digest = hashlib.sha1()
+    template_folder = os.path.join(app.root_path, app.template_folder)
+    for root, _, files in sorted(os.walk(template_folder)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(f'{path}:{os.path.getmtime(path)}'.encode())
+    return digest.hexdigest()[:12]
+
+
+def init_page_cache(app):
+    app.extensions['page_cache'] = PageCache(
+        version_map(app, CATALOG_GENERATION),
+        salt=_template_salt(app),
+        max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['PAGE_CACHE_MAX_BYTES'],
+    )
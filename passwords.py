@@ -0,0 +1,46 @@
+from flask import current_app
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import db
+from models import User
+from jobs import get_job_queue
+
+# Password hashing with a configurable cost (PASSWORD_HASH_METHOD, any werkzeug
+# method string such as "scrypt:32768:8:1" or "pbkdf2:sha256:600000"). Hashes
+# made with other parameters keep working and are upgraded after the user's
+# next successful login.
+
+_method_prefixes = {}
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def _current_prefix():
+    # Werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"), so learn the stored form from one hash
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method not in _method_prefixes:
+        _method_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _current_prefix()
+
+
+def check_password(user, password):
+    """Verify ``password`` for ``user``, queueing a rehash when the stored hash uses other parameters"""
+    if not user.password_hash or not check_password_hash(user.password_hash, password):
+        return False
+    if needs_rehash(user.password_hash):
+        get_job_queue().submit(f'password rehash for user {user.id}', _rehash, user.id, user.password_hash, password)
+    return True
+
+
+def _rehash(user_id, old_hash, password):
+    # Only replaces the hash that was verified, never a password changed in the meantime
+    db.session.execute(
+        update(User).where(User.id == user_id, User.password_hash == old_hash).values(password_hash=hash_password(password))
+    )
+    db.session.commit()
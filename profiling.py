@@ -0,0 +1,185 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from app import db
+
+logger = logging.getLogger('profiling')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_RE = re.compile(r'%\([^)]+\)s|%s|:\w+|\$\d+')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*(?:\?\s*,\s*)*\?\s*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(statement):
+    """Collapse literals, bind parameters and IN lists so equivalent statements group together"""
+    sql = _STRING_RE.sub('?', statement)
+    sql = _PARAM_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class HotStatements:
+    """Rolling per-worker aggregate of statement timings, grouped by normalized SQL.
+
+    Timings are kept in two windows of ``window`` seconds each (current and
+    previous), so the view always covers between one and two windows of recent
+    traffic. Each window holds at most ``max_entries`` distinct statements.
+    """
+
+    def __init__(self, window=300, max_entries=500):
+        self.window = window
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._window_start = time.monotonic()
+
+    def record(self, sql, duration_ms):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.window:
+                # A window with no traffic leaves nothing worth carrying over
+                self._previous = self._current if now - self._window_start < 2 * self.window else {}
+                self._current = {}
+                self._window_start = now
+
+            stats = self._current.get(sql)
+            if stats is None:
+                if len(self._current) >= self.max_entries:
+                    cheapest = min(self._current, key=lambda key: self._current[key][1])
+                    del self._current[cheapest]
+                stats = self._current[sql] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += duration_ms
+            stats[2] = max(stats[2], duration_ms)
+
+    def top(self, limit=50):
+        """Statements ordered by total time spent, as dicts"""
+        with self._lock:
+            merged = {}
+            for bucket in (self._previous, self._current):
+                for sql, (count, total, slowest) in bucket.items():
+                    stats = merged.setdefault(sql, [0, 0.0, 0.0])
+                    stats[0] += count
+                    stats[1] += total
+                    stats[2] = max(stats[2], slowest)
+
+        rows = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [{
+            'sql': sql,
+            'count': count,
+            'total_ms': round(total, 2),
+            'avg_ms': round(total / count, 2),
+            'max_ms': round(slowest, 2),
+        } for sql, (count, total, slowest) in rows]
+
+    def reset(self):
+        with self._lock:
+            self._current = {}
+            self._previous = {}
+            self._window_start = time.monotonic()
+
+
+def get_hot_statements():
+    return current_app.extensions['hot_statements']
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    duration_ms = (time.perf_counter() - start_times.pop()) * 1000
+    sql = normalize_sql(statement)
+    _record(sql, duration_ms)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    start_times = exception_context.connection.info.get('query_start_time') if exception_context.connection else None
+    if start_times:
+        start_times.pop()
+
+
+def _record(sql, duration_ms):
+    if not has_app_context():
+        return
+    config = current_app.config
+    hot_statements = current_app.extensions.get('hot_statements')
+    if hot_statements is None:
+        return
+    hot_statements.record(sql, duration_ms)
+
+    if duration_ms >= config['SQL_SLOW_QUERY_MS']:
+        logger.warning(json.dumps({'event': 'slow_query', 'duration_ms': round(duration_ms, 2), 'sql': sql}))
+
+    if not has_request_context():
+        return
+    g._db_query_count = g.get('_db_query_count', 0) + 1
+    g._db_time_ms = g.get('_db_time_ms', 0.0) + duration_ms
+
+    # Keep only the N slowest statements of the request
+    slowest = g.setdefault('_db_slowest', [])
+    slowest.append((duration_ms, sql))
+    if len(slowest) > config['SQL_PROFILER_TOP_N']:
+        slowest.sort(key=lambda item: item[0], reverse=True)
+        del slowest[config['SQL_PROFILER_TOP_N']:]
+
+
+def _start_request_timer():
+    g._request_start = time.perf_counter()
+
+
+def _emit_request_profile(response):
+    start = g.pop('_request_start', None)
+    if start is None:
+        return response
+
+    total_ms = (time.perf_counter() - start) * 1000
+    query_count = g.get('_db_query_count', 0)
+    db_ms = g.get('_db_time_ms', 0.0)
+    slowest = sorted(g.get('_db_slowest', []), key=lambda item: item[0], reverse=True)
+
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={db_ms:.2f};desc="{query_count} queries", app;dur={max(total_ms - db_ms, 0):.2f}, total;dur={total_ms:.2f}'
+    )
+    logger.info(json.dumps({
+        'event': 'request',
+        'method': request.method,
+        'endpoint': request.endpoint,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(total_ms, 2),
+        'db_queries': query_count,
+        'db_time_ms': round(db_ms, 2),
+        'slowest': [{'duration_ms': round(duration, 2), 'sql': sql} for duration, sql in slowest],
+    }))
+    return response
+
+
+def init_profiling(app):
+    if not app.config['SQL_PROFILER_ENABLED']:
+        return
+    app.extensions['hot_statements'] = HotStatements(
+        window=app.config['SQL_PROFILER_WINDOW'],
+        max_entries=app.config['SQL_PROFILER_MAX_STATEMENTS'],
+    )
+    with app.app_context():
+        for engine in db.engines.values():  # The primary and any read replicas
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+    app.before_request(_start_request_timer)
+    app.after_request(_emit_request_profile)
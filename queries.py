@@ -0,0 +1,127 @@
+from collections import namedtuple
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import desc, event, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+from app import db
+from models import Product, Order, OrderItem, Wishlist
+from catalog import pack_cursor, unpack_cursor
+
+# Query builders with explicit eager-loading graphs, so the customer and admin
+# pages render their rows without one lazy SELECT per product, category or owner.
+
+
+def _product_card_options(path):
+    """Eager-load the category and owner shown next to a product"""
+    return (
+        path.joinedload(Product.category),
+        path.joinedload(Product.owner),
+    )
+
+
+def load_wishlist(user_id):
+    """Wishlist entries for a user with their product, category and seller in one SELECT"""
+    return Wishlist.query.filter_by(user_id=user_id).options(
+        *_product_card_options(joinedload(Wishlist.product))
+    ).order_by(Wishlist.id).all()
+
+
+def load_orders(customer_id):
+    """A customer's orders, newest first, with lines and products in two SELECTs"""
+    return Order.query.filter_by(customer_id=customer_id).options(
+        *_product_card_options(selectinload(Order.order_items).joinedload(OrderItem.product))
+    ).order_by(desc(Order.created_at)).all()
+
+
+def seller_orders_query(seller_id):
+    """Orders containing at least one of a seller's products, with customer and lines preloaded"""
+    seller_order_ids = db.session.query(OrderItem.order_id).join(Product).filter(
+        Product.super_admin_id == seller_id
+    )
+    return Order.query.filter(Order.id.in_(seller_order_ids)).options(
+        joinedload(Order.customer),
+        selectinload(Order.order_items).joinedload(OrderItem.product),
+    ).order_by(desc(Order.created_at))
+
+
+OrderPage = namedtuple('OrderPage', ['items', 'next_cursor', 'per_page'])
+
+
+def paginate_seller_orders(seller_id, cursor=None, per_page=25):
+    """One newest-first keyset page of a seller's orders (see seller_orders_query)"""
+    query = seller_orders_query(seller_id).order_by(None)
+    if cursor:
+        created_at, last_id = unpack_cursor('seller_orders', cursor, 'datetime')
+        query = query.filter(tuple_(Order.created_at, Order.id) < tuple_(created_at, last_id))
+
+    rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        next_cursor = pack_cursor('seller_orders', items[-1].created_at, items[-1].id)
+    return OrderPage(items=items, next_cursor=next_cursor, per_page=per_page)
+
+
+def load_seller_low_stock(seller_id, threshold, limit=10):
+    """A seller's products below the stock threshold, lowest stock first"""
+    return Product.query.filter(
+        Product.super_admin_id == seller_id, Product.stock < threshold
+    ).options(joinedload(Product.category)).order_by(Product.stock, Product.id).limit(limit).all()
+
+
+def load_seller_products(seller_id):
+    """A seller's products with their category in one SELECT"""
+    return Product.query.filter_by(super_admin_id=seller_id).options(
+        joinedload(Product.category)
+    ).all()
+
+
+def load_product_detail(product_id):
+    """An active product with images, category and seller, or 404"""
+    return Product.query.filter_by(id=product_id, is_active=True).options(
+        selectinload(Product.product_images),
+        joinedload(Product.category),
+        joinedload(Product.owner),
+    ).first_or_404()
+
+
+# SELECT budget
+#
+# Every request counts the SELECT statements it issues. When the view has a
+# budget (@select_budget(n), falling back to SQL_SELECT_BUDGET) and goes over
+# it, testing mode fails the request with SelectBudgetExceeded and other modes
+# log a warning.
+
+class SelectBudgetExceeded(AssertionError):
+    pass
+
+
+def select_budget(limit):
+    def decorator(f):
+        f._select_budget = limit
+        return f
+    return decorator
+
+
+def _count_select(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+        g._select_count = g.get('_select_count', 0) + 1
+
+
+def _check_select_budget(response):
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, '_select_budget', current_app.config.get('SQL_SELECT_BUDGET'))
+    used = g.get('_select_count', 0)
+    if limit is not None and used > limit:
+        message = f"{request.endpoint} issued {used} SELECT statements (budget {limit})"
+        if current_app.testing:
+            raise SelectBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def init_select_budget(app):
+    with app.app_context():
+        for engine in db.engines.values():  # The primary and any read replicas
+            event.listen(engine, 'before_cursor_execute', _count_select)
+    app.after_request(_check_select_budget)
@@ -0,0 +1,173 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+# Read replica routing. Views marked @replica_reads send their SELECTs to one
+# of the DATABASE_REPLICA_URLS, picked once per request (round robin, skipping
+# replicas that failed recently) so a page never mixes replicas with different
+# lag; everything else, and every write, uses the primary. Replicas lag
+# the primary, so reads stay on the primary for REPLICA_STICKY_SECONDS after
+# (a) the user's own last write (read-your-writes, tracked in their session)
+# and (b) the catalog change this worker saw last, so the page, fragment and
+# category caches are never refilled from a replica that has not caught up.
+
+SESSION_KEY = '_primary_until'
+REPLICA_BIND_PREFIX = 'replica'
+
+
+class ReplicaSet:
+    """Round-robin choice among replica engines with passive health checks.
+
+    A replica is marked down when a connection to it fails and skipped for
+    ``retry_interval`` seconds. Before being used again (and before first
+    use) it is probed with ``SELECT 1``; if no replica is usable, callers
+    fall back to the primary.
+    """
+
+    def __init__(self, engines, retry_interval=30):
+        self.bind_keys = {engine: key for key, engine in engines.items()}
+        self.engines = list(engines.values())
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._healthy = set()
+        self._down_until = {}
+
+    def choose(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            if engine in self._healthy:
+                return engine
+            if time.monotonic() >= self._down_until.get(engine, 0) and self._probe(engine):
+                return engine
+        return None
+
+    def _probe(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+        except Exception as e:
+            self.mark_down(engine, e)
+            return False
+        with self._lock:
+            self._healthy.add(engine)
+        return True
+
+    def is_healthy(self, engine):
+        return engine in self._healthy
+
+    def mark_down(self, engine, error=None):
+        with self._lock:
+            self._healthy.discard(engine)
+            self._down_until[engine] = time.monotonic() + self.retry_interval
+        current_app.logger.warning(f"Read replica {engine.url.render_as_string(hide_password=True)} "
+                                   f"marked down for {self.retry_interval}s: {error}")
+
+    def status(self):
+        now = time.monotonic()
+        return [{
+            'bind': self.bind_keys[engine],
+            'url': engine.url.render_as_string(hide_password=True),
+            'healthy': engine in self._healthy,
+            'down_for': round(max(self._down_until.get(engine, 0) - now, 0), 1),
+        } for engine in self.engines]
+
+
+class RoutingSession(FlaskSession):
+    """Session that binds plain SELECTs to the request's replica while the request allows it"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if not getattr(clause, 'is_select', False):
+            self.info['replica_wrote'] = True  # DML, raw connection() use and anything else not known to be a read
+        elif bind is None and not self._flushing and getattr(clause, '_for_update_arg', None) is None:
+            engine = _request_replica()
+            # A replica that failed during this request is dropped for the rest of it
+            if engine is not None and current_app.extensions['replicas'].is_healthy(engine):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _request_replica():
+    return g.get('_replica') if has_request_context() else None
+
+
+def replica_reads(view):
+    """Let a read-only view's SELECTs go to a read replica (GET/HEAD only)"""
+    view._replica_reads = True
+    return view
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside a @replica_reads view, e.g. to fill a long-lived cache"""
+    if not has_request_context():
+        yield
+        return
+    previous = g.pop('_replica', None)
+    try:
+        yield
+    finally:
+        g._replica = previous
+
+
+def _route_request():
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, '_replica_reads', False) or request.method not in ('GET', 'HEAD'):
+        return
+    now = time.time()
+    if session.get(SESSION_KEY, 0) > now:
+        return
+    _, catalog_changed = current_app.extensions['page_cache'].catalog_version()
+    if now - catalog_changed.timestamp() < current_app.config['REPLICA_STICKY_SECONDS'] + 1:  # changed_at has 1s resolution
+        return
+    g._replica = current_app.extensions['replicas'].choose()  # None: no usable replica, read from the primary
+
+
+def _note_write(session_, flush_context):
+    session_.info['replica_wrote'] = True
+
+
+def _stick_to_primary(session_):
+    if session_.info.pop('replica_wrote', False) and has_request_context() and 'replicas' in current_app.extensions:
+        session[SESSION_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+
+def _discard_write(session_):
+    session_.info.pop('replica_wrote', None)
+
+
+event.listen(Session, 'after_flush', _note_write)
+event.listen(Session, 'after_commit', _stick_to_primary)
+event.listen(Session, 'after_rollback', _discard_write)
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated DATABASE_REPLICA_URLS value"""
+    return {f'{REPLICA_BIND_PREFIX}{i}': url.strip() for i, url in enumerate(urls.split(',')) if url.strip()}
+
+
+def init_replicas(app):
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        engines = {key: engine for key, engine in db.engines.items()
+                   if key is not None and key.startswith(REPLICA_BIND_PREFIX)}
+    if not engines:
+        return
+    replicas = app.extensions['replicas'] = ReplicaSet(engines, retry_interval=app.config['REPLICA_RETRY_INTERVAL'])
+
+    def handle_error(exception_context):
+        # Lost connections, and errors raised while connecting at all
+        if exception_context.is_disconnect or (exception_context.connection is None and
+                                               isinstance(exception_context.sqlalchemy_exception, DBAPIError)):
+            replicas.mark_down(exception_context.engine, exception_context.original_exception)
+
+    for engine in engines.values():
+        event.listen(engine, 'handle_error', handle_error)
+    app.before_request(_route_request)
@@ -1,69 +1,74 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session, abort, send_from_directory
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from app import db
-from models import User, Product, Category, Order, OrderItem, Cart, Wishlist, Payment, ProductImage
-from utils import admin_required, super_admin_required, generate_unique_code, allowed_file
-import os
-from datetime import datetime, timedelta
-from sqlalchemy import func, desc
-from app import supabase_client
-import io
-from supabase.lib.client_options import ClientOptions
+from models import User, Product, Category, Order, Wishlist, ProductImage
+from utils import admin_required, super_admin_required, generate_unique_code
+from catalog import paginate_products, paginate_ranked, InvalidCursor, SORT_LABELS, DEFAULT_SORT, RELEVANCE_SORT
+from search import get_search_backend
+from caching import get_categories
+from assets import get_asset_manifest
+from inventory import InsufficientStock
+from checkout import create_order, cancel_order as cancel_order_and_restock, set_order_status
+from analytics import get_dashboard_metrics, get_seller_stats, LOW_STOCK_THRESHOLD
+from carts import get_cart_service
+from upserts import insert_ignore
+from wishlists import get_wishlist_ids, invalidate_wishlist_ids
+from pagecache import conditional_page
+from dbpool import pool_snapshot
+from metrics import count
+from replicas import replica_reads
+from auth_jobs import session_jwt, JWT_SESSION_KEY
+from storage import upload_files, remove_uploaded, AuthenticatedSupabase, get_supabase_pool
+from queries import (load_wishlist, load_orders, seller_orders_query,
+                     paginate_seller_orders, load_seller_low_stock, load_seller_products, load_product_detail,
+                     select_budget)
+from datetime import datetime
+from sqlalchemy import desc, delete, literal, select
 import uuid # Import the uuid module
 
 main_bp = Blueprint('main', __name__)
 
 def get_authenticated_supabase_client():
-    jwt = session.get('supabase_jwt')
+    """(client, None), or (None, redirect) after flashing why there is no client"""
+    jwt, pending = session_jwt()
     if not jwt:
+        if pending:
+            # Still signed in; the background Supabase sign-in just has not finished, so retry from the dashboard
+            flash('Your Supabase session is still being set up. Please try again in a moment.', 'info')
+            return None, redirect(url_for('main.super_admin_dashboard'))
         flash('Supabase session not found. Please log in again.', 'error')
-        return None
+        return None, redirect(url_for('auth.login'))
     
-    # Create a new Supabase client with the authenticated JWT
-    from supabase import create_client
-    supabase_url = current_app.config["SUPABASE_URL"]
-    supabase_key = current_app.config["SUPABASE_KEY"]
-    
-    # Use ClientOptions to pass headers correctly
-    options = ClientOptions()
-    options.headers = {"Authorization": f"Bearer {jwt}"}
-    return create_client(supabase_url, supabase_key, options=options)
+    # Clients come from a per-process pool keyed by JWT and are only built when storage is used
+    client = AuthenticatedSupabase(get_supabase_pool(), jwt)
+    if client.expired:
+        session.pop(JWT_SESSION_KEY, None)
+        flash('Supabase session expired. Please log in again.', 'error')
+        return None, redirect(url_for('auth.login'))
+    return client, None
 
 
 @main_bp.route('/')
+@conditional_page
+@replica_reads
 def index():
     # Get featured products (latest 8 products)
     featured_products = Product.query.filter_by(is_active=True).order_by(desc(Product.created_at)).limit(8).all()
-    categories = Category.query.all()
-    
-    # Get slider images
-    slider_folder = os.path.join(current_app.root_path, 'static', 'Slider')
-    slider_images = []
-    if os.path.exists(slider_folder):
-        for filename in os.listdir(slider_folder):
-            if filename.lower().endswith( ('.png', '.jpg', '.jpeg', '.gif') ):
-                slider_images.append(url_for('static', filename=f'Slider/{filename}'))
-
-    # Get category icon images
-    category_icons_folder = os.path.join(current_app.root_path, 'static', 'Cat')
-    category_icon_map = {}
-    if os.path.exists(category_icons_folder):
-        for filename in os.listdir(category_icons_folder):
-            if filename.lower().endswith( ('.png', '.jpg', '.jpeg', '.gif') ):
-                # Assuming image filename matches category name (e.g., "Electronics.png" for "Electronics")
-                category_name_from_file = os.path.splitext(filename)[0].replace(' ', '_').replace('&', 'and') # Normalize for matching
-                category_icon_map[category_name_from_file] = url_for('static', filename=f'Cat/{filename}')
+    categories = get_categories()
+    
+    # Slider and category icon images come from the prebuilt asset manifest
+    manifest = get_asset_manifest()
+    slider_images = [manifest.image_sources(path, display_width=640) for path in manifest.slider_images()]
 
     # Attach icon URLs to categories
     categories_with_icons = []
     for category in categories:
-        normalized_category_name = category.name.replace(' ', '_').replace('&', 'and')
+        icon = manifest.category_icon(category.name)
         category_dict = {
             'id': category.id,
             'name': category.name,
             'description': category.description,
-            'icon_url': category_icon_map.get(normalized_category_name)
+            'icon': manifest.image_sources(icon, display_width=640) if icon else None
         }
         categories_with_icons.append(category_dict)
 
@@ -72,65 +77,67 @@ def index():
                            categories=categories_with_icons,
                            slider_images=slider_images)
 
+@main_bp.route('/img/<path:filename>')
+def image_derivative(filename):
+    # Resized homepage images; names are content-hashed, so they can be cached forever
+    manifest = get_asset_manifest()
+    if manifest.derivative_path(filename) is None:
+        abort(404)
+    response = send_from_directory(manifest.derived_folder, filename, max_age=31536000)
+    response.cache_control.immutable = True
+    return response
+
 # Admin Routes
 @main_bp.route('/admin/dashboard')
 @login_required
 @admin_required
+@replica_reads
 def admin_dashboard():
-    # Analytics data
-    total_orders = Order.query.count()
-    total_revenue = db.session.query(func.sum(Order.total_amount)).scalar() or 0
-    total_users = User.query.filter_by(role='customer').count()
-    total_super_admins = User.query.filter_by(role='super_admin').count()
-    
-    # Monthly revenue for last 6 months
-    monthly_revenue = []
-    for i in range(6):
-        start_date = datetime.now().replace(day=1) - timedelta(days=30*i)
-        end_date = (start_date + timedelta(days=32)).replace(day=1)
-        revenue = db.session.query(func.sum(Order.total_amount)).filter(
-            Order.created_at >= start_date,
-            Order.created_at < end_date
-        ).scalar() or 0
-        monthly_revenue.append({
-            'month': start_date.strftime('%B %Y'),
-            'revenue': float(revenue)
-        })
-    
-    # Order status breakdown
-    status_counts = db.session.query(
-        Order.status, func.count(Order.id)
-    ).group_by(Order.status).all()
-    status_counts = [{ "status": s, "count": c } for s, c in status_counts]
-
-    # Top selling products
-    top_products = db.session.query(
-        Product.name, func.sum(OrderItem.quantity).label('total_sold')
-    ).join(OrderItem).group_by(Product.id).order_by(desc('total_sold')).limit(5).all()
-    top_products = [{ "name": p, "total_sold": s } for p, s in top_products]
-
-    # Recent orders
-    recent_orders = Order.query.order_by(desc(Order.created_at)).limit(10).all()
-    recent_orders = [order.to_dict() for order in recent_orders] # Assuming Order model has a to_dict method
-
-    return render_template('admin/dashboard.html',
-                         total_orders=total_orders,
-                         total_revenue=total_revenue,
-                         total_users=total_users,
-                         total_super_admins=total_super_admins,
-                         monthly_revenue=monthly_revenue,
-                         status_counts=status_counts,
-                         top_products=top_products,
-                         recent_orders=recent_orders)
+    # Aggregates come from the daily sales rollup and are cached briefly per worker
+    return render_template('admin/dashboard.html', **get_dashboard_metrics())
 
 @main_bp.route('/admin/super-admins')
 @login_required
 @admin_required
 def admin_super_admins():
     super_admins = User.query.filter_by(role='super_admin').all()
-    categories = Category.query.all() # Fetch all categories
+    categories = get_categories()
     return render_template('admin/super_admins.html', super_admins=super_admins, categories=categories)
 
+@main_bp.route('/admin/queries')
+@login_required
+@admin_required
+def admin_queries():
+    hot_statements = current_app.extensions.get('hot_statements')
+    statements = hot_statements.top(50) if hot_statements else []
+    return render_template('admin/queries.html',
+                           statements=statements,
+                           profiler_enabled=hot_statements is not None,
+                           window=current_app.config['SQL_PROFILER_WINDOW'])
+
+@main_bp.route('/admin/queries/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_admin_queries():
+    hot_statements = current_app.extensions.get('hot_statements')
+    if hot_statements:
+        hot_statements.reset()
+        flash('Query statistics reset.', 'success')
+    return redirect(url_for('main.admin_queries'))
+
+@main_bp.route('/admin/db-pool')
+@login_required
+@admin_required
+def admin_db_pool():
+    # Per worker: each gunicorn process has its own pool, so repeated calls may land on different workers
+    # Top level is the primary's pool; each replica carries its own pool numbers
+    config = current_app.config
+    replicas = current_app.extensions.get('replicas')
+    return jsonify(pool_snapshot() | {'settings': {key.lower(): config[key] for key in (
+        'DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE',
+        'DB_POOL_PRE_PING', 'DB_STATEMENT_CACHE_SIZE', 'DB_PGBOUNCER')},
+        'replicas': [status | {'pool': pool_snapshot(status['bind'])} for status in replicas.status()] if replicas else []})
+
 @main_bp.route('/admin/create-super-admin', methods=['POST'])
 @login_required
 @admin_required
@@ -194,34 +201,19 @@ def toggle_super_admin(user_id):
 @main_bp.route('/super-admin/dashboard')
 @login_required
 @super_admin_required
+@replica_reads
 def super_admin_dashboard():
-    # Get super admin's products and stats
-    products_count = Product.query.filter_by(super_admin_id=current_user.id).count()
-    
-    # Orders for super admin's products
-    orders_count = db.session.query(Order).join(OrderItem).join(Product).filter(
-        Product.super_admin_id == current_user.id
-    ).count()
-    
-    # Revenue from super admin's products
-    revenue = db.session.query(func.sum(OrderItem.price * OrderItem.quantity)).join(Product).filter(
-        Product.super_admin_id == current_user.id
-    ).scalar() or 0
-    
-    # Low stock products (less than 10)
-    low_stock_products = Product.query.filter_by(
-        super_admin_id=current_user.id
-    ).filter(Product.stock < 10).all()
-    
-    # Recent orders for super admin's products
-    recent_orders = db.session.query(Order).join(OrderItem).join(Product).filter(
-        Product.super_admin_id == current_user.id
-    ).order_by(desc(Order.created_at)).limit(10).all()
+    # Counters come from the seller_stats summary row, kept current as orders and products change
+    stats = get_seller_stats(current_user.id)
+    low_stock_products = load_seller_low_stock(current_user.id, LOW_STOCK_THRESHOLD)
+    recent_orders = seller_orders_query(current_user.id).limit(10).all()
     
     return render_template('super_admin/dashboard.html',
-                         products_count=products_count,
-                         orders_count=orders_count,
-                         revenue=revenue,
+                         products_count=stats.product_count,
+                         orders_count=stats.order_count,
+                         revenue=stats.revenue or 0,
+                         units_sold=stats.units_sold,
+                         low_stock_count=stats.low_stock_count,
                          low_stock_products=low_stock_products,
                          recent_orders=recent_orders)
 
@@ -229,18 +221,18 @@ def super_admin_dashboard():
 @login_required
 @super_admin_required
 def super_admin_products():
-    products = Product.query.filter_by(super_admin_id=current_user.id).all()
+    products = load_seller_products(current_user.id)
     return render_template('super_admin/products.html', products=products)
 
 @main_bp.route('/super-admin/add-product', methods=['GET', 'POST'])
 @login_required
 @super_admin_required
 def add_product():
-    authenticated_supabase_client = get_authenticated_supabase_client()
+    authenticated_supabase_client, fallback = get_authenticated_supabase_client()
     if not authenticated_supabase_client:
-        return redirect(url_for('auth.login')) # Redirect to login if no JWT
+        return fallback
 
-    categories = Category.query.all()
+    categories = get_categories()
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -259,6 +251,7 @@ def add_product():
             flash('Please fill in all required fields.', 'error')
             return redirect(url_for('main.add_product')) # Redirect on validation error
         
+        upload_results = []
         try:
             product = Product(
                 name=name,
@@ -275,51 +268,24 @@ def add_product():
                 sales_count=int(sales_count) if sales_count else 0
             )
             
-            # Handle multiple image uploads
-            files = request.files.getlist('images')
-            uploaded_image_urls = []
-            if files:
-                for i, file in enumerate(files):
-                    if file and file.filename and allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{filename}"
-                        
-                        # Upload to Supabase Storage
-                        try:
-                            bucket_name = current_app.config["SUPABASE_PRODUCTS_BUCKET"]
-                            with io.BytesIO(file.read()) as data:
-                                res = authenticated_supabase_client.storage.from_(bucket_name).upload(filename, data.getvalue(), {"content-type": file.content_type})
-                            
-                            # Supabase upload response is usually a dictionary on success with 'Key' or 'path', or raises exception on error
-                            # Check if res is a dictionary and contains an error key (though client library usually raises exceptions for errors)
-                            if isinstance(res, dict) and res.get('error'):
-                                upload_error = res['error'].get('message', 'Unknown Supabase upload error')
-                                current_app.logger.error(f"Supabase upload error for {filename}: {upload_error}")
-                                raise Exception(upload_error)
-                            
-                            # Get public URL
-                            public_url_response = authenticated_supabase_client.storage.from_(bucket_name).get_public_url(filename)
-                            
-                            image_url = public_url_response
-                            uploaded_image_urls.append(image_url)
-                        except Exception as e:
-                            flash(f'Failed to upload image to Supabase: {str(e)}', 'error')
-                            current_app.logger.error(f"Supabase upload exception: {e}")
-                            # Optionally, skip this image and continue or return early
-                            continue
-
-                        # file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                        # file.save(file_path)
-                        # image_url = f"/static/uploads/{filename}"
-                        
-                        product_image = ProductImage(
-                            image_url=image_url,
-                            is_primary=(i == 0) # Set the first image as primary
-                        )
-                        product.product_images.append(product_image)
-
-                if uploaded_image_urls:
-                    product.image_url = uploaded_image_urls[0] # Set the primary image URL in the Product model
+            # Handle multiple image uploads (concurrently, see storage.upload_files)
+            bucket_name = current_app.config["SUPABASE_PRODUCTS_BUCKET"]
+            upload_results = upload_files(authenticated_supabase_client, bucket_name, request.files.getlist('images'))
+            uploaded = [result for result in upload_results if result.url]
+            for result in upload_results:
+                if result.error:
+                    flash(f'Failed to upload image {result.original_name} to Supabase: {result.error}', 'error')
+                    current_app.logger.error(f"Supabase upload exception for {result.object_name}: {result.error}")
+
+            for position, result in enumerate(uploaded):
+                product_image = ProductImage(
+                    image_url=result.url,
+                    is_primary=(position == 0) # The first successful upload is the primary image
+                )
+                product.product_images.append(product_image)
+
+            if uploaded:
+                product.image_url = uploaded[0].url # Set the primary image URL in the Product model
             
             db.session.add(product)
             db.session.commit()
@@ -328,6 +294,9 @@ def add_product():
             
         except Exception as e:
             db.session.rollback()
+            # Don't leave uploaded objects behind without ProductImage rows pointing at them
+            if upload_results:
+                remove_uploaded(authenticated_supabase_client, bucket_name, upload_results)
             flash(f'Failed to add product: {str(e)}', 'error')
     
     return render_template('super_admin/add_product.html', categories=categories)
@@ -336,14 +305,15 @@ def add_product():
 @login_required
 @super_admin_required
 def edit_product(product_id):
-    authenticated_supabase_client = get_authenticated_supabase_client()
+    authenticated_supabase_client, fallback = get_authenticated_supabase_client()
     if not authenticated_supabase_client:
-        return redirect(url_for('auth.login')) # Redirect to login if no JWT
+        return fallback
 
     product = Product.query.filter_by(id=product_id, super_admin_id=current_user.id).first_or_404()
-    categories = Category.query.all()
+    categories = get_categories()
     
     if request.method == 'POST':
+        upload_results = []
         try:
             product.name = request.form.get('name')
             product.description = request.form.get('description')
@@ -357,52 +327,34 @@ def edit_product(product_id):
             product.num_ratings = int(request.form.get('num_ratings')) if request.form.get('num_ratings') else 0
             product.sales_count = int(request.form.get('sales_count')) if request.form.get('sales_count') else 0
 
-            # Handle multiple image uploads for existing product
-            files = request.files.getlist('images')
-            if files:
-                for i, file in enumerate(files):
-                    if file and file.filename and allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{filename}"
-                        
-                        # Upload to Supabase Storage
-                        try:
-                            bucket_name = current_app.config["SUPABASE_PRODUCTS_BUCKET"]
-                            with io.BytesIO(file.read()) as data:
-                                res = authenticated_supabase_client.storage.from_(bucket_name).upload(filename, data.getvalue(), {"content-type": file.content_type})
-                                    
-                            if isinstance(res, dict) and res.get('error'):
-                                upload_error = res['error'].get('message', 'Unknown Supabase upload error during edit')
-                                current_app.logger.error(f"Supabase upload error for {filename} during edit: {upload_error}")
-                                raise Exception(upload_error)
-
-                            # Get public URL
-                            public_url_response = authenticated_supabase_client.storage.from_(bucket_name).get_public_url(filename)
-                            image_url = public_url_response
-                        except Exception as e:
-                            flash(f'Failed to upload image to Supabase: {str(e)}', 'error')
-                            current_app.logger.error(f"Supabase upload exception during edit: {str(e)}")
-                            continue
-
-                        # file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                        # file.save(file_path)
-                        # image_url = f"/static/uploads/{filename}"
-                        
-                        product_image = ProductImage(
-                            product_id=product.id,
-                            image_url=image_url,
-                            is_primary=(len(product.product_images) == 0 and i == 0) # Set as primary if no images exist and it's the first upload
-                        )
-                        db.session.add(product_image)
-                        if len(product.product_images) == 0 and i == 0:
-                            product.image_url = image_url # Update primary image if none existed
+            # Handle multiple image uploads for existing product (concurrently, see storage.upload_files)
+            bucket_name = current_app.config["SUPABASE_PRODUCTS_BUCKET"]
+            upload_results = upload_files(authenticated_supabase_client, bucket_name, request.files.getlist('images'))
+            uploaded = [result for result in upload_results if result.url]
+            for result in upload_results:
+                if result.error:
+                    flash(f'Failed to upload image {result.original_name} to Supabase: {result.error}', 'error')
+                    current_app.logger.error(f"Supabase upload exception during edit for {result.object_name}: {result.error}")
+
+            had_images = len(product.product_images) > 0
+            for position, result in enumerate(uploaded):
+                is_primary = not had_images and position == 0 # Set as primary if no images exist and it's the first upload
+                product_image = ProductImage(
+                    product_id=product.id,
+                    image_url=result.url,
+                    is_primary=is_primary
+                )
+                db.session.add(product_image)
+                if is_primary:
+                    product.image_url = result.url # Update primary image if none existed
 
-            
             db.session.commit()
             flash('Product updated successfully!', 'success')
             return redirect(url_for('main.super_admin_products'))
         except Exception as e:
             db.session.rollback()
+            if upload_results:
+                remove_uploaded(authenticated_supabase_client, bucket_name, upload_results)
             flash(f'Failed to update product: {str(e)}', 'error')
     
     return redirect(url_for('main.edit_product', product_id=product_id)) # Always redirect after POST
@@ -427,12 +379,14 @@ def delete_product(product_id):
 @login_required
 @super_admin_required
 def super_admin_orders():
-    # Get orders containing super admin's products
-    orders = db.session.query(Order).join(OrderItem).join(Product).filter(
-        Product.super_admin_id == current_user.id
-    ).distinct().order_by(desc(Order.created_at)).all()
+    # Orders containing super admin's products, one keyset page at a time
+    try:
+        page = paginate_seller_orders(current_user.id, request.args.get('cursor'),
+                                      current_app.config['SELLER_ORDERS_PER_PAGE'])
+    except InvalidCursor:
+        return redirect(url_for('main.super_admin_orders'))
     
-    return render_template('super_admin/orders.html', orders=orders)
+    return render_template('super_admin/orders.html', orders=page.items, page=page)
 
 @main_bp.route('/super-admin/update-order-status/<int:order_id>')
 @login_required
@@ -442,9 +396,12 @@ def update_order_status(order_id):
     order = Order.query.get_or_404(order_id)
     
     if status in ['processing', 'shipped', 'delivered']:
-        order.status = status
-        db.session.commit()
-        flash('Order status updated successfully!', 'success')
+        if set_order_status(order, status):
+            db.session.commit()
+            flash('Order status updated successfully!', 'success')
+        else:
+            db.session.rollback()
+            flash('The order was changed in the meantime; please try again.', 'error')
     else:
         flash('Invalid status.', 'error')
     
@@ -452,6 +409,8 @@ def update_order_status(order_id):
 
 # Customer Routes
 @main_bp.route('/products')
+@conditional_page
+@replica_reads
 def products():
     category_id = request.args.get('category')
     search = request.args.get('search')
@@ -461,94 +420,115 @@ def products():
     if category_id:
         query = query.filter_by(category_id=category_id)
     
+    # Keyset pagination: ?sort=<option>&cursor=<opaque>&per_page=<n>
+    sort = request.args.get('sort') or (RELEVANCE_SORT if search else DEFAULT_SORT)
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', type=int) or current_app.config['PRODUCTS_PER_PAGE']
+    per_page = max(1, min(per_page, current_app.config['PRODUCTS_MAX_PER_PAGE']))
+
+    ranked_ids = None
     if search:
-        query = query.filter(Product.name.contains(search))
-    
-    products = query.all()
-    categories = Category.query.all()
+        hits = get_search_backend().search(search, limit=current_app.config['SEARCH_MAX_RESULTS'])
+        ranked_ids = [product_id for product_id, _ in hits]
+        query = query.filter(Product.id.in_(ranked_ids))
+
+    def paginate(cursor=None):
+        if ranked_ids is not None and sort == RELEVANCE_SORT:
+            return paginate_ranked(query, ranked_ids, cursor=cursor, per_page=per_page)
+        return paginate_products(query, sort=sort, cursor=cursor, per_page=per_page)
 
-    user_wishlist_ids = []
+    try:
+        page = paginate(cursor)
+    except InvalidCursor:
+        flash('That page link is no longer valid. Showing the first page instead.', 'info')
+        page = paginate()
+
+    products = page.items
+    categories = get_categories()
+
+    user_wishlist_ids = frozenset()
     if current_user.is_authenticated and current_user.role == 'customer':
-        user_wishlist_ids = [item.product_id for item in Wishlist.query.filter_by(user_id=current_user.id).all()]
+        user_wishlist_ids = get_wishlist_ids(current_user.id)
     
     return render_template('customer/products.html', 
                            products=products, 
                            categories=categories,
-                           user_wishlist_ids=user_wishlist_ids)
+                           user_wishlist_ids=user_wishlist_ids,
+                           page=page,
+                           sort_options=SORT_LABELS)
 
 @main_bp.route('/product/<int:product_id>')
+@conditional_page
+@select_budget(5)
+@replica_reads
 def product_detail(product_id):
-    product = Product.query.filter_by(id=product_id, is_active=True).first_or_404()
+    product = load_product_detail(product_id)
     return render_template('customer/product_detail.html', product=product)
 
 @main_bp.route('/add-to-cart/<int:product_id>')
 @login_required
 def add_to_cart(product_id):
-    product = Product.query.filter_by(id=product_id, is_active=True).first_or_404()
-    
-    # Check if item already in cart
-    cart_item = Cart.query.filter_by(user_id=current_user.id, product_id=product_id).first()
+    price = db.session.query(Product.price).filter_by(id=product_id, is_active=True).scalar()
+    if price is None:
+        abort(404)
     
-    if cart_item:
-        cart_item.quantity += 1
-    else:
-        cart_item = Cart(user_id=current_user.id, product_id=product_id, quantity=1)
-        db.session.add(cart_item)
-    
-    db.session.commit()
+    # Cart changes go to the cart cache and reach the cart table in batched background writes
+    get_cart_service().add(current_user.id, product_id, price)
     flash('Product added to cart!', 'success')
     return redirect(url_for('main.product_detail', product_id=product_id))
 
 @main_bp.route('/cart')
 @login_required
+@select_budget(4)
 def cart():
-    cart_items = Cart.query.filter_by(user_id=current_user.id).all()
+    cart_items = get_cart_service().lines(current_user.id)
     total = sum(item.product.price * item.quantity for item in cart_items)
     return render_template('customer/cart.html', cart_items=cart_items, total=total)
 
-@main_bp.route('/update-cart/<int:cart_id>')
+@main_bp.route('/update-cart/<int:product_id>')
 @login_required
-def update_cart(cart_id):
+def update_cart(product_id):
     action = request.args.get('action')
-    cart_item = Cart.query.filter_by(id=cart_id, user_id=current_user.id).first_or_404()
+    carts = get_cart_service()
+    if product_id not in carts.quantities(current_user.id):
+        abort(404)
+    price = db.session.query(Product.price).filter_by(id=product_id).scalar() or 0
     
     if action == 'increase':
-        cart_item.quantity += 1
+        carts.add(current_user.id, product_id, price)
     elif action == 'decrease':
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-        else:
-            db.session.delete(cart_item)
+        carts.decrease(current_user.id, product_id, price)
     elif action == 'remove':
-        db.session.delete(cart_item)
+        carts.remove(current_user.id, product_id, price)
     
-    db.session.commit()
     return redirect(url_for('main.cart'))
 
 @main_bp.route('/add-to-wishlist/<int:product_id>')
 @login_required
 def add_to_wishlist(product_id):
-    product = Product.query.filter_by(id=product_id, is_active=True).first_or_404()
-    
-    # Check if already in wishlist
-    existing = Wishlist.query.filter_by(user_id=current_user.id, product_id=product_id).first()
-    
-    if existing:
-        db.session.delete(existing)
-        db.session.commit()
+    # Toggle: try the insert first (a no-op if the pair already exists), else remove the existing row
+    added = insert_ignore(
+        Wishlist.__table__, ['user_id', 'product_id'], ['user_id', 'product_id', 'created_at'],
+        select(literal(current_user.id), Product.id, literal(datetime.utcnow())).where(
+            Product.id == product_id, Product.is_active == True)
+    )
+    if added:
+        flash('Product added to wishlist!', 'success')
+    elif db.session.execute(delete(Wishlist).where(
+            Wishlist.user_id == current_user.id, Wishlist.product_id == product_id)).rowcount:
         flash('Product removed from wishlist!', 'success')
     else:
-        wishlist_item = Wishlist(user_id=current_user.id, product_id=product_id)
-        db.session.add(wishlist_item)
-        db.session.commit()
-        flash('Product added to wishlist!', 'success')
-    
+        abort(404)
+    db.session.commit()
+    invalidate_wishlist_ids(current_user.id)
+
     return redirect(url_for('main.products')) # Redirect back to the products page
 
 @main_bp.route('/wishlist')
 @login_required
+@select_budget(4)
 def wishlist():
-    wishlist_items = Wishlist.query.filter_by(user_id=current_user.id).all()
+    wishlist_items = load_wishlist(current_user.id)
     return render_template('customer/wishlist.html', wishlist_items=wishlist_items)
 
 @main_bp.route('/remove-from-wishlist/<int:wishlist_id>')
@@ -557,13 +537,15 @@ def remove_from_wishlist(wishlist_id):
     wishlist_item = Wishlist.query.filter_by(id=wishlist_id, user_id=current_user.id).first_or_404()
     db.session.delete(wishlist_item)
     db.session.commit()
+    invalidate_wishlist_ids(current_user.id)
     flash('Product removed from wishlist!', 'success')
     return redirect(url_for('main.wishlist'))
 
 @main_bp.route('/checkout')
 @login_required
+@select_budget(4)
 def checkout():
-    cart_items = Cart.query.filter_by(user_id=current_user.id).all()
+    cart_items = get_cart_service().lines(current_user.id)
     
     if not cart_items:
         flash('Your cart is empty!', 'error')
@@ -575,78 +557,56 @@ def checkout():
 @main_bp.route('/place-order', methods=['POST'])
 @login_required
 def place_order():
-    cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-    
-    if not cart_items:
-        flash('Your cart is empty!', 'error')
-        return redirect(url_for('main.cart'))
-    
     address = request.form.get('address')
     phone = request.form.get('phone')
     payment_method = request.form.get('payment_method')
     
     if not all([address, phone, payment_method]):
+        count('checkout_failures_total', reason='missing_fields')
         flash('Please fill in all required fields.', 'error')
         return redirect(url_for('main.checkout'))
     
-    total = sum(item.product.price * item.quantity for item in cart_items)
-    
-    # Create order
-    order = Order(
-        customer_id=current_user.id,
-        total_amount=total,
-        payment_method=payment_method,
-        shipping_address=address,
-        phone=phone
-    )
-    
-    if payment_method == 'online':
-        order.payment_status = 'paid'  # Simulate successful payment
-    
-    db.session.add(order)
-    db.session.flush()  # Get order ID
-    
-    # Create order items
-    for cart_item in cart_items:
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
-        )
-        db.session.add(order_item)
+    carts = get_cart_service()
+    # Write pending cart changes first and order exactly what the cart table holds
+    with carts.flushed(current_user.id):
+        cart_items = carts.lines(current_user.id, cached=False)
+        if not cart_items:
+            count('checkout_failures_total', reason='empty_cart')
+            flash('Your cart is empty!', 'error')
+            return redirect(url_for('main.cart'))
         
-        # Update product stock
-        cart_item.product.stock -= cart_item.quantity
-    
-    # Create payment record
-    payment = Payment(
-        order_id=order.id,
-        payment_method=payment_method,
-        payment_status='paid' if payment_method == 'online' else 'pending',
-        amount=total,
-        transaction_id=f"TXN{order.id}{datetime.now().strftime('%Y%m%d%H%M%S')}" if payment_method == 'online' else None
-    )
-    db.session.add(payment)
-    
-    # Clear cart
-    Cart.query.filter_by(user_id=current_user.id).delete()
-    
-    db.session.commit()
+        try:
+            create_order(current_user.id, cart_items, address, phone, payment_method)
+        except InsufficientStock as e:
+            db.session.rollback()
+            count('checkout_failures_total', reason='insufficient_stock')
+            for shortfall in e.shortfalls:
+                if shortfall.available:
+                    flash(f'Only {shortfall.available} of {shortfall.name} left in stock '
+                          f'(you requested {shortfall.requested}).', 'error')
+                else:
+                    flash(f'{shortfall.name or "A product in your cart"} is out of stock.', 'error')
+            return redirect(url_for('main.cart'))
+        
+        db.session.commit()
+        carts.clear(current_user.id)  # create_order emptied the cart table
+    count('orders_placed_total')
     
     flash('Order placed successfully!', 'success')
     return redirect(url_for('main.orders'))
 
 @main_bp.route('/orders')
 @login_required
+@select_budget(5)
 def orders():
-    user_orders = Order.query.filter_by(customer_id=current_user.id).order_by(desc(Order.created_at)).all()
+    user_orders = load_orders(current_user.id)
     return render_template('customer/orders.html', orders=user_orders)
 
 @main_bp.route('/profile')
 @login_required
 def profile():
-    return render_template('customer/profile.html')
+    cart_count, _ = get_cart_service().summary(current_user.id)
+    return render_template('customer/profile.html', cart_count=cart_count)
 
 @main_bp.route('/update-profile', methods=['POST'])
 @login_required
@@ -664,8 +624,9 @@ def update_profile():
         flash('Email already taken by another user.', 'error')
         return redirect(url_for('main.profile'))
     
-    current_user.name = name
-    current_user.email = email
+    user = current_user.record
+    user.name = name
+    user.email = email
     
     try:
         db.session.commit()
@@ -686,14 +647,9 @@ def cancel_order(order_id):
         return redirect(url_for('main.orders'))
     
     try:
-        order.status = 'cancelled'
-        
-        # Restore product stock
-        for item in order.order_items:
-            product = Product.query.get(item.product_id)
-            if product:
-                product.stock += item.quantity
-        
+        if not cancel_order_and_restock(order):
+            flash('Order cannot be cancelled at this stage.', 'error')
+            return redirect(url_for('main.orders'))
         db.session.commit()
         flash('Order cancelled successfully!', 'success')
     except Exception as e:
@@ -0,0 +1,351 @@
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect, literal_column, text
+from sqlalchemy.orm import Session
+from app import db
+from models import Product
+from caching import note_version_change, version_map
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Relative weight of a hit in each indexed field
+FIELD_WEIGHTS = {'name': 3.0, 'brand': 2.0, 'description': 1.0}
+
+# Score multipliers for inexact term matches
+PREFIX_PENALTY = 0.8
+TYPO_PENALTY = 0.5
+
+# Cap on how many index terms a single short prefix may expand to
+MAX_PREFIX_EXPANSIONS = 64
+
+# Typo tolerance (one edit) only kicks in for tokens at least this long
+MIN_TYPO_LENGTH = 4
+
+# Weighted document expression shared by the GIN index and the search query, so
+# Postgres can answer the @@ match straight from the index.
+PG_DOCUMENT_SQL = (
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(brand, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+)
+
+# VersionMap counter (cache_versions) that stamps every product whose indexed
+# text was committed; in-memory indexes re-read just the stamped products
+SEARCH_VERSION = 'product_search'
+
+
+def ensure_search_index():
+    """Create the Postgres full-text GIN index if it is missing (seed-db); a no-op elsewhere"""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING gin (({PG_DOCUMENT_SQL}))"))
+    db.session.commit()
+
+
+def tokenize(value):
+    """Lower-case a string and split it into alphanumeric tokens"""
+    return TOKEN_RE.findall(value.lower()) if value else []
+
+
+class PostgresSearchBackend:
+    """Full-text search on Postgres using the weighted tsvector GIN index.
+
+    Every query token is matched as a prefix (``term:*``) and results are ranked
+    with ts_rank_cd. When ``SEARCH_PG_TRGM`` is enabled, a trigram similarity
+    query over product names is used as a typo-tolerant fallback; that needs the
+    pg_trgm extension installed in the database.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, use_trigram=False):
+        self.use_trigram = use_trigram
+
+    def search(self, query_text, limit=1000):
+        tokens = tokenize(query_text)
+        if not tokens:
+            return []
+
+        tsquery = func.to_tsquery('english', ' & '.join(f'{token}:*' for token in tokens))
+        document = literal_column(f'({PG_DOCUMENT_SQL})')
+        rank = func.ts_rank_cd(document, tsquery).label('rank')
+        rows = db.session.query(Product.id, rank).filter(
+            document.op('@@')(tsquery)
+        ).order_by(rank.desc(), Product.id.desc()).limit(limit).all()
+
+        if not rows and self.use_trigram:
+            similarity = func.word_similarity(query_text, Product.name).label('rank')
+            rows = db.session.query(Product.id, similarity).filter(
+                similarity > 0.3
+            ).order_by(similarity.desc(), Product.id.desc()).limit(limit).all()
+
+        return [(product_id, float(score)) for product_id, score in rows]
+
+    # The tsvector is computed from the row itself, so there is nothing to maintain
+    def index_product(self, product_id, fields):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+
+class InMemorySearchBackend:
+    """In-process inverted index for SQLite and other non-Postgres setups.
+
+    The index is built lazily on first search and then kept up to date from
+    Product inserts, updates and deletes committed in this process. Each
+    worker holds its own copy, so it also follows ``versions`` (the
+    SEARCH_VERSION VersionMap, re-read at most every CACHE_VERSION_CHECK_INTERVAL
+    seconds) and re-indexes only the products other processes have stamped
+    since the version it is at.
+    """
+
+    name = 'memory'
+
+    def __init__(self, versions):
+        self.versions = versions
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+        self._postings = defaultdict(dict)      # term -> {product_id: weighted term frequency}
+        self._documents = {}                    # product_id -> set of terms
+        self._terms = []                        # sorted list of terms, for prefix lookups
+        self._deletes = defaultdict(set)        # one-character deletion -> terms, for typo lookups
+
+    def rebuild(self):
+        # Read the version first: a change committed in between is re-indexed once more later
+        version, _ = self.versions.current()
+        rows = db.session.query(Product.id, Product.name, Product.brand, Product.description).all()
+        with self._lock:
+            self._version = version
+            self._postings.clear()
+            self._documents.clear()
+            self._terms = []
+            self._deletes.clear()
+            for product_id, name, brand, description in rows:
+                self._add(product_id, {'name': name, 'brand': brand, 'description': description})
+            self._built = True
+
+    def _ensure_current(self):
+        if not self._built:
+            self.rebuild()
+            return
+        version, _ = self.versions.current()
+        if version == self._version:
+            return
+        changed = self.versions.changed_since(self._version)
+        if changed is None:
+            self.rebuild()
+            return
+        product_ids = [int(product_id) for product_id in changed]
+        rows = db.session.query(Product.id, Product.name, Product.brand, Product.description).filter(
+            Product.id.in_(product_ids)
+        ).all() if product_ids else []
+        with self._lock:
+            for product_id in product_ids:
+                self._remove(product_id)  # Deleted products are simply not re-added
+            for product_id, name, brand, description in rows:
+                self._add(product_id, {'name': name, 'brand': brand, 'description': description})
+            self._version = version
+
+    @staticmethod
+    def _single_deletes(term):
+        return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+    def _add(self, product_id, fields):
+        weights = defaultdict(float)
+        for field, value in fields.items():
+            for token in tokenize(value):
+                weights[token] += FIELD_WEIGHTS[field]
+
+        for term, weight in weights.items():
+            postings = self._postings[term]
+            if not postings:
+                insort(self._terms, term)
+                for deleted in self._single_deletes(term):
+                    self._deletes[deleted].add(term)
+            postings[product_id] = weight
+        self._documents[product_id] = set(weights)
+
+    def _remove(self, product_id):
+        for term in self._documents.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+                for deleted in self._single_deletes(term):
+                    self._deletes[deleted].discard(term)
+                    if not self._deletes[deleted]:
+                        del self._deletes[deleted]
+
+    def index_product(self, product_id, fields):
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(product_id)
+            self._add(product_id, fields)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built:
+                self._remove(product_id)
+
+    def _prefix_terms(self, token):
+        start = bisect_left(self._terms, token)
+        matches = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append(term)
+        return matches
+
+    def _typo_terms(self, token):
+        # Terms within one insertion, deletion, substitution or adjacent transposition of the token
+        candidates = set(self._deletes.get(token, ()))
+        for deleted in self._single_deletes(token):
+            if deleted in self._postings:
+                candidates.add(deleted)
+            candidates.update(self._deletes.get(deleted, ()))
+        candidates.discard(token)
+        return candidates
+
+    def _expand(self, token):
+        """Return {term: score multiplier} for every index term a query token matches"""
+        expansions = {}
+        if token in self._postings:
+            expansions[token] = 1.0
+        for term in self._prefix_terms(token):
+            expansions[term] = PREFIX_PENALTY
+        if not expansions and len(token) >= MIN_TYPO_LENGTH:
+            for term in self._typo_terms(token):
+                expansions[term] = TYPO_PENALTY
+                for longer in self._prefix_terms(term):
+                    expansions.setdefault(longer, TYPO_PENALTY * PREFIX_PENALTY)
+        return expansions
+
+    def search(self, query_text, limit=1000):
+        tokens = list(dict.fromkeys(tokenize(query_text)))
+        if not tokens:
+            return []
+
+        self._ensure_current()
+        with self._lock:
+            total_documents = max(len(self._documents), 1)
+            matches = []
+            for token in tokens:
+                expansions = [
+                    (self._postings[term], multiplier * math.log(1 + total_documents / len(self._postings[term])))
+                    for term, multiplier in self._expand(token).items()
+                ]
+                # Every query token has to match (AND semantics)
+                if not expansions:
+                    return []
+                matches.append(expansions)
+
+            # Score the rarest token first, then only probe the surviving candidates
+            matches.sort(key=lambda expansions: sum(len(postings) for postings, _ in expansions))
+            scores = {}
+            for postings, factor in matches[0]:
+                for product_id, weight in postings.items():
+                    score = weight * factor
+                    if score > scores.get(product_id, 0.0):
+                        scores[product_id] = score
+
+            for expansions in matches[1:]:
+                narrowed = {}
+                for product_id, score in scores.items():
+                    best = 0.0
+                    for postings, factor in expansions:
+                        weight = postings.get(product_id)
+                        if weight is not None and weight * factor > best:
+                            best = weight * factor
+                    if best:
+                        narrowed[product_id] = score + best
+                scores = narrowed
+                if not scores:
+                    return []
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+
+def get_search_backend():
+    return current_app.extensions['search']
+
+
+def _product_fields(product):
+    return {'name': product.name, 'brand': product.brand, 'description': product.description}
+
+
+SEARCH_FIELDS = ('name', 'brand', 'description')
+
+
+def _text_changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in SEARCH_FIELDS)
+
+
+def _collect_product_changes(session, flush_context):
+    pending = session.info.setdefault('search_pending', {})
+    changed = set()
+    for obj in session.new:
+        if isinstance(obj, Product) and obj.id is not None:
+            pending[obj.id] = _product_fields(obj)
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj.id is not None:
+            pending[obj.id] = _product_fields(obj)
+            if _text_changed(obj):
+                changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Product) and obj.id is not None:
+            pending[obj.id] = None
+            changed.add(obj.id)
+    backend = current_app.extensions.get('search') if has_app_context() else None
+    if changed and getattr(backend, 'name', None) == 'memory':
+        note_version_change(session, SEARCH_VERSION, changed)
+
+
+def _apply_product_changes(session):
+    pending = session.info.pop('search_pending', None)
+    if not pending or not has_app_context():
+        return
+    backend = current_app.extensions.get('search')
+    if backend is None:
+        return
+    for product_id, fields in pending.items():
+        if fields is None:
+            backend.remove_product(product_id)
+        else:
+            backend.index_product(product_id, fields)
+
+
+def _discard_product_changes(session):
+    session.info.pop('search_pending', None)
+
+
+def init_search(app):
+    """Pick the search backend from SEARCH_BACKEND ('auto', 'postgres' or 'memory')"""
+    choice = app.config.get('SEARCH_BACKEND', 'auto')
+    if choice == 'auto':
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        choice = 'postgres' if uri.startswith(('postgres', 'postgresql')) else 'memory'
+
+    if choice == 'postgres':
+        app.extensions['search'] = PostgresSearchBackend(use_trigram=app.config.get('SEARCH_PG_TRGM', False))
+    else:
+        app.extensions['search'] = InMemorySearchBackend(version_map(app, SEARCH_VERSION))
+
+    if not event.contains(Session, 'after_flush', _collect_product_changes):
+        event.listen(Session, 'after_flush', _collect_product_changes)
+        event.listen(Session, 'after_commit', _apply_product_changes)
+        event.listen(Session, 'after_rollback', _discard_product_changes)
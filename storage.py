@@ -0,0 +1,267 @@
+import io
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+
+import jwt as pyjwt
+from flask import current_app
+from werkzeug.utils import secure_filename
+from utils import allowed_file
+from jobs import is_retryable
+from metrics import get_metrics, supabase_call
+
+class SupabaseClientPool:
+    """Authenticated Supabase Storage clients keyed by user JWT.
+
+    Clients are kept in a bounded LRU and dropped once their token expires.
+    They all share one lazily created httpx connection pool, so a request only
+    pays for TLS/connection setup when the pool has no idle connection, and a
+    storage client is only built the first time a user's token actually
+    touches storage.
+    """
+
+    def __init__(self, url, key, max_clients=128, timeout=30, max_connections=20):
+        self.url = url
+        self.key = key
+        self.max_clients = max_clients
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()   # jwt -> (expires_at, storage client)
+        self._http = None
+        self._public = None
+
+    def _http_client(self):
+        if self._http is None:
+            import httpx
+            self._http = httpx.Client(
+                timeout=self.timeout,
+                follow_redirects=True,
+                http2=True,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._http
+
+    def public_client(self):
+        """The anon-key Supabase client (used for Auth), built on first use"""
+        with self._lock:
+            if self._public is None:
+                from supabase import create_client
+                self._public = create_client(self.url, self.key)
+            return self._public
+
+    @staticmethod
+    def token_expiry(token):
+        """The token's ``exp`` claim (no signature check; Supabase verifies the token), or None"""
+        try:
+            claims = pyjwt.decode(token, options={'verify_signature': False})
+        except pyjwt.PyJWTError:
+            return None
+        return claims.get('exp')
+
+    def storage(self, token):
+        """Storage client authenticated as ``token``, or None if the token has expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._clients.get(token)
+            if entry is not None:
+                expires_at, client = entry
+                if expires_at is None or expires_at > now:
+                    self._clients.move_to_end(token)
+                    return client
+                del self._clients[token]
+
+            expires_at = self.token_expiry(token)
+            if expires_at is not None and expires_at <= now:
+                return None
+
+            from storage3 import SyncStorageClient
+            client = SyncStorageClient(
+                url=f"{self.url.rstrip('/')}/storage/v1/",
+                headers={'apiKey': self.key, 'Authorization': f'Bearer {token}'},
+                http_client=self._http_client(),
+            )
+            self._clients[token] = (expires_at, client)
+
+            # Drop expired tokens first, then the least recently used ones
+            for stale in [t for t, (exp, _) in self._clients.items() if exp is not None and exp <= now]:
+                del self._clients[stale]
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def reset_after_fork(self):
+        """Forget clients inherited from the parent process without closing their shared sockets"""
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._http = None
+        self._public = None
+
+    def close(self):
+        with self._lock:
+            self._clients.clear()
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+
+class AuthenticatedSupabase:
+    """Handle for the current user's Supabase access; the storage client is resolved on first use"""
+
+    def __init__(self, pool, token):
+        self._pool = pool
+        self._token = token
+
+    @property
+    def storage(self):
+        client = self._pool.storage(self._token)
+        if client is None:
+            raise PermissionError('Supabase session has expired. Please log in again.')
+        return client
+
+    @property
+    def expired(self):
+        expires_at = self._pool.token_expiry(self._token)
+        return expires_at is not None and expires_at <= time.time()
+
+
+def get_supabase_pool():
+    return current_app.extensions['supabase_pool']
+
+
+def init_storage(app):
+    app.extensions['supabase_pool'] = SupabaseClientPool(
+        app.config['SUPABASE_URL'],
+        app.config['SUPABASE_KEY'],
+        max_clients=app.config['SUPABASE_CLIENT_CACHE_SIZE'],
+        timeout=app.config['SUPABASE_UPLOAD_TIMEOUT'],
+        max_connections=app.config['SUPABASE_HTTP_MAX_CONNECTIONS'],
+    )
+
+
+UploadResult = namedtuple('UploadResult', ['original_name', 'object_name', 'url', 'error'])
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    # One bounded pool per worker process, shared by all requests
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage-upload')
+        return _executor
+
+
+# Uploads larger than this are streamed from their file descriptor; matches the
+# size at which werkzeug's SpooledTemporaryFile moves a form upload to disk
+STREAM_FROM_DISK_BYTES = 500 * 1024
+
+
+def _upload_body(file):
+    """Return something the storage client can send without another in-memory copy.
+
+    Werkzeug spools large uploads to a temporary file; those are handed over as
+    a reader on a duplicate of the file descriptor so they stream from disk.
+    Small uploads, and streams without a file descriptor, are read once.
+    """
+    stream = file.stream
+    size = stream.seek(0, io.SEEK_END)
+    stream.seek(0)
+    if size > STREAM_FROM_DISK_BYTES:
+        try:
+            return os.fdopen(os.dup(stream.fileno()), 'rb')
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            stream.seek(0)
+    return stream.read()
+
+
+def _upload_one(bucket, object_name, file, content_type, retries, backoff, metrics):
+    attempt = 0
+    while True:
+        body = _upload_body(file)
+        try:
+            with supabase_call('storage_upload', metrics):
+                res = bucket.upload(object_name, body, {"content-type": content_type})
+                if isinstance(res, dict) and res.get('error'):
+                    raise Exception(res['error'].get('message', 'Unknown Supabase upload error'))
+            return bucket.get_public_url(object_name)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random() / 2))
+            attempt += 1
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+def upload_files(client, bucket_name, files):
+    """Upload allowed image files concurrently; returns one UploadResult per file, in order.
+
+    Uploads run on a bounded per-process thread pool with retries and
+    exponential backoff, and all of them share one SUPABASE_UPLOAD_TIMEOUT
+    deadline counted from submission. A failed file does not affect the
+    others; callers decide what to do with partial results. An upload that
+    is already running when the deadline passes cannot be stopped, so its
+    object is removed again if it completes later.
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    executor = _get_executor(config['SUPABASE_UPLOAD_WORKERS'])
+    bucket = client.storage.from_(bucket_name)
+
+    deadline = time.monotonic() + config['SUPABASE_UPLOAD_TIMEOUT']
+    jobs = []
+    for i, file in enumerate(files):
+        if not (file and file.filename and allowed_file(file.filename)):
+            continue
+        filename = secure_filename(file.filename)
+        object_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{i}_{filename}"
+        future = executor.submit(
+            _upload_one, bucket, object_name, file, file.content_type,
+            config['SUPABASE_UPLOAD_RETRIES'], config['SUPABASE_UPLOAD_BACKOFF'], get_metrics(),
+        )
+        jobs.append((file.filename, object_name, future))
+
+    results = []
+    for original_name, object_name, future in jobs:
+        try:
+            url = future.result(timeout=max(deadline - time.monotonic(), 0))
+            results.append(UploadResult(original_name, object_name, url, None))
+        except FutureTimeoutError:
+            if not future.cancel():
+                future.add_done_callback(_remove_late_upload(app, client, bucket_name, original_name, object_name))
+            results.append(UploadResult(original_name, object_name, None, 'Upload timed out'))
+        except Exception as e:
+            results.append(UploadResult(original_name, object_name, None, str(e)))
+    return results
+
+
+def _remove_late_upload(app, client, bucket_name, original_name, object_name):
+    """Done callback for an upload that was given up on: delete the object it created"""
+    def callback(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with app.app_context():
+            app.logger.warning(f"Upload of {object_name} finished after its timeout; removing it")
+            remove_uploaded(client, bucket_name, [UploadResult(original_name, object_name, future.result(), None)])
+    return callback
+
+
+def remove_uploaded(client, bucket_name, results):
+    """Best-effort removal of uploaded objects, e.g. when the database write fails afterwards"""
+    names = [result.object_name for result in results if result.url]
+    if not names:
+        return
+    try:
+        with supabase_call('storage_remove'):
+            client.storage.from_(bucket_name).remove(names)
+    except Exception as e:
+        current_app.logger.error(f"Failed to clean up uploaded images {names}: {e}")
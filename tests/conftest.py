@@ -0,0 +1,49 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('SESSION_SECRET', 'test')
+    monkeypatch.setenv('SUPABASE_URL', 'http://localhost:9')
+    monkeypatch.setenv('SUPABASE_KEY', 'test')
+    monkeypatch.setenv('KV_STORE_URL', 'memory://')
+    monkeypatch.setenv('SINGLE_HOST', 'true')
+    monkeypatch.setenv('PAGE_CACHE_MAX_ENTRIES', '0')  # Render every request, so every request runs its queries
+    monkeypatch.setenv('METRICS_ENABLED', 'false')
+    from app import create_app, init_db_and_admin
+    app = create_app()
+    app.config['TESTING'] = True
+    init_db_and_admin(app)
+    yield app
+    from app import db
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def product(app):
+    from app import db
+    from models import Category, Product, User
+    with app.app_context():
+        seller = User(id=str(uuid.uuid4()), name='Seller', email=f'{uuid.uuid4().hex}@test.local',
+                      password_hash='-', role='super_admin', is_active=True)
+        db.session.add(seller)
+        item = Product(name='Test product', description='A product for tests', price=10, stock=5,
+                       category_id=Category.query.first().id, super_admin_id=seller.id)
+        db.session.add(item)
+        db.session.commit()
+        return item.id
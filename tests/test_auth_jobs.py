@@ -0,0 +1,37 @@
+import time
+
+from cryptography.fernet import Fernet
+
+from auth_jobs import TICKET_SESSION_KEY
+
+
+def sign_in(client, user_id, ticket):
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+        session[TICKET_SESSION_KEY] = ticket
+
+
+def seller_id(app, product):
+    from app import db
+    from models import Product
+    with app.app_context():
+        return db.session.get(Product, product).super_admin_id
+
+
+def test_pending_supabase_sign_in_asks_to_retry(client, app, product):
+    sign_in(client, seller_id(app, product), ['ticket', Fernet.generate_key().decode(), time.time()])
+    response = client.get('/super-admin/add-product')
+    assert response.status_code == 302
+    assert response.location.endswith('/super-admin/dashboard')
+    with client.session_transaction() as session:
+        assert TICKET_SESSION_KEY in session  # Still waiting for the same sign-in
+        assert session['_flashes'] == [('info', 'Your Supabase session is still being set up. '
+                                                'Please try again in a moment.')]
+
+
+def test_abandoned_supabase_sign_in_asks_to_log_in_again(client, app, product):
+    sign_in(client, seller_id(app, product), ['ticket', Fernet.generate_key().decode(), time.time() - 3600])
+    response = client.get('/super-admin/add-product')
+    assert response.status_code == 302
+    assert '/login' in response.location
@@ -0,0 +1,31 @@
+from caching import CATEGORY_GENERATION, CategoryCache, VersionMap, get_categories
+
+
+def other_worker():
+    return CategoryCache(VersionMap(CATEGORY_GENERATION, check_interval=0))
+
+
+def test_category_changes_reach_every_worker(app):
+    from app import db
+    from models import Category
+    with app.app_context():
+        worker = other_worker()
+        before = worker.get()
+        assert get_categories() == before
+
+        db.session.add(Category(name='Garden', description='Outdoor things'))
+        db.session.commit()
+        assert get_categories()[-1].name == 'Garden'  # The writer sees its own change at once
+        assert worker.get()[-1].name == 'Garden'
+        assert len(worker.get()) == len(before) + 1
+
+
+def test_unrelated_commits_keep_the_cached_list(app, product):
+    from app import db
+    from models import Product
+    with app.app_context():
+        worker = other_worker()
+        categories = worker.get()
+        db.session.get(Product, product).stock = 4
+        db.session.commit()
+        assert worker.get() is categories
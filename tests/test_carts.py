@@ -0,0 +1,74 @@
+import uuid
+
+import pytest
+
+from carts import CartService
+from kvstore import MemoryStore
+
+
+@pytest.fixture
+def carts(app):
+    from app import db
+    from models import User
+    with app.app_context():
+        db.session.add(User(id='customer', name='Customer', email=f'{uuid.uuid4().hex}@test.local',
+                            password_hash='-', role='customer', is_active=True))
+        db.session.commit()
+        yield CartService(MemoryStore(), flush_interval=-1)  # Tests flush explicitly
+
+
+def table(user_id='customer'):
+    from app import db
+    from models import Cart
+    return dict(db.session.query(Cart.product_id, Cart.quantity).filter(Cart.user_id == user_id).all())
+
+
+def test_changes_reach_the_table_only_when_flushed(carts, product, monkeypatch):
+    monkeypatch.setattr(carts, 'start_flusher', lambda app: None)
+    carts.flush_interval = 2
+    carts.add('customer', product, 10)
+    carts.add('customer', product, 10)
+    assert carts.quantities('customer') == {product: 2}
+    assert table() == {}
+
+    assert carts.flush() == 1
+    assert table() == {product: 2}
+    assert carts.flush() == 0
+
+
+def test_summary_keeps_a_running_total(carts, product):
+    carts.add('customer', product, 10, quantity=3)
+    carts.decrease('customer', product, 10)
+    assert carts.summary('customer') == (1, 20)
+    carts.remove('customer', product, 10)
+    assert carts.summary('customer') == (0, 0)
+    assert table() == {}
+
+
+def test_late_refill_cannot_restore_a_removed_line(carts, product):
+    carts.add('customer', product, 10)
+    stale = carts._rows('customer')  # A refill that read the table before the removal
+    carts.remove('customer', product, 10)
+
+    key = carts._key('customer')
+    for product_id, quantity, _ in stale:
+        carts.store.hsetnx(key, product_id, int(quantity))
+    assert carts.quantities('customer') == {}
+
+
+def test_refill_racing_with_checkout_lands_in_the_old_generation(carts, product):
+    from app import db
+    from models import Cart
+    carts.add('customer', product, 10)
+    old_key = carts._key('customer')
+
+    with carts.flushed('customer'):
+        assert [(line.product.id, line.quantity) for line in carts.lines('customer', cached=False)] == [(product, 1)]
+        db.session.query(Cart).filter(Cart.user_id == 'customer').delete()
+        db.session.commit()
+        carts.clear('customer')
+
+    carts.store.hsetnx(old_key, product, 1)  # A refill that read the table before the order was placed
+    assert carts.quantities('customer') == {}
+    assert carts.flush(['customer']) == 0
+    assert table() == {}
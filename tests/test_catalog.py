@@ -0,0 +1,146 @@
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import MetaData
+
+from catalog import (DEFAULT_SORT, SORT_OPTIONS, InvalidCursor, fill_null_sort_keys, pack_cursor,
+                     paginate_products, unpack_cursor)
+
+
+@pytest.fixture
+def products(app):
+    """25 products with repeated prices, ratings, sales counts and creation times; returns their ids"""
+    from app import db
+    from models import Category, Product, User
+    with app.app_context():
+        seller = User(id=str(uuid.uuid4()), name='Seller', email=f'{uuid.uuid4().hex}@test.local',
+                      password_hash='-', role='super_admin', is_active=True)
+        db.session.add(seller)
+        category_id = Category.query.first().id
+        created = datetime(2024, 1, 1)
+        items = [Product(name=f'Product {i}', price=Decimal(5 + i % 4), stock=1, ratings=Decimal(i % 3),
+                         sales_count=i % 5, created_at=created + timedelta(days=i % 6),
+                         category_id=category_id, super_admin_id=seller.id)
+                 for i in range(25)]
+        db.session.add_all(items)
+        db.session.commit()
+        return [item.id for item in items]
+
+
+def walk(sort, per_page=4, cursor=None):
+    """Every page of the listing from ``cursor`` on, as lists of product ids"""
+    from models import Product
+    pages = []
+    while True:
+        page = paginate_products(Product.query, sort=sort, cursor=cursor, per_page=per_page)
+        pages.append([product.id for product in page.items])
+        if page.next_cursor is None:
+            return pages
+        cursor = page.next_cursor
+
+
+def expected_order(sort):
+    from models import Product
+    column, descending, _ = SORT_OPTIONS[sort]
+    rows = Product.query.all()
+    return [p.id for p in sorted(rows, key=lambda p: (getattr(p, column.key), p.id), reverse=descending)]
+
+
+@pytest.mark.parametrize('kind, value, value_type', [
+    ('newest', datetime(2024, 5, 6, 7, 8, 9, 123456), 'datetime'),
+    ('price_asc', Decimal('19.99'), 'decimal'),
+    ('ratings', Decimal('4.5'), 'decimal'),
+    ('bestsellers', 1234, 'int'),
+])
+def test_cursor_round_trip(kind, value, value_type):
+    cursor = pack_cursor(kind, value, 42)
+    assert '=' not in cursor  # Padding is stripped so the cursor is URL-safe as is
+    assert unpack_cursor(kind, cursor, value_type) == (value, 42)
+
+
+@pytest.mark.parametrize('sort', sorted(SORT_OPTIONS))
+def test_every_sort_walks_all_rows_once_in_order(app, products, sort):
+    with app.app_context():
+        pages = walk(sort)
+        seen = [product_id for page in pages for product_id in page]
+        assert seen == expected_order(sort)  # Ties broken on id: no gaps, no duplicates
+        assert len(seen) == len(products)
+        assert [len(page) for page in pages] == [4] * 6 + [1]
+
+
+def test_last_full_page_has_no_next_cursor(app, products):
+    from models import Product
+    with app.app_context():
+        page = paginate_products(Product.query, per_page=len(products))
+        assert len(page.items) == len(products)
+        assert page.next_cursor is None
+
+
+def test_unknown_sort_falls_back_to_the_default(app, products):
+    from models import Product
+    with app.app_context():
+        page = paginate_products(Product.query, sort='cheapest', per_page=3)
+        assert page.sort == DEFAULT_SORT
+        assert [p.id for p in page.items] == expected_order(DEFAULT_SORT)[:3]
+
+
+def tampered(cursor):
+    raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    raw[1] = 'not a number'
+    return base64.urlsafe_b64encode(json.dumps(raw).encode()).decode()
+
+
+@pytest.mark.parametrize('make_cursor', [
+    lambda cursor: 'garbage!',
+    lambda cursor: cursor[:-3],
+    lambda cursor: pack_cursor('price_desc', Decimal('5'), 1),  # Cursor of another sort order
+    tampered,
+])
+def test_invalid_cursors_are_rejected(app, products, make_cursor):
+    from models import Product
+    with app.app_context():
+        cursor = paginate_products(Product.query, sort='price_asc', per_page=4).next_cursor
+        with pytest.raises(InvalidCursor):
+            paginate_products(Product.query, sort='price_asc', cursor=make_cursor(cursor), per_page=4)
+
+
+def test_invalid_cursor_shows_page_one(client, app, products):
+    with app.app_context():
+        first_page = expected_order('price_asc')[:3]
+    response = client.get('/products?sort=price_asc&cursor=garbage!')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    for product_id in first_page:
+        assert f'/product/{product_id}' in body
+
+
+def test_null_sort_keys_are_backfilled_before_paginating(app, products):
+    """A products table created before the sort keys were NOT NULL"""
+    from app import db
+    from models import Category, Product, User
+    with app.app_context():
+        rows = [dict(row._mapping) for row in db.session.execute(Product.__table__.select())]
+        metadata = MetaData()
+        for table in (User.__table__, Category.__table__):
+            table.to_metadata(metadata)  # Only so the foreign keys resolve
+        legacy = Product.__table__.to_metadata(metadata)
+        for column in (legacy.c.ratings, legacy.c.sales_count, legacy.c.created_at):
+            column.nullable = True
+        db.session.commit()
+        with db.engine.begin() as connection:
+            Product.__table__.drop(connection)
+            legacy.create(connection)
+            for row in rows[::3]:
+                row.update(ratings=None, sales_count=None, created_at=None)
+            connection.execute(legacy.insert(), rows)
+
+        fill_null_sort_keys()
+        db.session.commit()
+        for sort in SORT_OPTIONS:
+            seen = [product_id for page in walk(sort) for product_id in page]
+            assert seen == expected_order(sort)
+        assert Product.query.filter(Product.created_at == datetime(1970, 1, 1)).count() == len(rows[::3])
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from inventory import InsufficientStock, Shortfall, release_stock, reserve_stock
+
+
+def stock(product_id):
+    from app import db
+    from models import Product
+    db.session.expire_all()
+    return db.session.get(Product, product_id).stock
+
+
+def reserve_concurrently(app, quantities, buyers):
+    """Run ``buyers`` checkouts of ``quantities`` at once; returns (reserved count, InsufficientStock errors)"""
+    from app import db
+    start = threading.Barrier(buyers)
+    reserved, failures = [], []
+
+    def buy():
+        with app.app_context():
+            start.wait()
+            while True:
+                try:
+                    reserve_stock(quantities)
+                    db.session.commit()
+                    reserved.append(1)
+                    return
+                except InsufficientStock as e:
+                    db.session.rollback()
+                    failures.append(e)
+                    return
+                except OperationalError:  # SQLite "database is locked": retry like the stress benchmark
+                    db.session.rollback()
+                    time.sleep(0.01)
+
+    threads = [threading.Thread(target=buy) for _ in range(buyers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(reserved), failures
+
+
+def test_concurrent_checkouts_never_oversell_the_last_units(app, product):
+    with app.app_context():
+        reserved, failures = reserve_concurrently(app, {product: 2}, buyers=8)
+        assert reserved == 2  # 5 in stock, 2 each
+        assert stock(product) == 1
+        assert len(failures) == 6
+        for error in failures:
+            assert error.shortfalls == [Shortfall(product, 'Test product', 2, 1)]
+
+
+def test_shortfall_lists_only_the_lines_that_cannot_be_covered(app, product):
+    from app import db
+    from models import Product
+    with app.app_context():
+        other = Product(name='Other product', description='Another product', price=5, stock=10,
+                        category_id=db.session.get(Product, product).category_id,
+                        super_admin_id=db.session.get(Product, product).super_admin_id)
+        db.session.add(other)
+        db.session.commit()
+
+        with pytest.raises(InsufficientStock) as raised:
+            reserve_stock({product: 6, other.id: 3, 999999: 1})
+        db.session.rollback()
+        assert raised.value.shortfalls == [Shortfall(product, 'Test product', 6, 5), Shortfall(999999, None, 1, 0)]
+        assert stock(product) == 5 and stock(other.id) == 10  # Nothing was taken
+
+
+def test_inactive_products_have_nothing_available(app, product):
+    from app import db
+    from models import Product
+    with app.app_context():
+        db.session.get(Product, product).is_active = False
+        db.session.commit()
+        with pytest.raises(InsufficientStock) as raised:
+            reserve_stock({product: 1})
+        db.session.rollback()
+        assert raised.value.shortfalls == [Shortfall(product, 'Test product', 1, 0)]
+
+
+def test_release_puts_reserved_units_back(app, product):
+    from app import db
+    with app.app_context():
+        reserve_stock({product: 5})
+        db.session.commit()
+        assert stock(product) == 0
+
+        release_stock({product: 5})
+        db.session.commit()
+        assert stock(product) == 5
+        reserve_stock({product: 5})  # All of it can be sold again
+        db.session.commit()
+        assert stock(product) == 0
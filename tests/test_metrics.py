@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture
+def metrics_client(app, monkeypatch):
+    def make(token=None):
+        from app import create_app
+        monkeypatch.setenv('METRICS_ENABLED', 'true')
+        if token:
+            monkeypatch.setenv('METRICS_TOKEN', token)
+        else:
+            monkeypatch.delenv('METRICS_TOKEN', raising=False)
+        return create_app().test_client()
+    return make
+
+
+def test_metrics_are_not_served_without_a_token(metrics_client):
+    assert metrics_client().get('/metrics').status_code == 404
+
+
+def test_metrics_require_the_configured_token(metrics_client):
+    client = metrics_client('s3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.get_data(as_text=True)
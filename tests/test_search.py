@@ -0,0 +1,47 @@
+from caching import VersionMap
+from search import SEARCH_VERSION, InMemorySearchBackend
+
+
+def other_worker():
+    """A second process's index: its own copy and its own view of the version counter"""
+    backend = InMemorySearchBackend(VersionMap(SEARCH_VERSION, check_interval=0))
+    backend.rebuild()
+    return backend
+
+
+def no_rebuilds(monkeypatch, backend):
+    def rebuild():
+        raise AssertionError('full rebuild')
+    monkeypatch.setattr(backend, 'rebuild', rebuild)
+
+
+def test_edits_reach_other_workers_without_a_rebuild(app, product, monkeypatch):
+    from app import db
+    from models import Product
+    with app.app_context():
+        own = app.extensions['search']
+        own.versions.check_interval = 0
+        own.rebuild()
+        other = other_worker()
+        assert [product_id for product_id, _ in other.search('test product')] == [product]
+        no_rebuilds(monkeypatch, own)
+        no_rebuilds(monkeypatch, other)
+
+        edited = db.session.get(Product, product)
+        edited.name, edited.description = 'Walnut bookshelf', 'Solid wood'
+        db.session.commit()
+
+        for backend in (own, other):
+            assert [product_id for product_id, _ in backend.search('bookshelf')] == [product]
+            assert backend.search('test product') == []
+
+
+def test_deletes_reach_other_workers(app, product, monkeypatch):
+    from app import db
+    from models import Product
+    with app.app_context():
+        other = other_worker()
+        no_rebuilds(monkeypatch, other)
+        db.session.delete(db.session.get(Product, product))
+        db.session.commit()
+        assert other.search('test product') == []
@@ -0,0 +1,43 @@
+import pytest
+
+from queries import SelectBudgetExceeded, select_budget
+
+
+def test_product_detail_stays_within_budget(client, product):
+    # The after_request check raises SelectBudgetExceeded in testing mode when the view goes over
+    response = client.get(f'/product/{product}')
+    assert response.status_code == 200
+
+
+def test_product_detail_budget_holds_for_missing_product(client):
+    assert client.get('/product/999999').status_code == 404
+
+
+def test_exceeding_the_budget_raises(app, client, product):
+    from app import db
+    from models import Product
+
+    @app.route('/test/too-many-selects')
+    @select_budget(1)
+    def too_many_selects():
+        db.session.get(Product, product)
+        db.session.query(Product).filter_by(id=product).count()
+        return 'ok'
+
+    with pytest.raises(SelectBudgetExceeded, match='issued 2 SELECT statements'):
+        client.get('/test/too-many-selects')
+
+
+def test_budget_only_logs_outside_testing(app, client, product, caplog):
+    from app import db
+    from models import Product
+
+    @app.route('/test/over-budget')
+    @select_budget(0)
+    def over_budget():
+        db.session.get(Product, product)
+        return 'ok'
+
+    app.config['TESTING'] = False
+    assert client.get('/test/over-budget').status_code == 200
+    assert 'issued 1 SELECT statements (budget 0)' in caplog.text
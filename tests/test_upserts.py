@@ -0,0 +1,100 @@
+import uuid
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.exc import IntegrityError
+
+import upserts
+from upserts import ensure_unique_index, insert_ignore, insert_missing, upsert
+
+metadata = MetaData()
+counters = Table(
+    'test_counters', metadata,
+    Column('name', String(20), primary_key=True),
+    Column('hits', Integer, nullable=False),
+    Column('label', String(20)),
+)
+
+
+@pytest.fixture(params=['on_conflict', 'fallback'])
+def db(app, request, monkeypatch):
+    """The session with a fresh counters table, on the dialect's ON CONFLICT path and on the generic fallback"""
+    from app import db
+    if request.param == 'fallback':
+        monkeypatch.setattr(upserts, '_ON_CONFLICT_INSERTS', {})
+    with app.app_context():
+        metadata.create_all(db.engine)
+        yield db
+
+
+def rows(db):
+    return {name: (hits, label) for name, hits, label in db.session.execute(select(counters)).all()}
+
+
+def test_upsert_inserts_then_overwrites(db):
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 1, 'label': 'first'}])
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 5, 'label': 'second'}, {'name': 'b', 'hits': 2, 'label': 'b'}])
+    assert rows(db) == {'a': (5, 'second'), 'b': (2, 'b')}
+
+
+def test_upsert_increment_adds_to_existing_rows(db):
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 1}], increment=True)
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 3}], increment=True)
+    assert rows(db) == {'a': (4, None)}
+
+
+def test_upsert_only_touches_the_update_columns(db):
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 1, 'label': 'kept'}])
+    upsert(counters, ['name'], [{'name': 'a', 'hits': 7, 'label': 'ignored'}], update=['hits'])
+    assert rows(db) == {'a': (7, 'kept')}
+
+
+def test_upsert_runs_on_a_given_connection(db):
+    with db.engine.begin() as connection:
+        upsert(counters, ['name'], [{'name': 'a', 'hits': 1}], connection=connection)
+        upsert(counters, ['name'], [{'name': 'a', 'hits': 1}], increment=True, connection=connection)
+    assert rows(db) == {'a': (2, None)}
+
+
+def test_insert_missing_keeps_existing_rows(db):
+    insert_missing(counters, ['name'], [{'name': 'a', 'hits': 1, 'label': 'old'}])
+    insert_missing(counters, ['name'], [{'name': 'a', 'hits': 9, 'label': 'new'}, {'name': 'b', 'hits': 2, 'label': 'new'}])
+    insert_missing(counters, ['name'], [])
+    assert rows(db) == {'a': (1, 'old'), 'b': (2, 'new')}
+
+
+def test_insert_ignore_skips_rows_that_clash(db):
+    insert_missing(counters, ['name'], [{'name': 'a', 'hits': 1, 'label': 'old'}])
+    source = select(counters.c.name + '2', counters.c.hits, counters.c.label)
+    assert insert_ignore(counters, ['name'], ['name', 'hits', 'label'], source) == 1
+    assert rows(db) == {'a': (1, 'old'), 'a2': (1, 'old')}
+
+
+def test_insert_ignore_inserts_nothing_on_a_clash(db):
+    insert_missing(counters, ['name'], [{'name': 'a', 'hits': 1, 'label': 'old'}])
+    source = select(counters.c.name, counters.c.hits + 1, counters.c.label)
+    assert insert_ignore(counters, ['name'], ['name', 'hits', 'label'], source) == 0
+    assert rows(db) == {'a': (1, 'old')}
+
+
+def test_ensure_unique_index_removes_duplicates_keeping_the_oldest(app, product):
+    from app import db
+    from models import Cart, User
+    with app.app_context():
+        user = User(id=str(uuid.uuid4()), name='Customer', email=f'{uuid.uuid4().hex}@test.local',
+                    password_hash='-', role='customer', is_active=True)
+        db.session.add(user)
+        db.session.commit()
+        index = next(index for index in Cart.__table__.indexes if index.name == 'ux_cart_user_product')
+        index.drop(db.engine)  # A cart table from before the unique index
+        db.session.add_all([Cart(user_id=user.id, product_id=product, quantity=quantity) for quantity in (1, 2, 3)])
+        db.session.commit()
+        oldest = min(cart.id for cart in Cart.query.filter_by(user_id=user.id))
+
+        assert ensure_unique_index(Cart, 'ux_cart_user_product')
+        assert [(cart.id, cart.quantity) for cart in Cart.query.filter_by(user_id=user.id)] == [(oldest, 1)]
+        assert not ensure_unique_index(Cart, 'ux_cart_user_product')  # Already there
+        db.session.add(Cart(user_id=user.id, product_id=product, quantity=1))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
@@ -0,0 +1,100 @@
+from sqlalchemy import delete, func, inspect, select, true
+from sqlalchemy import update as update_stmt
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app import db
+
+# Dialect-aware INSERT ... ON CONFLICT helpers. Postgres and SQLite get a single
+# statement; other databases fall back to UPDATE-then-INSERT / a savepoint.
+
+_ON_CONFLICT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _dialect(connection=None):
+    return (connection if connection is not None else db.session.get_bind()).dialect.name
+
+
+def _execute(connection):
+    return connection.execute if connection is not None else db.session.execute
+
+
+def upsert(table, key, rows, increment=False, update=None, connection=None):
+    """Insert ``rows``, or update the existing rows that share their ``key`` columns.
+
+    ``rows`` is a list of dicts with the same keys; the ``update`` columns (by
+    default every non-key column) are overwritten, or added to when
+    ``increment`` is set. ``key`` must match a primary key or unique index.
+    Runs on ``connection`` when given (e.g. inside a flush), else on the session.
+    """
+    if not rows:
+        return
+    execute = _execute(connection)
+    values = update if update is not None else [name for name in rows[0] if name not in key]
+    insert = _ON_CONFLICT_INSERTS.get(_dialect(connection))
+    if insert is not None:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[name] for name in key],
+            set_={name: (table.c[name] + stmt.excluded[name]) if increment else stmt.excluded[name] for name in values},
+        )
+        execute(stmt, rows)
+        return
+
+    for row in rows:
+        condition = [table.c[name] == row[name] for name in key]
+        changes = {name: (table.c[name] + row[name]) if increment else row[name] for name in values}
+        result = execute(update_stmt(table).where(*condition).values(changes))
+        if result.rowcount == 0:
+            execute(table.insert().values(**row))
+
+
+def insert_ignore(table, key, columns, query):
+    """INSERT INTO table (columns) <query> skipping rows that clash on ``key``; returns rows inserted"""
+    insert = _ON_CONFLICT_INSERTS.get(_dialect())
+    if insert is not None:
+        # SQLite cannot parse INSERT ... SELECT ... ON CONFLICT unless the SELECT has a WHERE clause
+        stmt = insert(table).from_select(columns, query.where(true())).on_conflict_do_nothing(
+            index_elements=[table.c[name] for name in key]
+        )
+        return db.session.execute(stmt).rowcount
+
+    try:
+        with db.session.begin_nested():
+            return db.session.execute(table.insert().from_select(columns, query)).rowcount
+    except IntegrityError:
+        return 0
+
+
+def insert_missing(table, key, rows):
+    """Insert the ``rows`` whose ``key`` columns are not taken yet, in one statement where supported"""
+    if not rows:
+        return
+    insert = _ON_CONFLICT_INSERTS.get(_dialect())
+    if insert is not None:
+        db.session.execute(insert(table).values(rows).on_conflict_do_nothing(
+            index_elements=[table.c[name] for name in key]
+        ))
+        return
+
+    existing = set(db.session.execute(
+        select(*[table.c[name] for name in key]).where(table.c[key[0]].in_({row[key[0]] for row in rows}))
+    ).all())
+    missing = [row for row in rows if tuple(row[name] for name in key) not in existing]
+    if missing:
+        db.session.execute(table.insert(), missing)
+
+
+def ensure_unique_index(model, index_name):
+    """Create a unique index declared on ``model`` if the table predates it; returns True if created.
+
+    Duplicate rows (same indexed columns) are removed first, keeping the oldest.
+    """
+    bind = db.session.get_bind()
+    if index_name in {index['name'] for index in inspect(bind).get_indexes(model.__tablename__)}:
+        return False
+    index = next(index for index in model.__table__.indexes if index.name == index_name)
+    oldest = select(func.min(model.id)).group_by(*index.columns)
+    db.session.execute(delete(model).where(model.id.not_in(oldest)))
+    db.session.commit()
+    index.create(bind)
+    return True
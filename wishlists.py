@@ -0,0 +1,52 @@
+from flask import current_app
+from app import db
+from models import Wishlist
+from metrics import count_cache
+from replicas import primary_reads
+
+# Per-user sets of wishlisted product ids, kept in the same shared key/value
+# store as the carts so every worker sees an invalidation at once. A marker
+# member distinguishes "cached, empty" from "not cached".
+
+LOADED_MEMBER = '_loaded'
+
+
+class WishlistIds:
+    """Cached ``frozenset`` of product ids on each user's wishlist"""
+
+    def __init__(self, store, ttl=3600):
+        self.store = store
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(user_id):
+        return f'wishlist:{user_id}'
+
+    def get(self, user_id):
+        key = self._key(user_id)
+        members = self.store.smembers(key)
+        count_cache('wishlist', LOADED_MEMBER in members)
+        if LOADED_MEMBER not in members:
+            with primary_reads():  # The set is cached for an hour; never fill it from a lagging replica
+                product_ids = [product_id for (product_id,) in
+                               db.session.query(Wishlist.product_id).filter(Wishlist.user_id == user_id)]
+            self.store.sadd(key, LOADED_MEMBER, *product_ids)
+            self.store.expire(key, self.ttl)
+            return frozenset(product_ids)
+        return frozenset(int(member) for member in members if member != LOADED_MEMBER)
+
+    def invalidate(self, user_id):
+        """Drop the cached set; call after the wishlist change is committed"""
+        self.store.delete(self._key(user_id))
+
+
+def get_wishlist_ids(user_id):
+    return current_app.extensions['wishlist_ids'].get(user_id)
+
+
+def invalidate_wishlist_ids(user_id):
+    current_app.extensions['wishlist_ids'].invalidate(user_id)
+
+
+def init_wishlists(app):
+    app.extensions['wishlist_ids'] = WishlistIds(app.extensions['kv_store'], ttl=app.config['WISHLIST_CACHE_TTL'])